@@ -1,6 +1,6 @@
 import os
+import httpx
 import openai
-import requests
 try:
     # Shim: align Litellm's expected OpenAI type name with current OpenAI SDK
     # Older Litellm versions import `ResponseTextConfig`, which was renamed to
@@ -343,7 +343,8 @@ class LiteLLMAIHandler(BaseAiHandler):
             if img_path:
                 try:
                     # check if the image link is alive
-                    r = requests.head(img_path, allow_redirects=True)
+                    async with httpx.AsyncClient(follow_redirects=True) as client:
+                        r = await client.head(img_path)
                     if r.status_code == 404:
                         error_msg = f"The image link is not [alive](img_path).\nPlease repost the original image as a comment, and send the question again with 'quote reply' (see [instructions](https://pr-agent-docs.codium.ai/tools/ask/#ask-on-images-using-the-pr-code-as-context))."
                         get_logger().error(error_msg)
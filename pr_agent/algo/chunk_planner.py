@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+
+
+@dataclass
+class PatchPiece:
+    """The patch of a file, or of some of its hunks (if the file does not fit in one call), to place in a chunk"""
+    filename: str
+    text: str
+    tokens: int
+    order: int  # position of the file in the diff
+    part: int = 0  # position of the piece in its file, if the file was split by hunks
+
+
+@dataclass(eq=False)
+class Chunk:
+    """The patches sent in one call to the model"""
+    capacity: int
+    pieces: list[PatchPiece] = field(default_factory=list)
+    tokens: int = 0
+
+    def fits(self, piece: PatchPiece) -> bool:
+        return self.tokens + piece.tokens <= self.capacity
+
+    def add(self, piece: PatchPiece):
+        self.pieces.append(piece)
+        self.tokens += piece.tokens
+
+    def sorted_pieces(self) -> list[PatchPiece]:
+        """The pieces in diff order (the order in which they were placed is by size)"""
+        return sorted(self.pieces, key=lambda piece: (piece.order, piece.part))
+
+    def filenames(self) -> list[str]:
+        return list(dict.fromkeys(piece.filename for piece in self.sorted_pieces()))
+
+    def render(self) -> str:
+        return "\n".join(piece.text for piece in self.sorted_pieces())
+
+
+@dataclass
+class ChunkPlan:
+    capacity: int  # tokens available for the patches in each call
+    chunks: list[Chunk] = field(default_factory=list)
+    unplaced: list[PatchPiece] = field(default_factory=list)  # pieces that did not fit in the allowed calls
+
+    def stats(self) -> dict:
+        """Packing efficiency: tokens used vs. available in each call"""
+        used_tokens = [chunk.tokens for chunk in self.chunks]
+        available_tokens = self.capacity * len(self.chunks)
+        return {
+            "calls": len(self.chunks),
+            "capacity": self.capacity,
+            "used_tokens": used_tokens,
+            "efficiency": [round(tokens / self.capacity, 3) for tokens in used_tokens] if self.capacity > 0 else [],
+            "total_efficiency": round(sum(used_tokens) / available_tokens, 3) if available_tokens > 0 else 0.0,
+            "unplaced_pieces": len(self.unplaced),
+            "unplaced_tokens": sum(piece.tokens for piece in self.unplaced),
+        }
+
+
+class _ChunkPacker:
+    """Places pieces in the first chunk they fit in, preferably one that already holds a piece of the same file"""
+
+    def __init__(self, capacity: int, max_chunks: int):
+        self.capacity = capacity
+        self.max_chunks = max_chunks
+        self.chunks: list[Chunk] = []
+        self.chunks_by_file: dict[str, list[Chunk]] = {}
+
+    def place(self, piece: PatchPiece, allow_new_chunk: bool = True) -> bool:
+        same_file_chunks = self.chunks_by_file.get(piece.filename, [])
+        chunk = next((chunk for chunk in same_file_chunks if chunk.fits(piece)), None)
+        if chunk is None:
+            chunk = next((chunk for chunk in self.chunks if chunk.fits(piece)), None)
+        if chunk is None:
+            if not allow_new_chunk or len(self.chunks) >= self.max_chunks:
+                return False
+            chunk = Chunk(capacity=self.capacity)
+            self.chunks.append(chunk)
+        chunk.add(piece)
+        if chunk not in same_file_chunks:
+            self.chunks_by_file.setdefault(piece.filename, []).append(chunk)
+        return True
+
+
+def _first_fit_decreasing(pieces: list[PatchPiece], capacity: int, max_chunks: int) \
+        -> tuple[_ChunkPacker, list[PatchPiece]]:
+    packer = _ChunkPacker(capacity, max_chunks)
+    unplaced = [piece for piece in sorted(pieces, key=lambda piece: (-piece.tokens, piece.order, piece.part))
+                if not packer.place(piece)]
+    return packer, unplaced
+
+
+def plan_chunks(pieces: list[PatchPiece], capacity: int, max_chunks: int) -> ChunkPlan:
+    """
+    Packs the pieces into at most 'max_chunks' chunks of 'capacity' tokens, with first-fit decreasing: the largest
+    pieces are placed first, each in the first chunk it fits in, and a new chunk is opened only when it fits in none.
+    A piece of a split file is placed preferably in a chunk that already holds another piece of the same file.
+
+    If not all the pieces fit in 'max_chunks' chunks, the pieces that are dropped follow the diff order (the priority
+    of the files): the longest run of pieces in diff order that fits is packed, and the next pieces only fill the
+    space left in its chunks.
+
+    Pieces larger than 'capacity' are never placed (they should be split or clipped by the caller).
+    """
+    plan = ChunkPlan(capacity=capacity)
+    plan.unplaced = [piece for piece in pieces if piece.tokens > capacity]
+    pieces = [piece for piece in pieces if piece.tokens <= capacity]
+    packer, unplaced = _first_fit_decreasing(pieces, capacity, max_chunks)
+    if unplaced:
+        by_priority = sorted(pieces, key=lambda piece: (piece.order, piece.part))
+        # the longest prefix that fits, by bisection (a prefix of 0 pieces fits, all the pieces do not)
+        fitting, not_fitting = 0, len(by_priority)
+        while not_fitting - fitting > 1:
+            middle = (fitting + not_fitting) // 2
+            if _first_fit_decreasing(by_priority[:middle], capacity, max_chunks)[1]:
+                not_fitting = middle
+            else:
+                fitting = middle
+        packer, _ = _first_fit_decreasing(by_priority[:fitting], capacity, max_chunks)
+        unplaced = [piece for piece in by_priority[fitting:] if not packer.place(piece, allow_new_chunk=False)]
+    plan.chunks = packer.chunks
+    plan.unplaced.extend(unplaced)
+
+    # calls in diff order, by their first piece
+    plan.chunks.sort(key=lambda chunk: min((piece.order, piece.part) for piece in chunk.pieces))
+    return plan
@@ -1,4 +1,9 @@
+import json
 from typing import Dict, Optional
+
+from github import UnknownObjectException
+
+from pr_agent.git_providers.blob_cache import BlobCache, get_blob_cache
 from pr_agent.log import get_logger
 
 
@@ -17,9 +22,10 @@ class CursorRulesHandler:
         """Load official Cursor rules from the repository."""
         if not branch:
             try:
-                # Use branch name first, fallback to SHA if needed, then 'main'
+                # Use the head commit SHA first (immutable, so the rules can be served from the blob cache),
+                # fallback to the branch name if needed, then 'main'
                 if hasattr(self.git_provider, 'pr') and self.git_provider.pr:
-                    branch = getattr(self.git_provider.pr.head, 'ref', None) or self.git_provider.pr.head.sha
+                    branch = getattr(self.git_provider.pr.head, 'sha', None) or self.git_provider.pr.head.ref
                 else:
                     branch = 'main'
             except (AttributeError, Exception):
@@ -62,36 +68,22 @@ class CursorRulesHandler:
         try:
             # Check if git provider supports directory listing (currently GitHub only)
             if hasattr(self.git_provider, '_get_repo'):
-                # NOTE: Using private method _get_repo() for GitHub-specific directory listing
-                # This is the only way to access repository contents beyond individual files
-                # We fallback gracefully for other providers that don't support this
-                repo = self.git_provider._get_repo()
-                directory_contents = repo.get_contents(self.CURSOR_RULES_DIR, ref=branch)
-                
-                # Filter for .mdc files
-                mdc_files = []
-                if isinstance(directory_contents, list):
-                    # Multiple files in directory
-                    mdc_files = [f for f in directory_contents if f.name.endswith('.mdc')]
-                else:
-                    # Single file
-                    if directory_contents.name.endswith('.mdc'):
-                        mdc_files = [directory_contents]
+                mdc_files = self._list_mdc_files(branch)
                 
                 get_logger().info(f"🔍 Found {len(mdc_files)} .mdc file(s) in {self.CURSOR_RULES_DIR}")
                 
                 # Load each .mdc file
-                for file_obj in mdc_files:
+                for file_path in mdc_files:
                     try:
-                        content = self.git_provider.get_pr_file_content(file_obj.path, branch)
+                        content = self.git_provider.get_pr_file_content(file_path, branch)
                         if content and content.strip():
-                            get_logger().info(f"✅ Loaded Cursor rules from: {file_obj.path}")
+                            get_logger().info(f"✅ Loaded Cursor rules from: {file_path}")
                             content_parts.append(content.strip())
-                            loaded_files.append(file_obj.path)
+                            loaded_files.append(file_path)
                         else:
-                            get_logger().debug(f"Empty content in {file_obj.path}")
+                            get_logger().debug(f"Empty content in {file_path}")
                     except Exception as e:
-                        get_logger().debug(f"Failed to load {file_obj.path}: {e}")
+                        get_logger().debug(f"Failed to load {file_path}: {e}")
                         continue
             else:
                 # Provider doesn't support directory listing, skip to fallback
@@ -103,6 +95,35 @@ class CursorRulesHandler:
 
         return "\n\n".join(content_parts) if content_parts else None, loaded_files
     
+    def _list_mdc_files(self, branch: str) -> list[str]:
+        """List the paths of the .mdc files in .cursor/rules/, reading through the blob cache when possible."""
+        blob_cache = get_blob_cache()
+        cache_key = BlobCache.make_key(getattr(self.git_provider, 'repo', None), ref=branch,
+                                       path=f"{self.CURSOR_RULES_DIR}/") if blob_cache else None
+        if cache_key:
+            cached_listing = blob_cache.get(cache_key)
+            if cached_listing is not None:
+                return json.loads(cached_listing)
+
+        # NOTE: Using private method _get_repo() for GitHub-specific directory listing
+        # This is the only way to access repository contents beyond individual files
+        # We fallback gracefully for other providers that don't support this
+        repo = self.git_provider._get_repo()
+        try:
+            directory_contents = repo.get_contents(self.CURSOR_RULES_DIR, ref=branch)
+        except UnknownObjectException:
+            directory_contents = []  # no rules directory at this commit
+
+        # Filter for .mdc files
+        if not isinstance(directory_contents, list):
+            # Single file
+            directory_contents = [directory_contents]
+        mdc_files = [f.path for f in directory_contents if f.name.endswith('.mdc')]
+
+        if cache_key:
+            blob_cache.put(cache_key, json.dumps(mdc_files))
+        return mdc_files
+
     def _load_legacy_file(self, branch: str) -> Optional[str]:
         """Load legacy .cursorrules file."""
         if not hasattr(self.git_provider, 'get_pr_file_content'):
@@ -0,0 +1,125 @@
+import mmap
+import sys
+import tempfile
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class SpilledContent:
+    """A file content written to the spill file of a DiffContentStore, read back (and decoded) on each access"""
+    __slots__ = ("store", "offset", "length")
+
+    def __init__(self, store: "DiffContentStore", offset: int, length: int):
+        self.store = store
+        self.offset = offset
+        self.length = length
+
+    def read(self) -> str:
+        return self.store.read(self)
+
+
+class DiffContentStore:
+    """
+    Holds the file contents of the diff files of a request (see LazyFilePatchInfo) within a memory budget. Contents
+    are kept in memory until they total 'max_memory_bytes' (in UTF-8 bytes); the next ones are appended to an
+    anonymous temporary file instead, and are decoded from a memory map of it (through memoryview slices, without an
+    intermediate bytes copy) each time they are accessed. A monorepo PR with thousands of files therefore does not
+    keep all its file contents alive in the worker, only the ones being used.
+    """
+
+    def __init__(self, max_memory_bytes: int):
+        self.max_memory_bytes = max_memory_bytes
+        self.memory_bytes = 0  # size of the contents kept in memory
+        self.spilled_bytes = 0  # size of the spill file
+        self.num_spilled = 0
+        self.num_reads = 0
+        self._lock = Lock()
+        self._spill_file = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._initial_max_rss_kb = _get_max_rss_kb()
+
+    def put(self, content):
+        """Returns the content to keep in a diff file: the content itself, or a SpilledContent if over the budget"""
+        if not isinstance(content, str) or not content:
+            return content
+        # the budget is in UTF-8 bytes (the size of an ASCII content is its length, without encoding it)
+        data = None if content.isascii() else content.encode("utf-8", errors="surrogatepass")
+        size = len(content) if data is None else len(data)
+        with self._lock:
+            if self.memory_bytes + size <= self.max_memory_bytes:
+                self.memory_bytes += size
+                return content
+            if data is None:
+                data = content.encode("utf-8", errors="surrogatepass")
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix="pr_agent_diff_contents_")
+            self._spill_file.seek(0, 2)
+            self._spill_file.write(data)
+            spilled_content = SpilledContent(self, self.spilled_bytes, len(data))
+            self.spilled_bytes += len(data)
+            self.num_spilled += 1
+            return spilled_content
+
+    def read(self, spilled_content: SpilledContent) -> str:
+        with self._lock:
+            self.num_reads += 1
+            end = spilled_content.offset + spilled_content.length
+            if self._mmap is None or len(self._mmap) < end:  # map the contents written since the last read
+                self._spill_file.flush()
+                if self._mmap is not None:
+                    self._mmap.close()
+                self._mmap = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+            with memoryview(self._mmap)[spilled_content.offset:end] as data:
+                return str(data, "utf-8", errors="surrogatepass")
+
+    def stats(self) -> dict:
+        """Memory and spill statistics of the request, with the growth of the peak RSS of the process during it"""
+        max_rss_kb = _get_max_rss_kb()
+        with self._lock:
+            return {"memory_mb": round(self.memory_bytes / 2 ** 20, 1),
+                    "max_memory_mb": round(self.max_memory_bytes / 2 ** 20, 1),
+                    "spilled_mb": round(self.spilled_bytes / 2 ** 20, 1),
+                    "spilled_contents": self.num_spilled,
+                    "spilled_reads": self.num_reads,
+                    "peak_rss_mb": round(max_rss_kb / 1024, 1),
+                    "peak_rss_growth_mb": round((max_rss_kb - self._initial_max_rss_kb) / 1024, 1)}
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _get_max_rss_kb() -> int:
+    if resource is None:
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss // 1024 if sys.platform == "darwin" else max_rss  # bytes on macOS, kilobytes on Linux
+
+
+def create_diff_content_store() -> Optional[DiffContentStore]:
+    """
+    Returns a new content store for the diff files of a request, or None if their contents are not limited
+    ('config.diff_contents_memory_budget_mb' is 0).
+    """
+    budget_mb = float(get_settings().get("CONFIG.DIFF_CONTENTS_MEMORY_BUDGET_MB", 0) or 0)
+    if budget_mb <= 0:
+        return None
+    return DiffContentStore(int(budget_mb * 2 ** 20))
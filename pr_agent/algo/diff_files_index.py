@@ -0,0 +1,144 @@
+import re
+from array import array
+from threading import Lock
+from typing import Optional
+
+from starlette_context import context
+
+from pr_agent.algo.patch_line_locator import PatchLineLocator
+from pr_agent.algo.types import FilePatchInfo, LazyFilePatchInfo
+
+# the line boundaries of str.splitlines()
+_RE_LINE_BREAK = re.compile(r"\r\n|[\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029]")
+
+
+class FileLines:
+    """
+    The lines of a file content, as in content.splitlines(), without materializing them: the offsets of the lines are
+    computed on first access, and a line (or a slice of lines) is cut from the content when it is read.
+    """
+    __slots__ = ("source", "content", "_starts", "_ends", "_lines")
+
+    def __init__(self, content, source=None):
+        self.source = content if source is None else source  # identifies the content the lines were computed from
+        self.content = content or ""
+        self._starts = self._ends = None
+        self._lines = None  # for non-str contents (bytes), the lines themselves
+
+    def _build(self):
+        if not isinstance(self.content, str):
+            self._lines = self.content.splitlines()
+            self._starts = self._ends = array("Q")
+            return
+        starts = array("Q", [0])
+        ends = array("Q")
+        for match in _RE_LINE_BREAK.finditer(self.content):
+            ends.append(match.start())
+            starts.append(match.end())
+        if starts[-1] == len(self.content):  # no last line after a final line break (or an empty content)
+            starts.pop()
+        else:
+            ends.append(len(self.content))
+        self._starts, self._ends = starts, ends
+
+    def __len__(self) -> int:
+        if self._starts is None:
+            self._build()
+        return len(self._lines) if self._lines is not None else len(self._starts)
+
+    def __getitem__(self, item):
+        """A line (str) by index, or the lines (list of str) of a slice, with the semantics of list indexing"""
+        if self._starts is None:
+            self._build()
+        if self._lines is not None:
+            return self._lines[item]
+        if isinstance(item, slice):
+            return [self.content[self._starts[i]:self._ends[i]] for i in range(len(self._starts))[item]]
+        i = range(len(self._starts))[item]  # raises IndexError like a list
+        return self.content[self._starts[i]:self._ends[i]]
+
+
+class DiffFilesIndex:
+    """
+    The diff files of a PR, indexed by (stripped) filename, with line access to their head and base contents (see
+    FileLines) and a line locator of their patches (see PatchLineLocator). Replaces the scans of the diff files for a
+    filename, and the splitlines() of whole files, of the code that post-processes the model output of each file.
+    """
+
+    def __init__(self, diff_files: list[FilePatchInfo]):
+        self.diff_files = diff_files
+        self.num_files = len(diff_files)
+        self._files: dict[str, FilePatchInfo] = {}
+        for file in diff_files:
+            if file.filename:
+                self._files.setdefault(file.filename.strip(), file)  # the first file wins, as in a scan
+        self._lock = Lock()
+        self._lines: dict[tuple, FileLines] = {}
+        self._locators: dict[str, PatchLineLocator] = {}
+
+    def get_file(self, filename: str) -> Optional[FilePatchInfo]:
+        """The file whose stripped name is 'filename', or None"""
+        return self._files.get(filename)
+
+    def head_lines(self, file: FilePatchInfo) -> FileLines:
+        return self._get_lines(file, "head")
+
+    def base_lines(self, file: FilePatchInfo) -> FileLines:
+        return self._get_lines(file, "base")
+
+    def line_locator(self, file: FilePatchInfo) -> PatchLineLocator:
+        with self._lock:
+            locator = self._locators.get(file.filename)
+            if locator is None or locator.patch is not file.patch:  # the patch of the file was replaced
+                locator = self._locators[file.filename] = PatchLineLocator(file.patch)
+            return locator
+
+    def _get_lines(self, file: FilePatchInfo, side: str) -> FileLines:
+        content = None
+        if isinstance(file, LazyFilePatchInfo):
+            # the lines are keyed on the stored content: a spilled content is decoded to a new str on each access
+            if not file.is_loaded(side):
+                content = getattr(file, f"{side}_file")
+            source = file.get_content_source(side)
+        else:
+            content = source = getattr(file, f"{side}_file")
+        key = (file.filename, side)
+        with self._lock:
+            lines = self._lines.get(key)
+            if lines is None or lines.source is not source:  # the content of the file was replaced
+                if content is None:
+                    content = getattr(file, f"{side}_file")
+                lines = self._lines[key] = FileLines(content, source)
+            return lines
+
+
+class _LastDiffFilesIndex:
+    index: Optional[DiffFilesIndex] = None  # outside of a request (e.g. CLI), the index of the last list
+    lock = Lock()
+
+
+def get_diff_files_index(diff_files: list[FilePatchInfo]) -> DiffFilesIndex:
+    """
+    Returns the index of a list of diff files. The index of the same list is built only once, and is rebuilt if
+    files were added to or removed from the list. It is kept with the diff files of the request (in the request
+    context), so it is released with them; outside of a request, only the index of the last list is kept.
+    """
+    if isinstance(diff_files, DiffFilesIndex):
+        return diff_files
+    if not diff_files:
+        return DiffFilesIndex([])
+    try:
+        index = context.get("diff_files_index", None)
+        in_request = True
+    except Exception:  # no request context
+        index = _LastDiffFilesIndex.index
+        in_request = False
+    if index is not None and index.diff_files is diff_files and index.num_files == len(diff_files):
+        return index
+    with _LastDiffFilesIndex.lock:
+        index = DiffFilesIndex(diff_files)
+        if in_request:
+            context["diff_files_index"] = index
+        else:
+            _LastDiffFilesIndex.index = index
+        return index
@@ -1,12 +1,117 @@
 from __future__ import annotations
 
+import multiprocessing
+import os
 import re
 import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from typing import Iterator
 
-from pr_agent.algo.types import EDIT_TYPE, FilePatchInfo
+from pr_agent.algo.types import EDIT_TYPE, FilePatchInfo, load_file_contents
 from pr_agent.config_loader import get_settings
 from pr_agent.log import get_logger
 
+RE_HUNK_HEADER = re.compile(
+    r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+
+
+class PatchHunk:
+    """
+    A hunk of a parsed patch. 'header_index' is the index of its header in the patch lines, and its body ends before
+    'end_index' (the next hunk header, or the end of the patch). Missing sizes are 0, as in extract_hunk_headers.
+    """
+    __slots__ = ("header_index", "end_index", "start1", "size1", "start2", "size2", "section_header", "has_additions")
+
+    def __init__(self, header_index: int, start1: int, size1: int, start2: int, size2: int, section_header: str):
+        self.header_index = header_index
+        self.end_index = header_index + 1
+        self.start1 = start1
+        self.size1 = size1
+        self.start2 = start2
+        self.size2 = size2
+        self.section_header = section_header
+        self.has_additions = False  # whether the hunk has '+' lines
+
+    def header_values(self) -> tuple:
+        """Same values, in the same order, as extract_hunk_headers"""
+        return self.section_header, self.size1, self.size2, self.start1, self.start2
+
+
+class ParsedPatch:
+    """
+    A patch split into lines, with its hunk headers parsed, in a single pass. It is shared (see parse_patch) by all
+    the functions that walk the same patch, instead of each splitting it and matching the headers again.
+    """
+    __slots__ = ("lines", "hunks", "hunk_by_line")
+
+    def __init__(self, lines: list[str]):
+        self.lines = lines
+        self.hunks: list[PatchHunk] = []
+        self.hunk_by_line: dict[int, PatchHunk] = {}  # index of a (valid) hunk header line -> hunk
+        hunk = None
+        for i, line in enumerate(lines):
+            if line.startswith('@@'):
+                match = RE_HUNK_HEADER.match(line)
+                if match:
+                    start1, size1, start2, size2, section_header = match.groups()
+                    hunk = PatchHunk(i, int(start1), int(size1 or 0), int(start2), int(size2 or 0), section_header)
+                    self.hunks.append(hunk)
+                    self.hunk_by_line[i] = hunk
+                    continue
+            if hunk is not None:
+                hunk.end_index = i + 1
+                if line.startswith('+'):
+                    hunk.has_additions = True
+
+
+class _ParsedPatchCache:
+    """
+    The last parsed patches, so the functions that walk the same patch during a request share its parse. Bounded by
+    the total length of the cached patches (each patch is also held as lines, so the memory used is about twice its
+    length), so that large patches are not kept long after their request.
+    """
+    max_entries = 512
+    max_size = 4 * 2 ** 20  # characters
+    size = 0
+    entries: OrderedDict = OrderedDict()  # patch -> parsed patch, least recently used first
+    lock = Lock()
+
+
+def parse_patch(patch: str) -> ParsedPatch:
+    """Parses a patch once: the same patch string is parsed again only after it was evicted from the cache"""
+    with _ParsedPatchCache.lock:
+        parsed_patch = _ParsedPatchCache.entries.get(patch)
+        if parsed_patch is not None:
+            _ParsedPatchCache.entries.move_to_end(patch)
+            return parsed_patch
+    parsed_patch = ParsedPatch(patch.splitlines())
+    if len(patch) > _ParsedPatchCache.max_size // 8:  # a large patch would evict many others
+        return parsed_patch
+    with _ParsedPatchCache.lock:
+        if patch not in _ParsedPatchCache.entries:
+            _ParsedPatchCache.entries[patch] = parsed_patch
+            _ParsedPatchCache.size += len(patch)
+            while len(_ParsedPatchCache.entries) > _ParsedPatchCache.max_entries or \
+                    _ParsedPatchCache.size > _ParsedPatchCache.max_size:
+                _ParsedPatchCache.size -= len(_ParsedPatchCache.entries.popitem(last=False)[0])
+    return parsed_patch
+
+
+def split_patch_by_hunks(patch: str) -> list[str]:
+    """
+    Splits a patch into one patch per hunk (lines before the first hunk header stay with the first hunk). Joining the
+    hunk patches with '\\n' gives back the lines of the patch.
+    """
+    parsed_patch = parse_patch(patch)
+    if len(parsed_patch.hunks) < 2:
+        return [patch]
+    starts = [0] + [hunk.header_index for hunk in parsed_patch.hunks[1:]]
+    ends = starts[1:] + [len(parsed_patch.lines)]
+    return ["\n".join(parsed_patch.lines[start:end]) for start, end in zip(starts, ends)]
+
 
 def extend_patch(original_file_str, patch_str, patch_extra_lines_before=0,
                  patch_extra_lines_after=0, filename: str = "", new_file_str="") -> str:
@@ -31,6 +136,126 @@ def extend_patch(original_file_str, patch_str, patch_extra_lines_before=0,
     return extended_patch_str
 
 
+def extend_patches(files: list, patch_extra_lines_before: int = 0, patch_extra_lines_after: int = 0) -> list[str]:
+    """
+    Same as extend_patch on the patch of each file (FilePatchInfo), in order.
+
+    When the file contents of the PR total at least 'config.patch_extension_pool_min_bytes', the files are extended on
+    a persistent pool of 'config.patch_extension_processes' worker processes (see get_patch_extension_pool), and the
+    files that are not extended on them within 'config.patch_extension_timeout_sec' are extended inline. Smaller PRs
+    are extended inline, since sending the file contents to the workers costs more than it saves.
+
+    Only the contents of the files that are extended are loaded (see LazyFilePatchInfo), together.
+    """
+    extended_files = [file for file in files if file.patch and (patch_extra_lines_before or patch_extra_lines_after)
+                      and not should_skip_patch(file.filename)]
+    load_file_contents(extended_files)
+    extended_files = {id(file) for file in extended_files}
+    inputs = [(file.base_file, file.patch, patch_extra_lines_before, patch_extra_lines_after, file.filename,
+               file.head_file) if id(file) in extended_files else
+              ("", file.patch, patch_extra_lines_before, patch_extra_lines_after, file.filename, "")
+              for file in files]
+    if extended_files:
+        min_bytes = int(get_settings().get("CONFIG.PATCH_EXTENSION_POOL_MIN_BYTES", 2_000_000))
+        total_bytes = sum(len(args[0] or "") + len(args[5] or "") for args in inputs)
+        pool = get_patch_extension_pool() if total_bytes >= min_bytes else None
+        if pool is not None:
+            try:
+                return _extend_patches_on_pool(pool, inputs)
+            except Exception as e:
+                get_logger().warning(f"Failed to extend patches on worker processes, extending them inline: {e}")
+    return [extend_patch(*args) for args in inputs]
+
+
+# the settings read by extend_patch, applied in the worker processes for each request
+_EXTENSION_SETTINGS = ("config.allow_dynamic_context", "config.max_extra_lines_before_dynamic_context",
+                       "config.patch_extension_skip_types")
+
+
+class _PatchExtensionPool:
+    instance: ProcessPoolExecutor | None = None
+    num_processes = 0
+    lock = Lock()
+
+
+def get_patch_extension_pool() -> ProcessPoolExecutor | None:
+    """
+    Returns the process-wide pool of patch extension workers, or None if it is disabled
+    ('config.patch_extension_processes' is below 2) or not supported on this platform.
+
+    The pool is created once per process, and its workers are forked from a 'forkserver' process: unlike a fork of
+    the (multi-threaded) server process, a worker never inherits a lock held by another thread at fork time.
+    """
+    num_processes = min(int(get_settings().get("CONFIG.PATCH_EXTENSION_PROCESSES", 0) or 0), os.cpu_count() or 1)
+    if num_processes <= 1 or "forkserver" not in multiprocessing.get_all_start_methods():
+        return None
+    with _PatchExtensionPool.lock:
+        if _PatchExtensionPool.instance is None or _PatchExtensionPool.num_processes != num_processes:
+            if _PatchExtensionPool.instance is not None:
+                _PatchExtensionPool.instance.shutdown(wait=False, cancel_futures=True)
+            mp_context = multiprocessing.get_context("forkserver")
+            mp_context.set_forkserver_preload([__name__])
+            _PatchExtensionPool.instance = ProcessPoolExecutor(max_workers=num_processes, mp_context=mp_context)
+            _PatchExtensionPool.num_processes = num_processes
+        return _PatchExtensionPool.instance
+
+
+def _discard_patch_extension_pool(pool: ProcessPoolExecutor):
+    """Shuts down a pool whose workers are stuck or broken, so that the next call creates a new one"""
+    with _PatchExtensionPool.lock:
+        if _PatchExtensionPool.instance is pool:
+            _PatchExtensionPool.instance = None
+    for process in list((getattr(pool, "_processes", None) or {}).values()):
+        try:
+            process.terminate()
+        except Exception:
+            pass
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+_worker_settings: dict = {}  # the settings last applied in a worker process
+
+
+def _extend_patches_in_worker(settings: dict, inputs: list) -> list[str]:
+    global _worker_settings
+    if settings != _worker_settings:  # setting them is slow, and they rarely change
+        for key, value in settings.items():
+            get_settings().set(key, value)
+        _worker_settings = settings
+    return [extend_patch(*args) for args in inputs]
+
+
+def _extend_patches_on_pool(pool: ProcessPoolExecutor, inputs: list) -> list[str]:
+    # only the files to extend are sent to the workers (with the settings of the request): the other patches are
+    # returned as is by extend_patch
+    settings = {key: get_settings().get(key) for key in _EXTENSION_SETTINGS}
+    timeout = float(get_settings().get("CONFIG.PATCH_EXTENSION_TIMEOUT_SEC", 60) or 0) or None
+    extended_indexes = [i for i, args in enumerate(inputs) if args[0]]
+    results = [extend_patch(*args) if not args[0] else None for args in inputs]
+    chunk_size = max(1, len(extended_indexes) // (_PatchExtensionPool.num_processes * 4))
+    chunks = [extended_indexes[start:start + chunk_size] for start in range(0, len(extended_indexes), chunk_size)]
+    futures = [pool.submit(_extend_patches_in_worker, settings, [inputs[i] for i in chunk]) for chunk in chunks]
+    _, not_done = wait(futures, timeout=timeout)
+    if not_done:
+        _discard_patch_extension_pool(pool)  # its workers may be stuck
+        get_logger().warning(f"{len(not_done)} of {len(futures)} batches of patches were not extended on worker "
+                             f"processes within {timeout} sec, extending them inline")
+    for chunk, future in zip(chunks, futures):
+        if future not in not_done:
+            try:
+                for i, extended_patch in zip(chunk, future.result()):
+                    results[i] = extended_patch
+                continue
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    _discard_patch_extension_pool(pool)
+                get_logger().warning(f"Failed to extend a batch of patches on a worker process, extending them "
+                                     f"inline: {e!r}")
+        for i in chunk:
+            results[i] = extend_patch(*inputs[i])
+    return results
+
+
 def decode_if_bytes(original_file_str):
     if isinstance(original_file_str, (bytes, bytearray)):
         try:
@@ -54,31 +279,31 @@ def should_skip_patch(filename):
 
 
 def process_patch_lines(patch_str, original_file_str, patch_extra_lines_before, patch_extra_lines_after, new_file_str=""):
-    allow_dynamic_context = get_settings().config.allow_dynamic_context
-    patch_extra_lines_before_dynamic = get_settings().config.max_extra_lines_before_dynamic_context
+    config = get_settings().config  # a settings lookup costs more than parsing a patch
+    allow_dynamic_context = config.allow_dynamic_context
+    patch_extra_lines_before_dynamic = config.max_extra_lines_before_dynamic_context
 
     file_original_lines = original_file_str.splitlines()
     file_new_lines = new_file_str.splitlines() if new_file_str else []
     len_original_lines = len(file_original_lines)
-    patch_lines = patch_str.splitlines()
+    parsed_patch = parse_patch(patch_str)
+    patch_lines = parsed_patch.lines
     extended_patch_lines = []
 
     is_valid_hunk = True
     start1, size1, start2, size2 = -1, -1, -1, -1
-    RE_HUNK_HEADER = re.compile(
-        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
     try:
         for i,line in enumerate(patch_lines):
             if line.startswith('@@'):
-                match = RE_HUNK_HEADER.match(line)
+                hunk = parsed_patch.hunk_by_line.get(i)
                 # identify hunk header
-                if match:
+                if hunk:
                     # finish processing previous hunk
                     if is_valid_hunk and (start1 != -1 and patch_extra_lines_after > 0):
                         delta_lines_original = [f' {line}' for line in file_original_lines[start1 + size1 - 1:start1 + size1 - 1 + patch_extra_lines_after]]
                         extended_patch_lines.extend(delta_lines_original)
 
-                    section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+                    section_header, size1, size2, start1, start2 = hunk.header_values()
 
                     is_valid_hunk = check_if_hunk_lines_matches_to_file(i, file_original_lines, patch_lines, start1)
 
@@ -234,34 +459,27 @@ def omit_deletion_hunks(patch_lines) -> str:
     - A string representing the modified patch with deletion hunks omitted
     """
 
-    temp_hunk = []
-    added_patched = []
-    add_hunk = False
-    inside_hunk = False
-    RE_HUNK_HEADER = re.compile(
-        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))?\ @@[ ]?(.*)")
-
-    for line in patch_lines:
-        if line.startswith('@@'):
-            match = RE_HUNK_HEADER.match(line)
-            if match:
-                # finish previous hunk
-                if inside_hunk and add_hunk:
-                    added_patched.extend(temp_hunk)
-                    temp_hunk = []
-                    add_hunk = False
-                temp_hunk.append(line)
-                inside_hunk = True
-        else:
-            temp_hunk.append(line)
-            if line:
-                edit_type = line[0]
-                if edit_type == '+':
-                    add_hunk = True
-    if inside_hunk and add_hunk:
-        added_patched.extend(temp_hunk)
-
-    return '\n'.join(added_patched)
+    return _omit_deletion_hunks(ParsedPatch(patch_lines))
+
+
+def _omit_deletion_hunks(parsed_patch: ParsedPatch) -> str:
+    # the hunks are kept up to the last one with added lines (lines before the first hunk belong to it), and the
+    # lines that look like an invalid hunk header are dropped
+    patch_lines = parsed_patch.lines
+    hunks = parsed_patch.hunks
+    if not hunks:
+        return ''
+    end_index = None
+    for hunk in reversed(hunks):
+        if hunk.has_additions:
+            end_index = hunk.end_index
+            break
+    if end_index is None and any(line.startswith('+') for line in patch_lines[:hunks[0].header_index]):
+        end_index = hunks[0].end_index
+    if end_index is None:
+        return ''
+    return '\n'.join(line for i, line in enumerate(patch_lines[:end_index])
+                     if not line.startswith('@@') or i in parsed_patch.hunk_by_line)
 
 
 def handle_patch_deletions(patch: str, original_file_content_str: str,
@@ -282,14 +500,13 @@ def handle_patch_deletions(patch: str, original_file_content_str: str,
         str: The modified patch with deletion hunks omitted.
 
     """
-    if not new_file_content_str and (edit_type == EDIT_TYPE.DELETED or edit_type == EDIT_TYPE.UNKNOWN):
+    if (edit_type == EDIT_TYPE.DELETED or edit_type == EDIT_TYPE.UNKNOWN) and not new_file_content_str:
         # logic for handling deleted files - don't show patch, just show that the file was deleted
         if get_settings().config.verbosity_level > 0:
             get_logger().info(f"Processing file: {file_name}, minimizing deletion file")
         patch = None # file was deleted
     else:
-        patch_lines = patch.splitlines()
-        patch_new = omit_deletion_hunks(patch_lines)
+        patch_new = _omit_deletion_hunks(parse_patch(patch))
         if patch != patch_new:
             if get_settings().config.verbosity_level > 0:
                 get_logger().info(f"Processing file: {file_name}, hunks were deleted")
@@ -297,6 +514,15 @@ def handle_patch_deletions(patch: str, original_file_content_str: str,
     return patch
 
 
+def handle_file_patch_deletions(file: FilePatchInfo, patch: str) -> str:
+    """
+    handle_patch_deletions of a file: its head content is needed (and loaded, see LazyFilePatchInfo) only if the file
+    may have been deleted.
+    """
+    may_be_deleted = file.edit_type == EDIT_TYPE.DELETED or file.edit_type == EDIT_TYPE.UNKNOWN
+    return handle_patch_deletions(patch, "", file.head_file if may_be_deleted else "", file.filename, file.edit_type)
+
+
 def decouple_and_convert_to_hunks_with_lines_numbers(patch: str, file) -> str:
     """
     Convert a given patch string into a string with line numbers for each hunk, indicating the new and old content of
@@ -329,20 +555,30 @@ __old hunk__
         line6
            ...
     """
+    return "".join(iter_hunks_with_lines_numbers(patch, file))
+
 
+def iter_hunks_with_lines_numbers(patch: str, file) -> Iterator[str]:
+    """
+    Yields the output of decouple_and_convert_to_hunks_with_lines_numbers lazily, one chunk per hunk (the file header
+    comes with the first hunk). The output is built in lists of strings, so it takes linear time in the size of the
+    patch; joining the chunks gives the same string.
+    """
     # Add a header for the file
     if file:
         # if the file was deleted, return a message indicating that the file was deleted
         if hasattr(file, 'edit_type') and file.edit_type == EDIT_TYPE.DELETED:
-            return f"\n\n## File '{file.filename.strip()}' was deleted\n"
+            yield f"\n\n## File '{file.filename.strip()}' was deleted\n"
+            return
 
-        patch_with_lines_str = f"\n\n## File: '{file.filename.strip()}'\n"
+        pieces = [f"\n\n## File: '{file.filename.strip()}'\n"]
     else:
-        patch_with_lines_str = ""
+        pieces = []
 
-    patch_lines = patch.splitlines()
-    RE_HUNK_HEADER = re.compile(
-        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+    # a chunk is held back until the next one starts, since the final rstrip() may reach into it
+    pending_chunk = ""
+    parsed_patch = parse_patch(patch)
+    patch_lines = parsed_patch.lines
     new_content_lines = []
     old_content_lines = []
     match = None
@@ -355,29 +591,21 @@ __old hunk__
 
         if line.startswith('@@'):
             header_line = line
-            match = RE_HUNK_HEADER.match(line)
+            match = parsed_patch.hunk_by_line.get(line_i)
             if match and (new_content_lines or old_content_lines):  # found a new hunk, split the previous lines
                 if prev_header_line:
-                    patch_with_lines_str += f'\n{prev_header_line}\n'
-                is_plus_lines = is_minus_lines = False
-                if new_content_lines:
-                    is_plus_lines = any([line.startswith('+') for line in new_content_lines])
-                if old_content_lines:
-                    is_minus_lines = any([line.startswith('-') for line in old_content_lines])
-                if is_plus_lines or is_minus_lines: # notice 'True' here - we always present __new hunk__ for section, otherwise LLM gets confused
-                    patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__new hunk__\n'
-                    for i, line_new in enumerate(new_content_lines):
-                        patch_with_lines_str += f"{start2 + i} {line_new}\n"
-                if is_minus_lines:
-                    patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__old hunk__\n'
-                    for line_old in old_content_lines:
-                        patch_with_lines_str += f"{line_old}\n"
+                    # the header ends the rstrip() of the hunk sections, so the previous chunk is complete
+                    if pending_chunk:
+                        yield pending_chunk
+                    pending_chunk = "".join(pieces)
+                    pieces = [f'\n{prev_header_line}\n']
+                _render_hunk_sections(pieces, new_content_lines, old_content_lines, start2)
                 new_content_lines = []
                 old_content_lines = []
             if match:
                 prev_header_line = header_line
 
-            section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+            section_header, size1, size2, start1, start2 = match.header_values()
 
         elif line.startswith('+'):
             new_content_lines.append(line)
@@ -394,36 +622,51 @@ __old hunk__
 
     # finishing last hunk
     if match and new_content_lines:
-        patch_with_lines_str += f'\n{header_line}\n'
-        is_plus_lines = is_minus_lines = False
-        if new_content_lines:
-            is_plus_lines = any([line.startswith('+') for line in new_content_lines])
-        if old_content_lines:
-            is_minus_lines = any([line.startswith('-') for line in old_content_lines])
-        if is_plus_lines or is_minus_lines:  # notice 'True' here - we always present __new hunk__ for section, otherwise LLM gets confused
-            patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__new hunk__\n'
-            for i, line_new in enumerate(new_content_lines):
-                patch_with_lines_str += f"{start2 + i} {line_new}\n"
-        if is_minus_lines:
-            patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__old hunk__\n'
-            for line_old in old_content_lines:
-                patch_with_lines_str += f"{line_old}\n"
-
-    return patch_with_lines_str.rstrip()
+        if pending_chunk:
+            yield pending_chunk
+        pending_chunk = "".join(pieces)
+        pieces = [f'\n{header_line}\n']
+        _render_hunk_sections(pieces, new_content_lines, old_content_lines, start2)
+
+    last_chunk = (pending_chunk + "".join(pieces)).rstrip()
+    if last_chunk:
+        yield last_chunk
+
+
+def _rstrip_pieces(pieces: list[str]):
+    """Same as rstrip() on the concatenation of the pieces, in place"""
+    while pieces:
+        stripped = pieces[-1].rstrip()
+        if stripped:
+            pieces[-1] = stripped
+            return
+        pieces.pop()
+
+
+def _render_hunk_sections(pieces: list[str], new_content_lines: list[str], old_content_lines: list[str], start2: int):
+    is_plus_lines = any(line.startswith('+') for line in new_content_lines)
+    is_minus_lines = any(line.startswith('-') for line in old_content_lines)
+    if is_plus_lines or is_minus_lines:  # notice 'True' here - we always present __new hunk__ for section, otherwise LLM gets confused
+        _rstrip_pieces(pieces)
+        pieces.append('\n__new hunk__\n')
+        pieces.extend(f"{start2 + i} {line_new}\n" for i, line_new in enumerate(new_content_lines))
+    if is_minus_lines:
+        _rstrip_pieces(pieces)
+        pieces.append('\n__old hunk__\n')
+        pieces.extend(f"{line_old}\n" for line_old in old_content_lines)
 
 
 def extract_hunk_lines_from_patch(patch: str, file_name, line_start, line_end, side, remove_trailing_chars: bool = True) -> tuple[str, str]:
     try:
         patch_with_lines_str = f"\n\n## File: '{file_name.strip()}'\n\n"
         selected_lines = ""
-        patch_lines = patch.splitlines()
-        RE_HUNK_HEADER = re.compile(
-            r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+        parsed_patch = parse_patch(patch)
+        patch_lines = parsed_patch.lines
         match = None
         start1, size1, start2, size2 = -1, -1, -1, -1
         skip_hunk = False
         selected_lines_num = 0
-        for line in patch_lines:
+        for line_i, line in enumerate(patch_lines):
             if 'no newline at end of file' in line.lower():
                 continue
 
@@ -432,9 +675,9 @@ def extract_hunk_lines_from_patch(patch: str, file_name, line_start, line_end, s
                 selected_lines_num = 0
                 header_line = line
 
-                match = RE_HUNK_HEADER.match(line)
+                match = parsed_patch.hunk_by_line.get(line_i)
 
-                section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+                section_header, size1, size2, start1, start2 = match.header_values()
 
                 # check if line range is in this hunk
                 if side.lower() == 'left':
@@ -0,0 +1,163 @@
+import difflib
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from typing import Optional
+
+from pr_agent.algo.git_patch_processing import parse_patch
+
+_NGRAM_SIZE = 3
+
+
+def _count_ngrams(text: str) -> Counter:
+    return Counter(text[j:j + _NGRAM_SIZE] for j in range(len(text) - _NGRAM_SIZE + 1))
+
+
+class PatchLineLocator:
+    """
+    Locates the lines of a patch that inline comments refer to, with the results of a linear scan of the patch (see
+    find_line_number_of_relevant_line_in_file), from indexes built once per patch:
+    - the new file line number (absolute position) of each patch line, and the first patch line of each number.
+    - the patch lines by length, to compute the close matches of a line only against lines of similar length.
+    - the patch lines by n-gram, to compute the close matches of a line only against lines that share enough n-grams
+      with it, and to scan for a substring only the lines that contain all its n-grams. The n-gram index is built on
+      the first search.
+    """
+
+    def __init__(self, patch: str):
+        self.patch = patch
+        parsed_patch = parse_patch(patch)
+        self.lines = parsed_patch.lines
+        # a hunk header line that could not be parsed stops the scans, as a linear scan would fail on it
+        self.invalid_header_index: Optional[int] = None
+        self.absolute_positions: list[int] = []  # patch line -> new file line number
+        delta = 0
+        start2 = 0
+        for i, line in enumerate(self.lines):
+            if line.startswith('@@'):
+                hunk = parsed_patch.hunk_by_line.get(i)
+                if hunk is None:
+                    self.invalid_header_index = i
+                    break
+                delta = 0
+                start2 = hunk.start2
+            elif not line.startswith('-'):
+                delta += 1
+            self.absolute_positions.append(start2 + delta - 1)
+
+        self._position_by_absolute: dict[int, int] = {}
+        for i, absolute_position in enumerate(self.absolute_positions):
+            self._position_by_absolute.setdefault(absolute_position, i)
+
+        self._lines_by_length: dict[int, list[str]] = {}
+        for line in self.lines:
+            self._lines_by_length.setdefault(len(line), []).append(line)
+        self._lengths = sorted(self._lines_by_length)
+
+        self._ngrams: Optional[dict[str, list[int]]] = None
+
+    def _check_scanned(self, scanned_lines: int):
+        if self.invalid_header_index is not None and scanned_lines > self.invalid_header_index:
+            raise ValueError(f"Invalid hunk header in patch: {self.lines[self.invalid_header_index]}")
+
+    def find_by_absolute_position(self, absolute_position: int) -> int:
+        """The first patch line at the given new file line number, or -1"""
+        position = self._position_by_absolute.get(absolute_position, -1)
+        if position == -1:
+            self._check_scanned(len(self.lines))
+        return position
+
+    def _get_ngrams(self) -> dict[str, list[int]]:
+        if self._ngrams is None:
+            self._ngrams = {}
+            for i, line in enumerate(self.lines):
+                for ngram in _count_ngrams(line):
+                    self._ngrams.setdefault(ngram, []).append(i)
+        return self._ngrams
+
+    def _lines_of_length(self, min_length: int, max_length: int) -> list[str]:
+        lines = []
+        for length in self._lengths[bisect_left(self._lengths, min_length):bisect_right(self._lengths, max_length)]:
+            lines.extend(self._lines_by_length[length])
+        return lines
+
+    def get_close_matches(self, word: str, n: int = 3, cutoff: float = 0.93) -> list[str]:
+        """difflib.get_close_matches() of the patch lines"""
+        if not 0.0 < cutoff < 1.0:
+            return difflib.get_close_matches(word, self.lines, n=n, cutoff=cutoff)
+        # the length bound of SequenceMatcher.real_quick_ratio(), widened by one so that float rounding never drops
+        # a line that difflib would keep; difflib still filters the candidates with its exact ratios
+        min_length = int(len(word) * cutoff / (2.0 - cutoff)) - 1
+        max_length = int(len(word) * (2.0 - cutoff) / cutoff) + 1
+
+        # the matching blocks of a close line leave at most 'max_unmatched' characters of both lines unmatched, and
+        # each unmatched character (or gap between blocks) breaks at most N n-grams of the word: a close line shares
+        # at least 'min_common' of the n-grams of the word, and so at least one of any
+        # (number of n-grams - min_common + 1) of them
+        max_unmatched = int((1.0 - cutoff) * (len(word) + max_length)) + 1
+        min_common = len(word) - _NGRAM_SIZE + 1 - _NGRAM_SIZE * max_unmatched
+        if min_common <= 0:
+            return difflib.get_close_matches(word, self._lines_of_length(min_length, max_length), n=n, cutoff=cutoff)
+
+        ngrams = self._get_ngrams()
+        word_ngrams = _count_ngrams(word)
+        required = sum(word_ngrams.values()) - min_common + 1
+        candidate_indexes = set()
+        for ngram in sorted(word_ngrams, key=lambda ngram: len(ngrams.get(ngram, ()))):  # the rarest first
+            candidate_indexes.update(ngrams.get(ngram, ()))
+            required -= word_ngrams[ngram]
+            if required <= 0:
+                break
+        if 2 * len(candidate_indexes) > len(self.lines):
+            # most lines look alike (e.g. generated code): counting their shared n-grams would cost more than it saves
+            return difflib.get_close_matches(word, self._lines_of_length(min_length, max_length), n=n, cutoff=cutoff)
+        candidates = []
+        for i in candidate_indexes:
+            line = self.lines[i]
+            # the n-grams of the word found in the line bound the n-grams they share
+            if min_length <= len(line) <= max_length and \
+                    sum(count for ngram, count in word_ngrams.items() if ngram in line) >= min_common:
+                candidates.append(line)
+        return difflib.get_close_matches(word, candidates, n=n, cutoff=cutoff)
+
+    def find_containing_line(self, text: str) -> int:
+        """The first patch line that contains 'text' and is not a deleted line, or -1"""
+        if len(text) < _NGRAM_SIZE:
+            for i, line in enumerate(self.lines):
+                if text in line and line[0] != '-':
+                    self._check_scanned(i + 1)
+                    return i
+            self._check_scanned(len(self.lines))
+            return -1
+
+        # every line that contains the text contains each of its n-grams, so the lines of the rarest one are enough
+        ngrams = self._get_ngrams()
+        candidate_indexes = min((ngrams.get(ngram, []) for ngram in _count_ngrams(text)), key=len)
+        for i in candidate_indexes:
+            line = self.lines[i]
+            if text in line and line[0] != '-':
+                self._check_scanned(i + 1)
+                return i
+        self._check_scanned(len(self.lines))
+        return -1
+
+    def locate(self, relevant_line_in_file: str, absolute_position: int = -1) -> tuple[int, int]:
+        """
+        Returns the (position, absolute_position) of the line an inline comment refers to: the patch line and its new
+        file line number. See find_line_number_of_relevant_line_in_file.
+        """
+        if absolute_position != -1:  # matching absolute to relative
+            return self.find_by_absolute_position(absolute_position), absolute_position
+
+        # try to find the line in the patch using difflib, with some margin of error
+        matches_difflib = self.get_close_matches(relevant_line_in_file, n=3, cutoff=0.93)
+        if len(matches_difflib) == 1 and matches_difflib[0].startswith('+'):
+            relevant_line_in_file = matches_difflib[0]
+
+        position = self.find_containing_line(relevant_line_in_file)
+        if position == -1 and relevant_line_in_file[0] == '+':
+            # The model might add a '+' to the beginning of the relevant_line_in_file even if originally
+            # it's a context line
+            position = self.find_containing_line(relevant_line_in_file[1:].lstrip())
+        if position == -1:
+            return -1, absolute_position
+        return position, self.absolute_positions[position]
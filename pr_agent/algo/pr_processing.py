@@ -1,18 +1,23 @@
 from __future__ import annotations
 
+import os
 import traceback
-from typing import Callable, List, Tuple
+from typing import Callable, Iterator, List, Optional, Tuple
 
 from github import RateLimitExceededException
 
+from pr_agent.algo.chunk_planner import PatchPiece, plan_chunks
 from pr_agent.algo.file_filter import filter_ignored
 from pr_agent.algo.git_patch_processing import (
-    extend_patch, handle_patch_deletions,
+    extend_patches, handle_file_patch_deletions, split_patch_by_hunks,
     decouple_and_convert_to_hunks_with_lines_numbers)
 from pr_agent.algo.language_handler import sort_files_by_main_languages
-from pr_agent.algo.token_handler import TokenHandler
+from pr_agent.algo.prepared_diff_cache import get_prepared_diff_cache, make_prepared_diff_key
+from pr_agent.algo.token_estimator import get_token_estimator
+from pr_agent.algo.token_handler import TokenHandler, get_token_count_cache
 from pr_agent.algo.types import EDIT_TYPE, FilePatchInfo
-from pr_agent.algo.utils import ModelType, clip_tokens, get_max_tokens, get_model
+from pr_agent.algo.utils import (ModelType, clip_tokens, clip_tokens_with_count,
+                                 get_max_tokens, get_model)
 from pr_agent.config_loader import get_settings
 from pr_agent.git_providers.git_provider import GitProvider
 from pr_agent.log import get_logger
@@ -26,6 +31,7 @@ ADDED_FILES_ = "Additional added files (insufficient token budget to process):\n
 OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD = 1500
 OUTPUT_BUFFER_TOKENS_HARD_THRESHOLD = 1000
 MAX_EXTRA_LINES = 10
+STREAMING_DIFF_BATCH_SIZE = 8  # files extended together by the streaming diff (see iter_extended_patches)
 
 
 def cap_and_log_extra_lines(value, direction) -> int:
@@ -35,6 +41,103 @@ def cap_and_log_extra_lines(value, direction) -> int:
     return value
 
 
+class _PRLanguages:
+    """
+    The diff files of the PR, sorted by main languages. They are loaded only when a stage of the diff preparation is
+    not cached (see prepared_diff_cache).
+    """
+
+    def __init__(self, git_provider: GitProvider):
+        self.git_provider = git_provider
+        self.files_tokens = None  # token counts of the extended patches, when they were read from the cache
+        self._pr_languages = None
+
+    def get(self) -> list:
+        if self._pr_languages is None:
+            try:
+                diff_files = self.git_provider.get_diff_files()
+            except RateLimitExceededException as e:
+                get_logger().error(f"Rate limit exceeded for git provider API. original message {e}")
+                raise
+
+            # get pr languages
+            self._pr_languages = sort_files_by_main_languages(self.git_provider.get_languages(), diff_files)
+            if self._pr_languages:
+                try:
+                    get_logger().info(f"PR main language: {self._pr_languages[0]['language']}")
+                except Exception as e:
+                    pass
+            if self.files_tokens:
+                for lang in self._pr_languages:
+                    for file in lang['files']:
+                        file.tokens = self.files_tokens.get(file.filename, file.tokens)
+        return self._pr_languages
+
+
+def _get_prepared_extended_diff(git_provider: GitProvider, pr_languages: _PRLanguages, token_handler: TokenHandler,
+                                model: str, add_line_numbers_to_hunks: bool, patch_extra_lines_before: int,
+                                patch_extra_lines_after: int, stream: bool = False) -> Tuple[list, int, list]:
+    """
+    Same outputs as pr_generate_extended_diff, from the prepared diff cache when possible. With 'stream', the patches
+    are generated only until they exceed the token budget (see _stream_extended_diff), in which case the outputs are
+    partial (and not cached).
+    """
+    prepared_diff_cache = get_prepared_diff_cache()
+    token_budget = get_max_tokens(model) - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD - 1
+    key = make_prepared_diff_key(git_provider, model, "extended_diff", add_line_numbers_to_hunks,
+                                 patch_extra_lines_before, patch_extra_lines_after)
+    prepared_diff = prepared_diff_cache.get(key) if prepared_diff_cache else None
+    if prepared_diff is not None:
+        # the counts may be estimated upper bounds (see pr_generate_extended_diff), which is safe for any prompt size
+        patches_extended, patches_extended_tokens, files_tokens = prepared_diff
+        pr_languages.files_tokens = dict(files_tokens)
+        return list(patches_extended), token_handler.prompt_tokens + sum(patches_extended_tokens), \
+            list(patches_extended_tokens)
+
+    if stream:
+        patches_extended, total_tokens, patches_extended_tokens, complete = _stream_extended_diff(
+            pr_languages.get(), token_handler, add_line_numbers_to_hunks, patch_extra_lines_before,
+            patch_extra_lines_after, token_budget)
+        if not complete:
+            return patches_extended, total_tokens, patches_extended_tokens
+    else:
+        patches_extended, total_tokens, patches_extended_tokens = pr_generate_extended_diff(
+            pr_languages.get(), token_handler, add_line_numbers_to_hunks,
+            patch_extra_lines_before=patch_extra_lines_before, patch_extra_lines_after=patch_extra_lines_after,
+            token_budget=token_budget)
+    if prepared_diff_cache:
+        files_tokens = tuple((file.filename, file.tokens) for lang in pr_languages.get() for file in lang['files'])
+        prepared_diff_cache.put(key, (tuple(patches_extended), tuple(patches_extended_tokens), files_tokens))
+    return patches_extended, total_tokens, patches_extended_tokens
+
+
+def _get_prepared_compressed_diff(git_provider: GitProvider, pr_languages: _PRLanguages, token_handler: TokenHandler,
+                                  model: str, convert_hunks_to_line_numbers: bool,
+                                  extended_diff_params: Optional[tuple] = None) -> Tuple[dict, list, list]:
+    """
+    Same outputs as prepare_compressed_diff, from the prepared diff cache when possible. The files are ordered by the
+    token counts of their extended patches, so 'extended_diff_params' are the parameters of the extended diff that
+    was prepared before (None if none was).
+    """
+    prepared_diff_cache = get_prepared_diff_cache()
+    key = make_prepared_diff_key(git_provider, model, "compressed_diff", convert_hunks_to_line_numbers,
+                                 extended_diff_params)
+    prepared_diff = prepared_diff_cache.get(key) if prepared_diff_cache else None
+    if prepared_diff is not None:
+        files_patches, deleted_files_list, sorted_filenames = prepared_diff
+        file_dict = {filename: {'patch': patch, 'tokens': tokens, 'edit_type': edit_type}
+                     for filename, patch, tokens, edit_type in files_patches}
+        return file_dict, list(deleted_files_list), list(sorted_filenames)
+
+    file_dict, deleted_files_list, sorted_filenames = prepare_compressed_diff(
+        pr_languages.get(), token_handler, convert_hunks_to_line_numbers)
+    if prepared_diff_cache:
+        files_patches = tuple((filename, data['patch'], data['tokens'], data['edit_type'])
+                              for filename, data in file_dict.items())
+        prepared_diff_cache.put(key, (files_patches, tuple(deleted_files_list), tuple(sorted_filenames)))
+    return file_dict, deleted_files_list, sorted_filenames
+
+
 def get_pr_diff(git_provider: GitProvider, token_handler: TokenHandler,
                 model: str,
                 add_line_numbers_to_hunks: bool = False,
@@ -51,24 +154,26 @@ def get_pr_diff(git_provider: GitProvider, token_handler: TokenHandler,
         PATCH_EXTRA_LINES_BEFORE = cap_and_log_extra_lines(PATCH_EXTRA_LINES_BEFORE, "before")
         PATCH_EXTRA_LINES_AFTER = cap_and_log_extra_lines(PATCH_EXTRA_LINES_AFTER, "after")
 
-    try:
-        diff_files = git_provider.get_diff_files()
-    except RateLimitExceededException as e:
-        get_logger().error(f"Rate limit exceeded for git provider API. original message {e}")
-        raise
-
-    # get pr languages
-    pr_languages = sort_files_by_main_languages(git_provider.get_languages(), diff_files)
-    if pr_languages:
-        try:
-            get_logger().info(f"PR main language: {pr_languages[0]['language']}")
-        except Exception as e:
-            pass
+    # with a streaming diff, the files are processed only until no more patches can fit (not for multiple calls)
+    streaming_diff = get_settings().get("config.streaming_diff", False) and not large_pr_handling
 
     # generate a standard diff string, with patch extension
-    patches_extended, total_tokens, patches_extended_tokens = pr_generate_extended_diff(
-        pr_languages, token_handler, add_line_numbers_to_hunks,
-        patch_extra_lines_before=PATCH_EXTRA_LINES_BEFORE, patch_extra_lines_after=PATCH_EXTRA_LINES_AFTER)
+    pr_languages = _PRLanguages(git_provider)
+    patches_extended, total_tokens, patches_extended_tokens = _get_prepared_extended_diff(
+        git_provider, pr_languages, token_handler, model, add_line_numbers_to_hunks,
+        PATCH_EXTRA_LINES_BEFORE, PATCH_EXTRA_LINES_AFTER, stream=streaming_diff)
+    token_count_cache = get_token_count_cache()
+    if token_count_cache is not None:
+        get_logger().debug("Token count cache statistics", artifact=token_count_cache.stats())
+    token_estimator = get_token_estimator()
+    if token_estimator is not None:
+        get_logger().debug("Token estimator statistics", artifact=token_estimator.stats())
+    prepared_diff_cache = get_prepared_diff_cache()
+    if prepared_diff_cache is not None:
+        get_logger().debug("Prepared diff cache statistics", artifact=prepared_diff_cache.stats())
+    diff_content_stats = git_provider.get_diff_content_stats()
+    if diff_content_stats is not None:
+        get_logger().debug("Diff contents memory statistics", artifact=diff_content_stats)
 
     # if we are under the limit, return the full diff
     if total_tokens + OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD < get_max_tokens(model):
@@ -82,19 +187,27 @@ def get_pr_diff(git_provider: GitProvider, token_handler: TokenHandler,
     # if we are over the limit, start pruning (If we got here, we will not extend the patches with extra lines)
     get_logger().info(f"Tokens: {total_tokens}, total tokens over limit: {get_max_tokens(model)}, "
                       f"pruning diff.")
-    patches_compressed_list, total_tokens_list, deleted_files_list, remaining_files_list, file_dict, files_in_patches_list = \
-        pr_generate_compressed_diff(pr_languages, token_handler, model, add_line_numbers_to_hunks, large_pr_handling)
-
-    if large_pr_handling and len(patches_compressed_list) > 1:
-        get_logger().info(f"Large PR handling mode, and found {len(patches_compressed_list)} patches with original diff.")
-        if return_pruning_info:
-            return "", True  # Large PR handling with pruning
-        return "" # return empty string, as we want to generate multiple patches with a different prompt
-
-    # return the first patch
-    patches_compressed = patches_compressed_list[0]
-    total_tokens_new = total_tokens_list[0]
-    files_in_patch = files_in_patches_list[0]
+    if streaming_diff:
+        patches_compressed, total_tokens_new, remaining_files_list, file_dict, files_in_patch = \
+            generate_streamed_compressed_diff(pr_languages.get(), token_handler, model, add_line_numbers_to_hunks)
+    else:
+        patches_compressed_list, total_tokens_list, deleted_files_list, remaining_files_list, file_dict, files_in_patches_list = \
+            pr_generate_compressed_diff(None, token_handler, model, add_line_numbers_to_hunks, large_pr_handling,
+                                        prepared_diff=_get_prepared_compressed_diff(
+                                            git_provider, pr_languages, token_handler, model, add_line_numbers_to_hunks,
+                                            extended_diff_params=(add_line_numbers_to_hunks, PATCH_EXTRA_LINES_BEFORE,
+                                                                  PATCH_EXTRA_LINES_AFTER)))
+
+        if large_pr_handling and len(patches_compressed_list) > 1:
+            get_logger().info(f"Large PR handling mode, and found {len(patches_compressed_list)} patches with original diff.")
+            if return_pruning_info:
+                return "", True  # Large PR handling with pruning
+            return "" # return empty string, as we want to generate multiple patches with a different prompt
+
+        # return the first patch
+        patches_compressed = patches_compressed_list[0]
+        total_tokens_new = total_tokens_list[0]
+        files_in_patch = files_in_patches_list[0]
 
     # Insert additional information about added, modified, and deleted files if there is enough space
     max_tokens = get_max_tokens(model) - OUTPUT_BUFFER_TOKENS_HARD_THRESHOLD
@@ -128,14 +241,14 @@ def get_pr_diff(git_provider: GitProvider, token_handler: TokenHandler,
                     deleted_list_str = deleted_list_str + f"\n{filename}"
 
     # prune the added, modified, and deleted files lists, and add them to the final diff
-    added_list_str = clip_tokens(added_list_str, max_tokens - curr_token)
+    added_list_str, added_list_tokens = clip_tokens_with_count(added_list_str, max_tokens - curr_token)
     if added_list_str:
         final_diff = final_diff + "\n\n" + added_list_str
-        curr_token += token_handler.count_tokens(added_list_str) + 2
-    modified_list_str = clip_tokens(modified_list_str, max_tokens - curr_token)
+        curr_token += added_list_tokens + 2
+    modified_list_str, modified_list_tokens = clip_tokens_with_count(modified_list_str, max_tokens - curr_token)
     if modified_list_str:
         final_diff = final_diff + "\n\n" + modified_list_str
-        curr_token += token_handler.count_tokens(modified_list_str) + 2
+        curr_token += modified_list_tokens + 2
     deleted_list_str = clip_tokens(deleted_list_str, max_tokens - curr_token)
     if deleted_list_str:
         final_diff = final_diff + "\n\n" + deleted_list_str
@@ -154,22 +267,11 @@ def get_pr_diff(git_provider: GitProvider, token_handler: TokenHandler,
 
 def get_pr_diff_multiple_patchs(git_provider: GitProvider, token_handler: TokenHandler, model: str,
                 add_line_numbers_to_hunks: bool = False, disable_extra_lines: bool = False):
-    try:
-        diff_files = git_provider.get_diff_files()
-    except RateLimitExceededException as e:
-        get_logger().error(f"Rate limit exceeded for git provider API. original message {e}")
-        raise
-
-    # get pr languages
-    pr_languages = sort_files_by_main_languages(git_provider.get_languages(), diff_files)
-    if pr_languages:
-        try:
-            get_logger().info(f"PR main language: {pr_languages[0]['language']}")
-        except Exception as e:
-            pass
-
+    prepared_diff = _get_prepared_compressed_diff(git_provider, _PRLanguages(git_provider), token_handler, model,
+                                                  add_line_numbers_to_hunks)
     patches_compressed_list, total_tokens_list, deleted_files_list, remaining_files_list, file_dict, files_in_patches_list = \
-        pr_generate_compressed_diff(pr_languages, token_handler, model, add_line_numbers_to_hunks, large_pr_handling=True)
+        pr_generate_compressed_diff(None, token_handler, model, add_line_numbers_to_hunks, large_pr_handling=True,
+                                    prepared_diff=prepared_diff)
 
     return patches_compressed_list, total_tokens_list, deleted_files_list, remaining_files_list, file_dict, files_in_patches_list
 
@@ -178,48 +280,108 @@ def pr_generate_extended_diff(pr_languages: list,
                               token_handler: TokenHandler,
                               add_line_numbers_to_hunks: bool,
                               patch_extra_lines_before: int = 0,
-                              patch_extra_lines_after: int = 0) -> Tuple[list, int, list]:
+                              patch_extra_lines_after: int = 0,
+                              token_budget: Optional[int] = None) -> Tuple[list, int, list]:
+    """
+    Generates the extended patches of all the files, and counts their tokens.
+    If 'token_budget' (the maximal total number of tokens, including the prompt) is given, and the patches clearly fit
+    in it (or clearly exceed it), the counts may be estimated upper (or lower) bounds instead of exact counts (see
+    TokenHandler.count_tokens_within_budget).
+    """
     total_tokens = token_handler.prompt_tokens  # initial tokens
     patches_extended = []
-    patches_extended_tokens = []
-    for lang in pr_languages:
-        for file in lang['files']:
-            original_file_content_str = file.base_file
-            new_file_content_str = file.head_file
-            patch = file.patch
-            if not patch:
-                continue
+    extended_files = []
+    files = [file for lang in pr_languages for file in lang['files'] if file.patch]
+
+    # extend each patch with extra lines of context (on worker processes, for large PRs)
+    extended_patches = extend_patches(files, patch_extra_lines_before, patch_extra_lines_after)
+    for file, extended_patch in zip(files, extended_patches):
+        full_extended_patch = _render_extended_patch(file, extended_patch, add_line_numbers_to_hunks)
+        if full_extended_patch is None:
+            continue
+        extended_files.append(file)
+        patches_extended.append(full_extended_patch)
+
+    # tokenize all the patches in one batch
+    if token_budget is not None:
+        patches_extended_tokens = token_handler.count_tokens_batch_within_budget(
+            patches_extended, token_budget - total_tokens,
+            [os.path.splitext(file.filename)[1] for file in extended_files])
+    else:
+        patches_extended_tokens = token_handler.count_tokens_batch(patches_extended)
+    for file, patch_tokens in zip(extended_files, patches_extended_tokens):
+        file.tokens = patch_tokens
+        total_tokens += patch_tokens
 
-            # extend each patch with extra lines of context
-            extended_patch = extend_patch(original_file_content_str, patch,
-                                          patch_extra_lines_before, patch_extra_lines_after, file.filename,
-                                          new_file_str=new_file_content_str)
-            if not extended_patch:
-                get_logger().warning(f"Failed to extend patch for file: {file.filename}")
-                continue
+    return patches_extended, total_tokens, patches_extended_tokens
 
-            if add_line_numbers_to_hunks:
-                full_extended_patch = decouple_and_convert_to_hunks_with_lines_numbers(extended_patch, file)
-            else:
-                extended_patch = extended_patch.replace('\n@@ ', '\n\n@@ ') # add extra line before each hunk
-                full_extended_patch = f"\n\n## File: '{file.filename.strip()}'\n\n{extended_patch.strip()}\n"
 
-            # add AI-summary metadata to the patch
-            if file.ai_file_summary and get_settings().get("config.enable_ai_metadata", False):
-                full_extended_patch = add_ai_summary_top_patch(file, full_extended_patch)
+def _render_extended_patch(file: FilePatchInfo, extended_patch: str, add_line_numbers_to_hunks: bool) -> Optional[str]:
+    if not extended_patch:
+        get_logger().warning(f"Failed to extend patch for file: {file.filename}")
+        return None
 
-            patch_tokens = token_handler.count_tokens(full_extended_patch)
-            file.tokens = patch_tokens
-            total_tokens += patch_tokens
-            patches_extended_tokens.append(patch_tokens)
-            patches_extended.append(full_extended_patch)
+    if add_line_numbers_to_hunks:
+        full_extended_patch = decouple_and_convert_to_hunks_with_lines_numbers(extended_patch, file)
+    else:
+        extended_patch = extended_patch.replace('\n@@ ', '\n\n@@ ') # add extra line before each hunk
+        full_extended_patch = f"\n\n## File: '{file.filename.strip()}'\n\n{extended_patch.strip()}\n"
 
-    return patches_extended, total_tokens, patches_extended_tokens
+    # add AI-summary metadata to the patch
+    if file.ai_file_summary and get_settings().get("config.enable_ai_metadata", False):
+        full_extended_patch = add_ai_summary_top_patch(file, full_extended_patch)
+    return full_extended_patch
 
 
-def pr_generate_compressed_diff(top_langs: list, token_handler: TokenHandler, model: str,
-                                convert_hunks_to_line_numbers: bool,
-                                large_pr_handling: bool) -> Tuple[list, list, list, list, dict, list]:
+def iter_extended_patches(pr_languages: list, add_line_numbers_to_hunks: bool, patch_extra_lines_before: int = 0,
+                          patch_extra_lines_after: int = 0) -> Iterator[Tuple[FilePatchInfo, str]]:
+    """
+    Yields the files and their extended patches, as pr_generate_extended_diff generates them (same patches, same
+    order). The files are extended in batches of STREAMING_DIFF_BATCH_SIZE, whose contents are loaded together, so a
+    consumer that stops early does not load, extend nor render the files after its last batch.
+    """
+    files = [file for lang in pr_languages for file in lang['files'] if file.patch]
+    for start in range(0, len(files), STREAMING_DIFF_BATCH_SIZE):
+        batch = files[start:start + STREAMING_DIFF_BATCH_SIZE]
+        for file, extended_patch in zip(batch, extend_patches(batch, patch_extra_lines_before,
+                                                              patch_extra_lines_after)):
+            full_extended_patch = _render_extended_patch(file, extended_patch, add_line_numbers_to_hunks)
+            if full_extended_patch is not None:
+                yield file, full_extended_patch
+
+
+def prioritize_files_by_patch_size(pr_languages: list) -> list[FilePatchInfo]:
+    """
+    The files with a patch, by priority: the files of the main languages first, and the largest patches of each
+    language first. Unlike the order of prepare_compressed_diff, it does not depend on the token counts of the files.
+    """
+    files = []
+    for lang in pr_languages:
+        files.extend(sorted((file for file in lang['files'] if file.patch), key=lambda file: len(file.patch),
+                            reverse=True))
+    return files
+
+
+def iter_compressed_patches(files: list[FilePatchInfo],
+                            convert_hunks_to_line_numbers: bool) -> Iterator[Tuple[FilePatchInfo, Optional[str]]]:
+    """
+    Yields the files and their compressed patches (None for a deleted file), in order. A file is processed only when
+    it is reached.
+    """
+    for file in files:
+        patch = handle_file_patch_deletions(file, file.patch)
+        if patch is not None and convert_hunks_to_line_numbers:
+            patch = decouple_and_convert_to_hunks_with_lines_numbers(patch, file)
+        yield file, patch
+
+
+def prepare_compressed_diff(top_langs: list, token_handler: TokenHandler,
+                            convert_hunks_to_line_numbers: bool) -> Tuple[dict, list, list]:
+    """
+    Generates the compressed patch of each file, and counts its tokens. Returns the files patches (filename -> patch,
+    tokens, edit type), the deleted files, and the names of all the files in the order they should be added to the
+    calls.
+    """
     deleted_files_list = []
 
     # sort each one of the languages in top_langs by the number of tokens in the diff
@@ -230,15 +392,12 @@ def pr_generate_compressed_diff(top_langs: list, token_handler: TokenHandler, mo
     # generate patches for each file, and count tokens
     file_dict = {}
     for file in sorted_files:
-        original_file_content_str = file.base_file
-        new_file_content_str = file.head_file
         patch = file.patch
         if not patch:
             continue
 
         # removing delete-only hunks
-        patch = handle_patch_deletions(patch, original_file_content_str,
-                                       new_file_content_str, file.filename, file.edit_type)
+        patch = handle_file_patch_deletions(file, patch)
         if patch is None:
             if file.filename not in deleted_files_list:
                 deleted_files_list.append(file.filename)
@@ -251,14 +410,32 @@ def pr_generate_compressed_diff(top_langs: list, token_handler: TokenHandler, mo
         # if file.ai_file_summary and get_settings().config.get('config.is_auto_command', False):
         #     patch = add_ai_summary_top_patch(file, patch)
 
-        new_patch_tokens = token_handler.count_tokens(patch)
-        file_dict[file.filename] = {'patch': patch, 'tokens': new_patch_tokens, 'edit_type': file.edit_type}
+        file_dict[file.filename] = {'patch': patch, 'tokens': -1, 'edit_type': file.edit_type}
+
+    # tokenize all the patches in one batch
+    patches_tokens = token_handler.count_tokens_batch([data['patch'] for data in file_dict.values()])
+    for data, new_patch_tokens in zip(file_dict.values(), patches_tokens):
+        data['tokens'] = new_patch_tokens
+    return file_dict, deleted_files_list, [file.filename for file in sorted_files]
+
+
+def pr_generate_compressed_diff(top_langs: list, token_handler: TokenHandler, model: str,
+                                convert_hunks_to_line_numbers: bool,
+                                large_pr_handling: bool,
+                                prepared_diff: Optional[tuple] = None) -> Tuple[list, list, list, list, dict, list]:
+    """
+    Generates the compressed patches (without delete-only hunks) of the files, in one or more calls.
+    If 'prepared_diff' (the output of prepare_compressed_diff) is given, 'top_langs' is not used.
+    """
+    if prepared_diff is None:
+        prepared_diff = prepare_compressed_diff(top_langs, token_handler, convert_hunks_to_line_numbers)
+    file_dict, deleted_files_list, sorted_filenames = prepared_diff
 
     max_tokens_model = get_max_tokens(model)
 
     # first iteration
     files_in_patches_list = []
-    remaining_files_list =  [file.filename for file in sorted_files]
+    remaining_files_list = list(sorted_filenames)
     patches_list =[]
     total_tokens_list = []
     total_tokens, patches, remaining_files_list, files_in_patch_list = generate_full_patch(convert_hunks_to_line_numbers, file_dict,
@@ -286,6 +463,100 @@ def pr_generate_compressed_diff(top_langs: list, token_handler: TokenHandler, mo
     return patches_list, total_tokens_list, deleted_files_list, remaining_files_list, file_dict, files_in_patches_list
 
 
+def _stream_extended_diff(pr_languages: list, token_handler: TokenHandler, add_line_numbers_to_hunks: bool,
+                          patch_extra_lines_before: int, patch_extra_lines_after: int,
+                          token_budget: int) -> Tuple[list, int, list, bool]:
+    """
+    Same outputs as pr_generate_extended_diff, with a running token count: since the extended diff is used only if
+    it fits 'token_budget', it stops extending (and loading, and tokenizing) the patches as soon as they exceed it.
+    The last output is whether all the files were extended.
+    """
+    total_tokens = token_handler.prompt_tokens  # initial tokens
+    patches_extended = []
+    patches_extended_tokens = []
+    extended_patches = iter_extended_patches(pr_languages, add_line_numbers_to_hunks,
+                                             patch_extra_lines_before, patch_extra_lines_after)
+    for file, full_extended_patch in extended_patches:
+        patch_tokens = token_handler.count_tokens_within_budget(full_extended_patch, token_budget - total_tokens,
+                                                                language=os.path.splitext(file.filename)[1])
+        file.tokens = patch_tokens
+        total_tokens += patch_tokens
+        patches_extended.append(full_extended_patch)
+        patches_extended_tokens.append(patch_tokens)
+        if total_tokens > token_budget:
+            extended_patches.close()
+            get_logger().info(f"Extended diff is over the token budget after {len(patches_extended)} files, "
+                              f"stopped extending the patches")
+            return patches_extended, total_tokens, patches_extended_tokens, False
+    return patches_extended, total_tokens, patches_extended_tokens, True
+
+
+def generate_streamed_compressed_diff(pr_languages: list, token_handler: TokenHandler, model: str,
+                                      convert_hunks_to_line_numbers: bool) -> Tuple[list, int, list, dict, list]:
+    """
+    Same outputs as the first call of pr_generate_compressed_diff (patches, total tokens, remaining files, files
+    patches, files in the patches), with the files in the order of prioritize_files_by_patch_size. The patches are
+    added as the files are reached, and the files after the point where no other patch can fit are not processed:
+    their contents are not loaded and their patches are not tokenized. They are still in the files patches (without
+    a patch), for the lists of additional files.
+    """
+    max_tokens_model = get_max_tokens(model)
+    total_tokens = token_handler.prompt_tokens  # initial tokens
+    patches = []
+    remaining_files_list = []
+    files_in_patch_list = []
+    file_dict = {}
+    files = prioritize_files_by_patch_size(pr_languages)
+    num_processed_files = 0
+    hard_stop = False
+    for file, patch in iter_compressed_patches(files, convert_hunks_to_line_numbers):
+        num_processed_files += 1
+        if patch is None:  # deleted file
+            continue
+        filename = file.filename
+        file_dict[filename] = {'patch': patch, 'tokens': -1, 'edit_type': file.edit_type}
+
+        # Hard Stop, no more tokens
+        if total_tokens > max_tokens_model - OUTPUT_BUFFER_TOKENS_HARD_THRESHOLD:
+            get_logger().warning(f"File was fully skipped, no more tokens: {filename}.")
+            hard_stop = True
+            break
+
+        new_patch_tokens = file_dict[filename]['tokens'] = token_handler.count_tokens(patch)
+        # If the patch is too large, just show the file name
+        if total_tokens + new_patch_tokens > max_tokens_model - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD:
+            if get_settings().config.verbosity_level >= 2:
+                get_logger().warning(f"Patch too large, skipping it: '{filename}'")
+            remaining_files_list.append(filename)
+            continue
+
+        if patch:
+            if not convert_hunks_to_line_numbers:
+                patch_final = f"\n\n## File: '{filename.strip()}'\n\n{patch.strip()}\n"
+            else:
+                patch_final = "\n\n" + patch.strip()
+            patches.append(patch_final)
+            total_tokens += token_handler.count_tokens_within_budget(
+                patch_final, max_tokens_model - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD - total_tokens,
+                language=os.path.splitext(filename)[1])
+            files_in_patch_list.append(filename)
+            if get_settings().config.verbosity_level >= 2:
+                get_logger().info(f"Tokens: {total_tokens}, last filename: {filename}")
+            if total_tokens >= max_tokens_model - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD:  # no token left for a patch
+                break
+
+    unprocessed_files = files[num_processed_files:]
+    if unprocessed_files:
+        get_logger().info(f"No more patches can fit, {len(unprocessed_files)} files were not processed")
+    for file in unprocessed_files:
+        if file.edit_type == EDIT_TYPE.DELETED:  # its patch would be omitted (see handle_patch_deletions)
+            continue
+        file_dict[file.filename] = {'patch': None, 'tokens': -1, 'edit_type': file.edit_type}
+        if not hard_stop:
+            remaining_files_list.append(file.filename)
+    return patches, total_tokens, remaining_files_list, file_dict, files_in_patch_list
+
+
 def generate_full_patch(convert_hunks_to_line_numbers, file_dict, max_tokens_model,remaining_files_list_prev, token_handler):
     total_tokens = token_handler.prompt_tokens # initial tokens
     patches = []
@@ -320,7 +591,9 @@ def generate_full_patch(convert_hunks_to_line_numbers, file_dict, max_tokens_mod
             else:
                 patch_final = "\n\n" + patch.strip()
             patches.append(patch_final)
-            total_tokens += token_handler.count_tokens(patch_final)
+            total_tokens += token_handler.count_tokens_within_budget(
+                patch_final, max_tokens_model - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD - total_tokens,
+                language=os.path.splitext(filename)[1])
             files_in_patch_list.append(filename)
             if get_settings().config.verbosity_level >= 2:
                 get_logger().info(f"Tokens: {total_tokens}, last filename: {filename}")
@@ -399,20 +672,6 @@ def get_pr_multi_diffs(git_provider: GitProvider,
     Raises:
         RateLimitExceededException: If the rate limit for the Git provider API is exceeded.
     """
-    try:
-        diff_files = git_provider.get_diff_files()
-    except RateLimitExceededException as e:
-        get_logger().error(f"Rate limit exceeded for git provider API. original message {e}")
-        raise
-
-    # Sort files by main language
-    pr_languages = sort_files_by_main_languages(git_provider.get_languages(), diff_files)
-
-    # Sort files within each language group by tokens in descending order
-    sorted_files = []
-    for lang in pr_languages:
-        sorted_files.extend(sorted(lang['files'], key=lambda x: x.tokens, reverse=True))
-
     # Get the maximum number of extra lines before and after the patch
     PATCH_EXTRA_LINES_BEFORE = get_settings().config.patch_extra_lines_before
     PATCH_EXTRA_LINES_AFTER = get_settings().config.patch_extra_lines_after
@@ -420,48 +679,62 @@ def get_pr_multi_diffs(git_provider: GitProvider,
     PATCH_EXTRA_LINES_AFTER = cap_and_log_extra_lines(PATCH_EXTRA_LINES_AFTER, "after")
 
     # try first a single run with standard diff string, with patch extension, and no deletions
-    patches_extended, total_tokens, patches_extended_tokens = pr_generate_extended_diff(
-        pr_languages, token_handler,
-        add_line_numbers_to_hunks=add_line_numbers,
-        patch_extra_lines_before=PATCH_EXTRA_LINES_BEFORE,
-        patch_extra_lines_after=PATCH_EXTRA_LINES_AFTER)
+    pr_languages = _PRLanguages(git_provider)
+    patches_extended, total_tokens, patches_extended_tokens = _get_prepared_extended_diff(
+        git_provider, pr_languages, token_handler, model, add_line_numbers,
+        PATCH_EXTRA_LINES_BEFORE, PATCH_EXTRA_LINES_AFTER)
 
     # if we are under the limit, return the full diff
     if total_tokens + OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD < get_max_tokens(model):
         return ["\n".join(patches_extended)] if patches_extended else []
 
+    # prepare the patches of all the files, and tokenize them in one batch
+    prepared_diff_cache = get_prepared_diff_cache()
+    multi_diff_key = make_prepared_diff_key(git_provider, model, "multi_diff", add_line_numbers,
+                                            PATCH_EXTRA_LINES_BEFORE, PATCH_EXTRA_LINES_AFTER)
+    prepared_multi_diff = prepared_diff_cache.get(multi_diff_key) if prepared_diff_cache else None
+    if prepared_multi_diff is not None:
+        # the file contents are not needed anymore, only the names and edit types (for splitting large patches)
+        files_patches = [(FilePatchInfo("", "", patch, filename, edit_type=edit_type), patch, rendered_patch)
+                         for filename, edit_type, patch, rendered_patch, _ in prepared_multi_diff]
+        patches_tokens = [patch_tokens for *_, patch_tokens in prepared_multi_diff]
+    else:
+        # Sort files within each language group by tokens in descending order
+        sorted_files = []
+        for lang in pr_languages.get():
+            sorted_files.extend(sorted(lang['files'], key=lambda x: x.tokens, reverse=True))
+
+        files_patches = []
+        for file in sorted_files:
+            patch = file.patch
+            if not patch:
+                continue
+
+            # Remove delete-only hunks
+            patch = handle_file_patch_deletions(file, patch)
+            if patch is None:
+                continue
+
+            files_patches.append((file, patch, _render_multi_diff_patch(file, patch, add_line_numbers)))
+        patches_tokens = token_handler.count_tokens_batch([rendered_patch for _, _, rendered_patch in files_patches])
+        if prepared_diff_cache:
+            prepared_diff_cache.put(multi_diff_key, tuple(
+                (file.filename, file.edit_type, patch, rendered_patch, patch_tokens)
+                for (file, patch, rendered_patch), patch_tokens in zip(files_patches, patches_tokens)))
+
+    if get_settings().get("config.multi_call_packing", "bin_packing") == "bin_packing":
+        return _pack_multi_diffs(files_patches, patches_tokens, token_handler, model, max_calls, add_line_numbers)
+
     patches = []
     final_diff_list = []
     total_tokens = token_handler.prompt_tokens
     call_number = 1
-    for file in sorted_files:
+    for (file, _, patch), new_patch_tokens in zip(files_patches, patches_tokens):
         if call_number > max_calls:
             if get_settings().config.verbosity_level >= 2:
                 get_logger().info(f"Reached max calls ({max_calls})")
             break
 
-        original_file_content_str = file.base_file
-        new_file_content_str = file.head_file
-        patch = file.patch
-        if not patch:
-            continue
-
-        # Remove delete-only hunks
-        patch = handle_patch_deletions(patch, original_file_content_str, new_file_content_str, file.filename, file.edit_type)
-        if patch is None:
-            continue
-
-        # Add line numbers and metadata to the patch
-        if add_line_numbers:
-            patch = decouple_and_convert_to_hunks_with_lines_numbers(patch, file)
-        else:
-            patch = f"\n\n## File: '{file.filename.strip()}'\n\n{patch.strip()}\n"
-
-        # add AI-summary metadata to the patch
-        if file.ai_file_summary and get_settings().get("config.enable_ai_metadata", False):
-            patch = add_ai_summary_top_patch(file, patch)
-        new_patch_tokens = token_handler.count_tokens(patch)
-
         if patch and (token_handler.prompt_tokens + new_patch_tokens) > get_max_tokens(
                 model) - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD:
             if get_settings().config.get('large_patch_policy', 'skip') == 'skip':
@@ -469,8 +742,8 @@ def get_pr_multi_diffs(git_provider: GitProvider,
                 continue
             elif get_settings().config.get('large_patch_policy') == 'clip':
                 delta_tokens = get_max_tokens(model) - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD - token_handler.prompt_tokens
-                patch_clipped = clip_tokens(patch, delta_tokens, delete_last_line=True, num_input_tokens=new_patch_tokens)
-                new_patch_tokens = token_handler.count_tokens(patch_clipped)
+                patch_clipped, new_patch_tokens = clip_tokens_with_count(patch, delta_tokens, delete_last_line=True,
+                                                                         num_input_tokens=new_patch_tokens)
                 if patch_clipped and (token_handler.prompt_tokens + new_patch_tokens) > get_max_tokens(
                         model) - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD:
                     get_logger().warning(f"Patch too large, skipping: {file.filename}")
@@ -509,6 +782,86 @@ def get_pr_multi_diffs(git_provider: GitProvider,
     return final_diff_list
 
 
+def _render_multi_diff_patch(file: FilePatchInfo, patch: str, add_line_numbers: bool) -> str:
+    # Add line numbers and metadata to the patch
+    if add_line_numbers:
+        patch = decouple_and_convert_to_hunks_with_lines_numbers(patch, file)
+    else:
+        patch = f"\n\n## File: '{file.filename.strip()}'\n\n{patch.strip()}\n"
+
+    # add AI-summary metadata to the patch
+    if file.ai_file_summary and get_settings().get("config.enable_ai_metadata", False):
+        patch = add_ai_summary_top_patch(file, patch)
+    return patch
+
+
+def _pack_multi_diffs(files_patches: list, patches_tokens: list[int], token_handler: TokenHandler, model: str,
+                      max_calls: int, add_line_numbers: bool) -> List[str]:
+    """
+    Packs the patches of the files (file, patch, rendered patch) into at most 'max_calls' calls with first-fit
+    decreasing (see plan_chunks). A file that does not fit in one call is split at hunk boundaries into pieces that do.
+    """
+    capacity = get_max_tokens(model) - OUTPUT_BUFFER_TOKENS_SOFT_THRESHOLD - token_handler.prompt_tokens
+    pieces = []
+    for order, ((file, patch, rendered_patch), patch_tokens) in enumerate(zip(files_patches, patches_tokens)):
+        if patch_tokens <= capacity:
+            pieces.append(PatchPiece(file.filename, rendered_patch, patch_tokens, order))
+        else:
+            pieces.extend(_split_file_patch(file, patch, add_line_numbers, token_handler, capacity, order))
+
+    plan = plan_chunks(pieces, capacity, max_calls)
+    plan_stats = plan.stats()
+    message = (f"Packed the PR patches into {len(plan.chunks)} calls, efficiency per call: "
+               f"{plan_stats['efficiency']} (total {plan_stats['total_efficiency']})")
+    if plan.unplaced:
+        for piece in plan.unplaced:
+            get_logger().warning(f"Reached max calls ({max_calls}), skipping patch: {piece.filename}")
+        get_logger().warning(message, artifact=plan_stats)
+    else:
+        get_logger().info(message, artifact=plan_stats)
+    return [chunk.render().strip() for chunk in plan.chunks]
+
+
+def _split_file_patch(file: FilePatchInfo, patch: str, add_line_numbers: bool, token_handler: TokenHandler,
+                      capacity: int, order: int) -> List[PatchPiece]:
+    """
+    Splits the patch of a file that does not fit in one call into groups of consecutive hunks that do, each rendered
+    with the file header. A single hunk that does not fit is clipped or skipped, according to
+    'config.large_patch_policy'.
+    """
+    hunk_patches = split_patch_by_hunks(patch)
+    hunks_tokens = token_handler.count_tokens_batch(
+        [_render_multi_diff_patch(file, hunk_patch, add_line_numbers) for hunk_patch in hunk_patches])
+
+    # the count of each hunk includes the file header, so their sum over-estimates the count of a group of hunks
+    groups = []
+    group_tokens = 0
+    for hunk_patch, hunk_tokens in zip(hunk_patches, hunks_tokens):
+        if groups and group_tokens + hunk_tokens <= capacity:
+            groups[-1].append(hunk_patch)
+            group_tokens += hunk_tokens
+        else:
+            groups.append([hunk_patch])
+            group_tokens = hunk_tokens
+    parts = [_render_multi_diff_patch(file, "\n".join(group), add_line_numbers) for group in groups]
+    parts_tokens = token_handler.count_tokens_batch(parts)
+
+    pieces = []
+    for part, (part_patch, part_tokens) in enumerate(zip(parts, parts_tokens)):
+        if part_tokens > capacity:
+            if get_settings().config.get('large_patch_policy', 'skip') == 'clip':
+                part_patch, part_tokens = clip_tokens_with_count(part_patch, capacity, delete_last_line=True,
+                                                                 num_input_tokens=part_tokens)
+            if not part_patch or part_tokens > capacity:
+                get_logger().warning(f"Hunk too large, skipping: {file.filename}")
+                continue
+            get_logger().info(f"Clipped large hunk for file: {file.filename}")
+        pieces.append(PatchPiece(file.filename, part_patch, part_tokens, order, part))
+    if len(groups) > 1:
+        get_logger().info(f"Split large patch of file {file.filename} into {len(pieces)} pieces")
+    return pieces
+
+
 def add_ai_metadata_to_diff_files(git_provider, pr_description_files):
     """
     Adds AI metadata to the diff files based on the PR description files (FilePatchInfo.ai_file_summary).
@@ -0,0 +1,133 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+
+# settings that change the prepared diffs, besides the parameters of each stage
+_PREPARATION_SETTINGS = (
+    "ignore.regex",
+    "ignore.glob",
+    "config.patch_extension_skip_types",
+    "config.allow_dynamic_context",
+    "config.max_extra_lines_before_dynamic_context",
+    "config.use_token_estimator",
+)
+
+
+class PreparedDiffCache:
+    """
+    In-memory store of prepared diffs: the rendered patches of a PR and their token counts, for a stage of the diff
+    preparation (see pr_processing). The auto flow runs several tools on the same commits (describe, review, improve),
+    and each of them would otherwise extend, render and tokenize the same patches again.
+
+    Entries are keyed by the commit pair of the diff, the model and the settings of the preparation, so an entry is
+    never stale. Values are stored as tuples and must not be mutated by the callers.
+
+    The cache is bounded by its number of entries and by the total size of their strings ('max_size', in
+    characters), so a few monorepo diffs cannot hold the memory of a worker: least recently used entries are evicted
+    first, and an entry larger than 'max_size' is not stored.
+    """
+
+    def __init__(self, max_entries: int, max_size: int):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (prepared diff, size), least recently used first
+
+    def get(self, key: Optional[tuple]) -> Optional[tuple]:
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: Optional[tuple], value: tuple):
+        if key is None:
+            return
+        size = _get_size(value)
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= previous[1]
+            if size > self.max_size:
+                return
+            self._entries[key] = (value, size)
+            self.size += size
+            while len(self._entries) > self.max_entries or self.size > self.max_size:
+                self.size -= self._entries.popitem(last=False)[1][1]
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "size_mb": round(self.size / 2 ** 20, 1),
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+def _get_size(value) -> int:
+    """The total length of the strings of a prepared diff (nested in tuples, lists and dicts)"""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (tuple, list)):
+        return sum(_get_size(item) for item in value)
+    if isinstance(value, dict):
+        return sum(_get_size(item) + _get_size(key) for key, item in value.items())
+    return 0
+
+
+class _PreparedDiffCacheInstance:
+    instance: Optional[PreparedDiffCache] = None
+    lock = Lock()
+
+
+def get_prepared_diff_cache() -> Optional[PreparedDiffCache]:
+    """
+    Returns the process-wide prepared diff cache, or None if it is disabled ('config.prepared_diff_cache_max_entries'
+    or 'config.prepared_diff_cache_max_mb' is 0).
+    """
+    max_entries = int(get_settings().get("CONFIG.PREPARED_DIFF_CACHE_MAX_ENTRIES", 0) or 0)
+    max_mb = float(get_settings().get("CONFIG.PREPARED_DIFF_CACHE_MAX_MB", 32) or 0)
+    if max_entries <= 0 or max_mb <= 0:
+        return None
+    if _PreparedDiffCacheInstance.instance is None:
+        with _PreparedDiffCacheInstance.lock:
+            if _PreparedDiffCacheInstance.instance is None:
+                _PreparedDiffCacheInstance.instance = PreparedDiffCache(max_entries, int(max_mb * 2 ** 20))
+    return _PreparedDiffCacheInstance.instance
+
+
+def make_prepared_diff_key(git_provider, model: str, stage: str, *params) -> Optional[tuple]:
+    """
+    Returns the cache key of a stage of the diff preparation of a PR, or None if it cannot be cached: the cache is
+    disabled, the git provider does not know the commit pair of the diff (e.g. incremental review), or the patches
+    include AI metadata (which changes between tools of the same run).
+
+    Args:
+        git_provider: the git provider of the PR.
+        model: the model the patches are prepared for (token limits and encoder).
+        stage: the name of the preparation stage.
+        params: the parameters of the stage (e.g. line numbers mode, extra lines).
+    """
+    if get_prepared_diff_cache() is None or get_settings().get("config.enable_ai_metadata", False):
+        return None
+    try:
+        diff_refs = git_provider.get_diff_refs()
+    except Exception:
+        diff_refs = None
+    if not diff_refs:
+        return None
+    preparation_settings = json.dumps([get_settings().get(name, None) for name in _PREPARATION_SETTINGS],
+                                      sort_keys=True, default=str)
+    settings_digest = hashlib.blake2b(preparation_settings.encode("utf-8"), digest_size=16).hexdigest()
+    return (git_provider.get_pr_id(), *diff_refs, model, stage, *params, settings_digest)
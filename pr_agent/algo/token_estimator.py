@@ -0,0 +1,146 @@
+import string
+from dataclasses import dataclass
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+
+# maps each character to its class: word characters -> 'a', whitespace -> ' ', ASCII punctuation -> '.'
+# (other characters, e.g. non-ASCII, are left unchanged)
+_CHAR_CLASS_TABLE = str.maketrans({
+    **{c: "a" for c in string.ascii_letters + string.digits + "_"},
+    **{c: " " for c in string.whitespace},
+    **{c: "." for c in string.punctuation},
+})
+
+# tokens per character of each class (word, whitespace, punctuation, other), before calibration.
+# o200k_base / cl100k_base merge long identifiers and indentation runs, while punctuation and non-ASCII
+# characters mostly cost a token each
+_DEFAULT_WEIGHTS = (0.23, 0.12, 0.55, 0.85)
+
+MIN_OBSERVATIONS = 20  # exact counts needed before the estimate of an encoder is trusted
+MIN_ERROR_BAND = 0.05
+CALIBRATION_DECAY = 0.05  # weight of a new observation in the running averages
+ERROR_PEAK_DECAY = 0.01  # decay of the peak relative error with each observation
+CALIBRATION_SAMPLE_INTERVAL = 10  # one in this many texts decided from the estimate is still counted exactly
+
+
+@dataclass
+class _Calibration:
+    ratio: float = 1.0  # running average of (exact count / raw estimate)
+    abs_error: float = 0.0  # running average of the relative error of the calibrated estimate
+    max_error: float = 0.0  # peak relative error, decaying with each observation
+    observations: int = 0
+
+
+class TokenEstimator:
+    """
+    Cheap token count estimate of a text, from the number of characters of each class, with a relative error band.
+
+    The estimate is calibrated per encoder and per language (file extension) from the exact counts that are computed
+    anyway, when an estimate is too close to a budget to decide, and from a sample of the texts that were decided
+    from the estimate (see should_sample). The error band is the peak relative error (with a margin), which decays as
+    more accurate estimates are observed, so the band tightens. Until MIN_OBSERVATIONS exact counts were observed for
+    an encoder, there is no error band and the callers count exactly.
+    """
+
+    def __init__(self):
+        self.estimates = 0
+        self.exact_counts = 0
+        self.decided = 0  # texts decided from the estimate
+        self._lock = Lock()
+        self._calibrations: dict[tuple, _Calibration] = {}
+
+    @staticmethod
+    def raw_estimate(text: str) -> float:
+        classes = text.translate(_CHAR_CLASS_TABLE)
+        word_chars = classes.count("a")
+        space_chars = classes.count(" ")
+        punct_chars = classes.count(".")
+        other_chars = len(classes) - word_chars - space_chars - punct_chars
+        w_word, w_space, w_punct, w_other = _DEFAULT_WEIGHTS
+        return w_word * word_chars + w_space * space_chars + w_punct * punct_chars + w_other * other_chars
+
+    def estimate(self, text: str, encoder_name: str, language: str = "") -> tuple[int, Optional[float]]:
+        """Returns the estimated number of tokens, and its relative error band (None if not calibrated yet)"""
+        raw = self.raw_estimate(text)
+        with self._lock:
+            self.estimates += 1
+            calibration = self._calibrations.get((encoder_name, language))
+            if calibration is None or calibration.observations < MIN_OBSERVATIONS:
+                calibration = self._calibrations.get((encoder_name, ""))
+            if calibration is None or calibration.observations < MIN_OBSERVATIONS:
+                return round(raw * calibration.ratio if calibration else raw), None
+            return round(raw * calibration.ratio), max(MIN_ERROR_BAND, 1.5 * calibration.max_error)
+
+    def bounds(self, text: str, encoder_name: str, language: str = "") -> Optional[tuple[int, int]]:
+        """
+        Returns a lower and an upper bound of the number of tokens of the text (within the error band), or None if
+        unknown
+        """
+        estimate, band = self.estimate(text, encoder_name, language)
+        if band is None:
+            return None
+        return max(0, int(estimate * (1 - band))), int(estimate * (1 + band)) + 1
+
+    def should_sample(self) -> bool:
+        """
+        Called for each text decided from its estimate. Returns whether it should be counted exactly anyway (and
+        observed), so the calibration keeps following the texts that clearly fit or clearly do not fit a budget.
+        """
+        with self._lock:
+            self.decided += 1
+            return self.decided % CALIBRATION_SAMPLE_INTERVAL == 0
+
+    def observe(self, text: str, encoder_name: str, language: str, exact_count: int):
+        """Calibrates the estimates of an encoder and language with an exact count"""
+        raw = self.raw_estimate(text)
+        if raw <= 0 or exact_count <= 0:
+            return
+        with self._lock:
+            self.exact_counts += 1
+            # the language-agnostic calibration is used for languages without observations
+            for key in {(encoder_name, language), (encoder_name, "")}:
+                calibration = self._calibrations.setdefault(key, _Calibration())
+                if calibration.observations > 0:
+                    error = abs(raw * calibration.ratio - exact_count) / exact_count
+                    calibration.abs_error += CALIBRATION_DECAY * (error - calibration.abs_error)
+                    calibration.max_error = max(error, calibration.max_error * (1 - ERROR_PEAK_DECAY))
+                    calibration.ratio += CALIBRATION_DECAY * (exact_count / raw - calibration.ratio)
+                else:
+                    calibration.ratio = exact_count / raw
+                calibration.observations += 1
+
+    def stats(self) -> dict:
+        """Accuracy report of the estimates, per encoder and language"""
+        with self._lock:
+            return {
+                "estimates": self.estimates,
+                "exact_counts": self.exact_counts,
+                "decided": self.decided,
+                "calibrations": {f"{encoder_name}:{language or '*'}": {
+                    "observations": calibration.observations,
+                    "ratio": round(calibration.ratio, 3),
+                    "mean_abs_error": round(calibration.abs_error, 3),
+                    "max_error": round(calibration.max_error, 3)}
+                    for (encoder_name, language), calibration in self._calibrations.items()},
+            }
+
+
+class _TokenEstimatorInstance:
+    instance: Optional[TokenEstimator] = None
+    lock = Lock()
+
+
+def get_token_estimator() -> Optional[TokenEstimator]:
+    """
+    Returns the process-wide token estimator, or None if budget decisions use exact counts only
+    ('config.use_token_estimator').
+    """
+    if not get_settings().get("CONFIG.USE_TOKEN_ESTIMATOR", False):
+        return None
+    if _TokenEstimatorInstance.instance is None:
+        with _TokenEstimatorInstance.lock:
+            if _TokenEstimatorInstance.instance is None:
+                _TokenEstimatorInstance.instance = TokenEstimator()
+    return _TokenEstimatorInstance.instance
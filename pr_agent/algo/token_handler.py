@@ -1,8 +1,16 @@
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
 from threading import Lock
+from typing import Optional
 
-from jinja2 import Environment, StrictUndefined
+from jinja2 import Environment, StrictUndefined, Template, meta
 from tiktoken import encoding_for_model, get_encoding
 
+from pr_agent.algo.token_estimator import get_token_estimator
 from pr_agent.config_loader import get_settings
 from pr_agent.log import get_logger
 
@@ -11,6 +19,7 @@ class TokenEncoder:
     _encoder_instance = None
     _model = None
     _lock = Lock()  # Create a lock object
+    load_time_sec: Optional[float] = None  # time spent loading the tokenizer encodings (at startup, or on first use)
 
     @classmethod
     def get_token_encoder(cls):
@@ -18,14 +27,212 @@ class TokenEncoder:
         if cls._encoder_instance is None or model != cls._model:  # Check without acquiring the lock for performance
             with cls._lock:  # Lock acquisition to ensure thread safety
                 if cls._encoder_instance is None or model != cls._model:
+                    start = time.perf_counter()
+                    cls.use_bundled_assets()
                     cls._model = model
                     try:
                         cls._encoder_instance = encoding_for_model(cls._model) if "gpt" in cls._model else get_encoding(
                             "o200k_base")
                     except:
                         cls._encoder_instance = get_encoding("o200k_base")
+                    if cls.load_time_sec is None:
+                        cls.load_time_sec = time.perf_counter() - start
         return cls._encoder_instance
 
+    @staticmethod
+    def use_bundled_assets():
+        """
+        Makes tiktoken read its BPE files from a local directory ('config.tiktoken_cache_dir', e.g. pre-downloaded in
+        the Docker image), instead of downloading them. An explicit TIKTOKEN_CACHE_DIR environment variable wins.
+        """
+        cache_dir = get_settings().get("CONFIG.TIKTOKEN_CACHE_DIR", "")
+        if cache_dir and not os.environ.get("TIKTOKEN_CACHE_DIR"):
+            os.environ["TIKTOKEN_CACHE_DIR"] = cache_dir
+
+    @classmethod
+    def warm_up(cls) -> float:
+        """
+        Loads the encodings ('config.tokenizer_warm_up_encodings', and the one of the configured model) ahead of the
+        first request. Called in the gunicorn master before forking, so the workers share the loaded encodings
+        copy-on-write instead of each loading them.
+
+        Returns:
+            The loading time in seconds, also kept in 'TokenEncoder.load_time_sec'.
+        """
+        start = time.perf_counter()
+        cls.use_bundled_assets()
+        for encoding_name in get_settings().get("CONFIG.TOKENIZER_WARM_UP_ENCODINGS", []):
+            try:
+                get_encoding(encoding_name).encode("warm up")
+            except Exception as e:
+                get_logger().warning(f"Failed to load tokenizer encoding {encoding_name}: {e}")
+        cls.get_token_encoder().encode("warm up")
+        cls.load_time_sec = time.perf_counter() - start
+        get_logger().info(f"Tokenizer encodings loaded in {cls.load_time_sec:.2f} sec",
+                          artifact={"tokenizer_load_time_sec": round(cls.load_time_sec, 3)})
+        return cls.load_time_sec
+
+
+class TokenCountCache:
+    """
+    Process-wide LRU of token counts, keyed by (encoder name, text digest), so the same text (e.g. a patch counted by
+    several tools, or the repository rules appended to every prompt) is encoded only once.
+    Also records the encoding time of each entry, to report the time saved by the hits.
+    """
+    MIN_TEXT_LENGTH = 256  # shorter texts are cheaper to encode than to hash and look up
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.time_saved_sec = 0.0
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (number of tokens, encoding time in seconds)
+
+    @staticmethod
+    def make_key(encoder, text: str) -> tuple:
+        digest = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+        return getattr(encoder, "name", type(encoder).__name__), len(text), digest
+
+    def count_tokens(self, encoder, text: str) -> int:
+        if len(text) < self.MIN_TEXT_LENGTH:
+            return len(encoder.encode(text, disallowed_special=()))
+        key = self.make_key(encoder, text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.time_saved_sec += entry[1]
+                return entry[0]
+        start = time.perf_counter()
+        num_tokens = len(encoder.encode(text, disallowed_special=()))
+        self._put(key, num_tokens, time.perf_counter() - start, is_miss=True)
+        return num_tokens
+
+    def add(self, encoder, text: str, num_tokens: int):
+        """Records a token count that is already known (e.g. computed by the caller from the same encoding)"""
+        if len(text) >= self.MIN_TEXT_LENGTH:
+            self._put(self.make_key(encoder, text), num_tokens, 0.0, is_miss=False)
+
+    def count_tokens_batch(self, encoder, texts: list[str], num_threads: int) -> list[int]:
+        """Same as count_tokens for a list of texts. The missing counts are encoded in a single batch"""
+        counts = [None] * len(texts)
+        keys = [None] * len(texts)
+        with self._lock:
+            for i, text in enumerate(texts):
+                if len(text) < self.MIN_TEXT_LENGTH:
+                    continue
+                keys[i] = self.make_key(encoder, text)
+                entry = self._entries.get(keys[i])
+                if entry is not None:
+                    self._entries.move_to_end(keys[i])
+                    self.hits += 1
+                    self.time_saved_sec += entry[1]
+                    counts[i] = entry[0]
+        missing = [i for i, count in enumerate(counts) if count is None]
+        if missing:
+            start = time.perf_counter()
+            missing_counts = encode_batch_counts(encoder, [texts[i] for i in missing], num_threads)
+            encode_time_sec = (time.perf_counter() - start) / len(missing)  # the batch time is shared evenly
+            for i, count in zip(missing, missing_counts):
+                counts[i] = count
+                if keys[i] is not None:
+                    self._put(keys[i], count, encode_time_sec, is_miss=True)
+        return counts
+
+    def _put(self, key: tuple, num_tokens: int, encode_time_sec: float, is_miss: bool):
+        with self._lock:
+            if is_miss:
+                self.misses += 1
+            self._entries.pop(key, None)
+            self._entries[key] = (num_tokens, encode_time_sec)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                    "time_saved_sec": round(self.time_saved_sec, 3)}
+
+
+class _TokenCountCacheInstance:
+    instance: Optional[TokenCountCache] = None
+    lock = Lock()
+
+
+def get_token_count_cache() -> Optional[TokenCountCache]:
+    """
+    Returns the process-wide token count cache, or None if it is disabled ('config.token_count_cache_max_entries' = 0).
+    """
+    max_entries = int(get_settings().get("CONFIG.TOKEN_COUNT_CACHE_MAX_ENTRIES", 0) or 0)
+    if max_entries <= 0:
+        return None
+    if _TokenCountCacheInstance.instance is None:
+        with _TokenCountCacheInstance.lock:
+            if _TokenCountCacheInstance.instance is None:
+                _TokenCountCacheInstance.instance = TokenCountCache(max_entries)
+    return _TokenCountCacheInstance.instance
+
+
+def count_encoder_tokens(encoder, text: str) -> int:
+    """Counts the tokens of a text with the given encoder, through the token count cache (if enabled)"""
+    token_count_cache = get_token_count_cache()
+    if token_count_cache is None:
+        return len(encoder.encode(text, disallowed_special=()))
+    return token_count_cache.count_tokens(encoder, text)
+
+
+def encode_batch_counts(encoder, texts: list[str], num_threads: int) -> list[int]:
+    """Counts the tokens of several texts at once, with tiktoken's multi-threaded batch encoder when available"""
+    if len(texts) > 1 and num_threads > 1 and hasattr(encoder, "encode_batch"):
+        return [len(tokens) for tokens in encoder.encode_batch(texts, num_threads=num_threads, disallowed_special=())]
+    return [len(encoder.encode(text, disallowed_special=())) for text in texts]
+
+
+_TEMPLATE_ENVIRONMENT = Environment(undefined=StrictUndefined)
+
+
+@lru_cache(maxsize=256)
+def get_compiled_template(source: str) -> tuple[Template, frozenset]:
+    """
+    Compiles a prompt template once per process. Returns the template, and the names of the variables it uses.
+    Compiled templates are immutable, so they can be rendered concurrently.
+    """
+    variables = frozenset(meta.find_undeclared_variables(_TEMPLATE_ENVIRONMENT.parse(source)))
+    return _TEMPLATE_ENVIRONMENT.from_string(source), variables
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class _PromptTokensCache:
+    """
+    Process-wide LRU of prompt token counts, keyed by (encoder, templates, digest of the variables the templates use,
+    digest of the repository rules), so warm workers do not render and tokenize the same prompts again.
+    """
+    max_entries = 512
+    entries = OrderedDict()
+    lock = Lock()
+
+    @classmethod
+    def get(cls, key: tuple) -> Optional[int]:
+        with cls.lock:
+            prompt_tokens = cls.entries.get(key)
+            if prompt_tokens is not None:
+                cls.entries.move_to_end(key)
+            return prompt_tokens
+
+    @classmethod
+    def put(cls, key: tuple, prompt_tokens: int):
+        with cls.lock:
+            cls.entries[key] = prompt_tokens
+            while len(cls.entries) > cls.max_entries:
+                cls.entries.popitem(last=False)
+
 
 class TokenHandler:
     """
@@ -69,19 +276,36 @@ class TokenHandler:
         The sum of the number of tokens in the system and user strings.
         """
         try:
-            environment = Environment(undefined=StrictUndefined)
-            system_prompt = environment.from_string(system).render(vars)
-            user_prompt = environment.from_string(user).render(vars)
+            system_template, system_variables = get_compiled_template(system)
+            user_template, user_variables = get_compiled_template(user)
 
             # Ensure token accounting includes repository-specific rules appended to system prompt
             try:
                 from pr_agent.git_providers.utils import add_repository_rules_to_prompt as _add_rules
-                system_prompt_with_rules = _add_rules(system_prompt)
+                from pr_agent.git_providers.utils import get_repository_rules_for_prompt
+                repo_rules = get_repository_rules_for_prompt()
+            except Exception:
+                _add_rules, repo_rules = None, ""
+
+            # the prompts only depend on the variables used by the templates, and on the repository rules
+            relevant_vars = {name: vars.get(name) for name in sorted(system_variables | user_variables)}
+            cache_key = (getattr(encoder, "name", type(encoder).__name__), _digest(system), _digest(user),
+                         _digest(json.dumps(relevant_vars, sort_keys=True, default=str)), _digest(repo_rules))
+            prompt_tokens = _PromptTokensCache.get(cache_key)
+            if prompt_tokens is not None:
+                return prompt_tokens
+
+            system_prompt = system_template.render(vars)
+            user_prompt = user_template.render(vars)
+            try:
+                system_prompt_with_rules = _add_rules(system_prompt, repo_rules=repo_rules) if _add_rules \
+                    else system_prompt
             except Exception:
                 system_prompt_with_rules = system_prompt
 
-            system_prompt_tokens = len(encoder.encode(system_prompt_with_rules))
-            user_prompt_tokens = len(encoder.encode(user_prompt))
+            system_prompt_tokens = count_encoder_tokens(encoder, system_prompt_with_rules)
+            user_prompt_tokens = count_encoder_tokens(encoder, user_prompt)
+            _PromptTokensCache.put(cache_key, system_prompt_tokens + user_prompt_tokens)
             return system_prompt_tokens + user_prompt_tokens
         except Exception as e:
             get_logger().error(f"Error in _get_system_user_tokens: {e}")
@@ -128,9 +352,78 @@ class TokenHandler:
         get_logger().warning(f"{model}'s expected token count cannot be accurately estimated. Using {elbow_factor} of encoder output as best effort estimate")
         return ceil(elbow_factor * default_encoder_estimate)
 
+    def remember_token_count(self, text: str, num_tokens: int):
+        """
+        Records the known number of tokens of a text, so a later count_tokens call on the same text does not encode it.
+        """
+        token_count_cache = get_token_count_cache()
+        if token_count_cache is not None:
+            token_count_cache.add(self.encoder, text, num_tokens)
+
+    def count_tokens_batch(self, patches: list[str]) -> list[int]:
+        """
+        Counts the number of tokens in several patch strings at once, with the encoder's batch API on a pool of
+        'config.tokenizer_num_threads' threads. Equivalent to calling count_tokens (not forced accurate) on each patch.
+
+        Args:
+        - patches: The patch strings.
+
+        Returns:
+        The number of tokens in each patch string.
+        """
+        num_threads = int(get_settings().get("CONFIG.TOKENIZER_NUM_THREADS", 8) or 1)
+        token_count_cache = get_token_count_cache()
+        if token_count_cache is None:
+            return encode_batch_counts(self.encoder, patches, num_threads)
+        return token_count_cache.count_tokens_batch(self.encoder, patches, num_threads)
+
+    def count_tokens_within_budget(self, patch: str, budget: int, language: str = "") -> int:
+        """
+        Counts the number of tokens in a patch string, for a decision against a token budget.
+        With the token estimator ('config.use_token_estimator'), a patch that clearly fits the budget, or clearly
+        exceeds it, is not encoded: an upper bound (respectively a lower bound) of its number of tokens is returned.
+        Otherwise, returns the exact count.
+
+        Args:
+        - patch: The patch string.
+        - budget: The number of tokens available.
+        - language: The language (file extension) of the patch, used to calibrate the estimator.
+        """
+        return self.count_tokens_batch_within_budget([patch], budget, [language])[0]
+
+    def count_tokens_batch_within_budget(self, patches: list[str], budget: int, languages: list[str]) -> list[int]:
+        """
+        Same as count_tokens_within_budget, for several patches that must fit the budget together.
+        """
+        token_estimator = get_token_estimator()
+        if token_estimator is None:
+            return self.count_tokens_batch(patches)
+        encoder_name = getattr(self.encoder, "name", type(self.encoder).__name__)
+        bounds = [token_estimator.bounds(patch, encoder_name, language) for patch, language in zip(patches, languages)]
+        counts = None
+        if None not in bounds:
+            lower_bounds, upper_bounds = zip(*bounds)
+            if sum(upper_bounds) <= budget:
+                counts = list(upper_bounds)
+            elif sum(lower_bounds) > budget:
+                counts = list(lower_bounds)
+        if counts is None:
+            sampled = range(len(patches))
+            counts = [None] * len(patches)
+        else:
+            # a sample of the decided patches is still counted exactly, to keep calibrating the estimator
+            sampled = [i for i in range(len(patches)) if token_estimator.should_sample()]
+        if sampled:
+            exact_counts = self.count_tokens_batch([patches[i] for i in sampled])
+            for i, num_tokens in zip(sampled, exact_counts):
+                counts[i] = num_tokens
+                token_estimator.observe(patches[i], encoder_name, languages[i], num_tokens)
+        return counts
+
     def count_tokens(self, patch: str, force_accurate=False) -> int:
         """
         Counts the number of tokens in a given patch string.
+        The encoder count is memoized process-wide (see TokenCountCache).
 
         Args:
         - patch: The patch string.
@@ -138,7 +431,7 @@ class TokenHandler:
         Returns:
         The number of tokens in the patch string.
         """
-        encoder_estimate = len(self.encoder.encode(patch, disallowed_special=()))
+        encoder_estimate = count_encoder_tokens(self.encoder, patch)
 
         #If an estimate is enough (for example, in cases where the maximal allowed tokens is way below the known limits), return it.
         if not force_accurate:
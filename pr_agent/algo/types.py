@@ -1,7 +1,10 @@
+import copy
 from dataclasses import dataclass
 from enum import Enum
 from typing import Optional
 
+from pr_agent.algo.diff_content_store import DiffContentStore, SpilledContent
+
 
 class EDIT_TYPE(Enum):
     ADDED = 1
@@ -24,3 +27,116 @@ class FilePatchInfo:
     num_minus_lines: int = -1
     language: Optional[str] = None
     ai_file_summary: str = None
+
+
+class _NotLoaded:
+    """The content of a file that was not loaded yet: a singleton, also through copies and pickling"""
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return "_NOT_LOADED"
+
+    def __repr__(self):
+        return "<not loaded>"
+
+
+_NOT_LOADED = _NotLoaded()
+
+
+class LazyFilePatchInfo(FilePatchInfo):
+    """
+    A FilePatchInfo whose base and head contents are loaded on first access, by its content loader (an object with a
+    'load_contents(requests)' method, that returns the contents of a list of (file, side) requests, side being "base"
+    or "head"). The contents of several files can be loaded together with load_file_contents.
+
+    With a content store (see DiffContentStore), the contents are kept by the store, in memory or spilled to disk.
+
+    Comparing or printing a lazy file does not load its contents: only its filename and patch are used.
+    """
+
+    def __init__(self, patch: str, filename: str, content_loader, content_store: DiffContentStore = None, **kwargs):
+        self.content_loader = content_loader
+        self.content_store = content_store
+        super().__init__(_NOT_LOADED, _NOT_LOADED, patch, filename, **kwargs)
+
+    def __eq__(self, other):
+        if not isinstance(other, FilePatchInfo):
+            return NotImplemented
+        return (self.filename, self.patch) == (other.filename, other.patch)
+
+    __hash__ = None  # as a FilePatchInfo
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(filename={self.filename!r}, patch={self.patch!r})"
+
+    def __deepcopy__(self, memo):
+        # the copy shares the content loader (e.g. a git provider) and the content store (a spill file)
+        memo[id(self.content_loader)] = self.content_loader
+        if self.content_store is not None:
+            memo[id(self.content_store)] = self.content_store
+        copied = self.__class__.__new__(self.__class__)
+        memo[id(self)] = copied
+        copied.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return copied
+
+    def _get_content(self, side: str) -> str:
+        content = getattr(self, f"_{side}_file")
+        if content is _NOT_LOADED:
+            setattr(self, f"{side}_file", self.content_loader.load_contents([(self, side)])[0])
+            content = getattr(self, f"_{side}_file")
+        if isinstance(content, SpilledContent):
+            return content.read()
+        return content
+
+    def _set_content(self, side: str, content: str):
+        if self.content_store is not None and content is not _NOT_LOADED:
+            content = self.content_store.put(content)
+        setattr(self, f"_{side}_file", content)
+
+    @property
+    def base_file(self) -> str:
+        return self._get_content("base")
+
+    @base_file.setter
+    def base_file(self, value: str):
+        self._set_content("base", value)
+
+    @property
+    def head_file(self) -> str:
+        return self._get_content("head")
+
+    @head_file.setter
+    def head_file(self, value: str):
+        self._set_content("head", value)
+
+    def is_loaded(self, side: str) -> bool:
+        return getattr(self, f"_{side}_file") is not _NOT_LOADED
+
+    def get_content_source(self, side: str):
+        """
+        The stored content of a side (a str, or a SpilledContent), which stays the same object until the content
+        is replaced, unlike the decoded str of a spilled content.
+        """
+        return getattr(self, f"_{side}_file")
+
+
+def load_file_contents(files: list) -> None:
+    """
+    Loads the contents of the lazy files among 'files' (see LazyFilePatchInfo) that were not loaded yet, with one
+    request per content loader, so the loader can fetch them concurrently instead of one by one on access.
+    """
+    requests_by_loader = {}
+    for file in files:
+        if isinstance(file, LazyFilePatchInfo):
+            for side in ("base", "head"):
+                if not file.is_loaded(side):
+                    requests_by_loader.setdefault(id(file.content_loader), (file.content_loader, []))[1].append(
+                        (file, side))
+    for content_loader, requests in requests_by_loader.values():
+        for (file, side), content in zip(requests, content_loader.load_contents(requests)):
+            setattr(file, f"{side}_file", content)
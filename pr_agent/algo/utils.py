@@ -23,8 +23,9 @@ from pydantic import BaseModel
 from starlette_context import context
 
 from pr_agent.algo import MAX_TOKENS
-from pr_agent.algo.git_patch_processing import extract_hunk_lines_from_patch
-from pr_agent.algo.token_handler import TokenEncoder
+from pr_agent.algo.diff_files_index import get_diff_files_index
+from pr_agent.algo.git_patch_processing import extract_hunk_lines_from_patch, parse_patch
+from pr_agent.algo.token_handler import TokenEncoder, get_token_count_cache
 from pr_agent.algo.types import FilePatchInfo
 from pr_agent.config_loader import get_settings, global_settings
 from pr_agent.log import get_logger
@@ -366,32 +367,32 @@ def extract_relevant_lines_str(end_line, files, relevant_file, start_line, deden
     try:
         relevant_lines_str = ""
         if files:
-            files = set_file_languages(files)
-            for file in files:
-                if file.filename.strip() == relevant_file:
-                    if not file.head_file:
-                        # as a fallback, extract relevant lines directly from patch
-                        patch = file.patch
-                        get_logger().info(f"No content found in file: '{file.filename}' for 'extract_relevant_lines_str'. Using patch instead")
-                        _, selected_lines = extract_hunk_lines_from_patch(patch, file.filename, start_line, end_line,side='right')
-                        if not selected_lines:
-                            get_logger().error(f"Failed to extract relevant lines from patch: {file.filename}")
-                            return ""
-                        # filter out '-' lines
-                        relevant_lines_str = ""
-                        for line in selected_lines.splitlines():
-                            if line.startswith('-'):
-                                continue
-                            relevant_lines_str += line[1:] + '\n'
-                    else:
-                        relevant_file_lines = file.head_file.splitlines()
-                        relevant_lines_str = "\n".join(relevant_file_lines[start_line - 1:end_line])
+            files_index = get_diff_files_index(files)
+            set_file_languages(files_index.diff_files)
+            file = files_index.get_file(relevant_file)
+            if file is not None:
+                if not file.head_file:
+                    # as a fallback, extract relevant lines directly from patch
+                    patch = file.patch
+                    get_logger().info(f"No content found in file: '{file.filename}' for 'extract_relevant_lines_str'. Using patch instead")
+                    _, selected_lines = extract_hunk_lines_from_patch(patch, file.filename, start_line, end_line,side='right')
+                    if not selected_lines:
+                        get_logger().error(f"Failed to extract relevant lines from patch: {file.filename}")
+                        return ""
+                    # filter out '-' lines
+                    relevant_lines_str = ""
+                    for line in selected_lines.splitlines():
+                        if line.startswith('-'):
+                            continue
+                        relevant_lines_str += line[1:] + '\n'
+                else:
+                    relevant_file_lines = files_index.head_lines(file)
+                    relevant_lines_str = "\n".join(relevant_file_lines[start_line - 1:end_line])
 
-                    if dedent and relevant_lines_str:
-                        # Remove the longest leading string of spaces and tabs common to all lines.
-                        relevant_lines_str = textwrap.dedent(relevant_lines_str)
-                    relevant_lines_str = f"```{file.language}\n{relevant_lines_str}\n```"
-                    break
+                if dedent and relevant_lines_str:
+                    # Remove the longest leading string of spaces and tabs common to all lines.
+                    relevant_lines_str = textwrap.dedent(relevant_lines_str)
+                relevant_lines_str = f"```{file.language}\n{relevant_lines_str}\n```"
 
         return relevant_lines_str
     except Exception as e:
@@ -1019,49 +1020,95 @@ def get_max_tokens(model):
     return max_tokens_model
 
 
-def clip_tokens(text: str, max_tokens: int, add_three_dots=True, num_input_tokens=None, delete_last_line=False) -> str:
+TRUNCATION_SUFFIX = "\n...(truncated)"
+
+
+def clip_tokens_with_count(text: str, max_tokens: int, add_three_dots=True, num_input_tokens=None,
+                           delete_last_line=False, snap_to_hunk=False) -> Tuple[str, int]:
     """
-    Clip the number of tokens in a string to a maximum number of tokens.
+    Clip a string to a maximum number of tokens, at an exact token boundary. The text is encoded once, and the
+    clipped text is decoded from a prefix of its tokens, so its token count is known without encoding it again.
 
     Args:
         text (str): The string to clip.
-        max_tokens (int): The maximum number of tokens allowed in the string.
+        max_tokens (int): The maximum number of tokens allowed in the string (including the three dots, if added).
         add_three_dots (bool, optional): A boolean indicating whether to add three dots at the end of the clipped
+            string.
+        num_input_tokens (int, optional): The number of tokens in the string, if already known. It can be a more
+            accurate count than the local encoder (e.g. from the model provider), in which case the clipping is
+            scaled to it.
+        delete_last_line (bool, optional): Remove the last (partial) line of the clipped string.
+        snap_to_hunk (bool, optional): Cut the clipped string before its last (partial) diff hunk, if it has a hunk
+            header ('@@ ... @@').
     Returns:
-        str: The clipped string.
+        Tuple[str, int]: The clipped string, and its number of tokens (in the units of 'num_input_tokens', if given),
+            counted from the token prefix it was decoded from. When a line or hunk is cut inside a token, that token is
+            counted.
     """
     if not text:
-        return text
+        return text, 0
+    if num_input_tokens is not None and num_input_tokens <= max_tokens:
+        return text, num_input_tokens
 
     try:
-        if num_input_tokens is None:
-            encoder = TokenEncoder.get_token_encoder()
-            num_input_tokens = len(encoder.encode(text))
-        if num_input_tokens <= max_tokens:
-            return text
-        if max_tokens < 0:
-            return ""
-
-        # calculate the number of characters to keep
-        num_chars = len(text)
-        chars_per_token = num_chars / num_input_tokens
-        factor = 0.9  # reduce by 10% to be safe
-        num_output_chars = int(factor * chars_per_token * max_tokens)
-
-        # clip the text
-        if num_output_chars > 0:
-            clipped_text = text[:num_output_chars]
-            if delete_last_line:
-                clipped_text = clipped_text.rsplit('\n', 1)[0]
-            if add_three_dots:
-                clipped_text += "\n...(truncated)"
-        else: # if the text is empty
-            clipped_text =  ""
-
-        return clipped_text
+        encoder = TokenEncoder.get_token_encoder()
+        tokens = encoder.encode(text, disallowed_special=())
+        num_tokens = len(tokens)
+        token_count_cache = get_token_count_cache()
+        if token_count_cache is not None:
+            token_count_cache.add(encoder, text, num_tokens)
+        scale = 1.0
+        if num_input_tokens is not None and num_input_tokens > num_tokens > 0:
+            scale = num_input_tokens / num_tokens  # e.g. an accurate count of the model provider
+        if num_tokens * scale <= max_tokens:
+            return text, round(num_tokens * scale)
+        if max_tokens <= 0:
+            return "", 0
+
+        suffix_tokens = len(encoder.encode(TRUNCATION_SUFFIX)) if add_three_dots else 0
+        num_kept_tokens = int(max_tokens / scale) - suffix_tokens
+        if num_kept_tokens <= 0:
+            return "", 0
+
+        # decode the kept tokens to bytes, since a token prefix can end in the middle of a multi-byte character
+        clipped_bytes = encoder.decode_bytes(tokens[:num_kept_tokens])
+        cut = -1
+        if snap_to_hunk:
+            cut = clipped_bytes.rfind(b"\n@@ ")
+        if cut < 0 and (delete_last_line or snap_to_hunk):
+            cut = clipped_bytes.rfind(b"\n")
+        if cut >= 0:
+            clipped_bytes = clipped_bytes[:cut]
+            # drop the tokens after the cut. The token that contains the cut (if any) is counted, as an upper bound
+            kept_length = 0
+            for i, token in enumerate(tokens[:num_kept_tokens]):
+                kept_length += len(encoder.decode_single_token_bytes(token))
+                if kept_length >= cut:
+                    num_kept_tokens = i + 1
+                    break
+        clipped_text = clipped_bytes.decode("utf-8", errors="ignore")
+        if add_three_dots:
+            clipped_text += TRUNCATION_SUFFIX
+        return clipped_text, round((num_kept_tokens + suffix_tokens) * scale)
     except Exception as e:
         get_logger().warning(f"Failed to clip tokens: {e}")
-        return text
+        return text, num_input_tokens if num_input_tokens is not None else len(text)  # a token has a character or more
+
+
+def clip_tokens(text: str, max_tokens: int, add_three_dots=True, num_input_tokens=None, delete_last_line=False) -> str:
+    """
+    Clip the number of tokens in a string to a maximum number of tokens.
+
+    Args:
+        text (str): The string to clip.
+        max_tokens (int): The maximum number of tokens allowed in the string.
+        add_three_dots (bool, optional): A boolean indicating whether to add three dots at the end of the clipped
+    Returns:
+        str: The clipped string.
+    """
+    clipped_text, _ = clip_tokens_with_count(text, max_tokens, add_three_dots=add_three_dots,
+                                             num_input_tokens=num_input_tokens, delete_last_line=delete_last_line)
+    return clipped_text
 
 def replace_code_tags(text):
     """
@@ -1081,71 +1128,16 @@ def find_line_number_of_relevant_line_in_file(diff_files: List[FilePatchInfo],
     position = -1
     if absolute_position is None:
         absolute_position = -1
-    re_hunk_header = re.compile(
-        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
 
     if not diff_files:
         return position, absolute_position
 
-    for file in diff_files:
-        if file.filename and (file.filename.strip() == relevant_file):
-            patch = file.patch
-            patch_lines = patch.splitlines()
-            delta = 0
-            start1, size1, start2, size2 = 0, 0, 0, 0
-            if absolute_position != -1: # matching absolute to relative
-                for i, line in enumerate(patch_lines):
-                    # new hunk
-                    if line.startswith('@@'):
-                        delta = 0
-                        match = re_hunk_header.match(line)
-                        start1, size1, start2, size2 = map(int, match.groups()[:4])
-                    elif not line.startswith('-'):
-                        delta += 1
-
-                    #
-                    absolute_position_curr = start2 + delta - 1
-
-                    if absolute_position_curr == absolute_position:
-                        position = i
-                        break
-            else:
-                # try to find the line in the patch using difflib, with some margin of error
-                matches_difflib: list[str | Any] = difflib.get_close_matches(relevant_line_in_file,
-                                                                             patch_lines, n=3, cutoff=0.93)
-                if len(matches_difflib) == 1 and matches_difflib[0].startswith('+'):
-                    relevant_line_in_file = matches_difflib[0]
-
-
-                for i, line in enumerate(patch_lines):
-                    if line.startswith('@@'):
-                        delta = 0
-                        match = re_hunk_header.match(line)
-                        start1, size1, start2, size2 = map(int, match.groups()[:4])
-                    elif not line.startswith('-'):
-                        delta += 1
-
-                    if relevant_line_in_file in line and line[0] != '-':
-                        position = i
-                        absolute_position = start2 + delta - 1
-                        break
-
-                if position == -1 and relevant_line_in_file[0] == '+':
-                    no_plus_line = relevant_line_in_file[1:].lstrip()
-                    for i, line in enumerate(patch_lines):
-                        if line.startswith('@@'):
-                            delta = 0
-                            match = re_hunk_header.match(line)
-                            start1, size1, start2, size2 = map(int, match.groups()[:4])
-                        elif not line.startswith('-'):
-                            delta += 1
-
-                        if no_plus_line in line and line[0] != '-':
-                            # The model might add a '+' to the beginning of the relevant_line_in_file even if originally
-                            # it's a context line
-                            position = i
-                            absolute_position = start2 + delta - 1
-                            break
+    diff_files_index = get_diff_files_index(diff_files)
+    file = diff_files_index.get_file(relevant_file)
+    if file is not None:
+        # see PatchLineLocator: the results of a linear scan of the patch, from indexes built once per file
+        position, absolute_position = diff_files_index.line_locator(file).locate(relevant_line_in_file,
+                                                                                 absolute_position)
     return position, absolute_position
 
 def get_rate_limit_status(github_token) -> dict:
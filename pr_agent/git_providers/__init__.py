@@ -1,11 +1,13 @@
 from starlette_context import context
 
 from pr_agent.config_loader import get_settings
+from pr_agent.git_providers.async_github_provider import AsyncGithubProvider
 from pr_agent.git_providers.git_provider import GitProvider
 from pr_agent.git_providers.github_provider import GithubProvider
 
 _GIT_PROVIDERS = {
     'github': GithubProvider,
+    'github_async': AsyncGithubProvider,
 }
 
 
@@ -0,0 +1,153 @@
+import asyncio
+import threading
+from threading import Lock
+from typing import Optional
+from urllib.parse import quote
+
+import httpx
+from github import GithubException
+
+from ..config_loader import get_settings
+from ..log import get_logger
+from .blob_cache import get_blob_cache
+from .github_provider import GithubProvider
+
+
+class _SharedAsyncClient:
+    """
+    A pooled httpx.AsyncClient, running on a dedicated event loop thread, shared by all the AsyncGithubProvider
+    instances of the process. Connections are kept alive and reused across PRs.
+    """
+    loop: Optional[asyncio.AbstractEventLoop] = None
+    client: Optional[httpx.AsyncClient] = None
+    lock = Lock()
+
+    @classmethod
+    def run(cls, coro, timeout: Optional[float] = None):
+        """Runs a coroutine on the shared event loop, and waits for its result. Must not be called from that loop."""
+        if cls.loop is None:
+            with cls.lock:
+                if cls.loop is None:
+                    cls._start()
+        return asyncio.run_coroutine_threadsafe(coro, cls.loop).result(timeout)
+
+    @classmethod
+    def _start(cls):
+        max_connections = int(get_settings().get("GITHUB.ASYNC_MAX_CONNECTIONS", 32))
+        timeout = get_settings().get("GITHUB.ASYNC_REQUEST_TIMEOUT_SEC", 30)
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, name="pr_agent_github_async", daemon=True).start()
+        cls.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=timeout, follow_redirects=True)
+        cls.loop = loop
+
+
+class AsyncGithubProvider(GithubProvider):
+    """
+    GitHub provider whose bulk API traffic (file contents, inline comment verification) runs on a shared, pooled
+    async HTTP client, without a thread per request and without blocking sleeps.
+
+    The GitProvider interface is synchronous, so the servers run agent requests that use this provider off the
+    main event loop (see 'run_off_event_loop'), and many PRs can then be processed concurrently in a single process.
+    """
+    run_off_event_loop = True
+
+    def _api_headers(self, accept: str = "application/vnd.github+json") -> dict:
+        # resolving the token may refresh an app installation token (a blocking call), so it is done by the caller
+        return {"Authorization": f"token {self.auth.token}", "Accept": accept, "X-GitHub-Api-Version": "2022-11-28"}
+
+    async def _async_request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        rate_limiter = getattr(self, "rate_limiter", None)
+        if rate_limiter:
+            await asyncio.sleep(rate_limiter.reserve_slot(method, url))
+        response = await _SharedAsyncClient.client.request(method, url, **kwargs)
+        if rate_limiter:
+            rate_limiter.update(response.status_code, {k.lower(): v for k, v in response.headers.items()})
+        return response
+
+    async def _async_fetch_file_content(self, file_path: str, ref: str, headers: dict) -> Optional[str]:
+        """Same contract as GithubProvider._fetch_file_content"""
+        try:
+            response = await self._async_request(
+                "GET", f"{self.base_url}/repos/{self.repo}/contents/{quote(file_path)}", params={"ref": ref},
+                headers=headers)
+            if response.status_code == 404:
+                return ""
+            if response.status_code != 200:
+                return None
+            return response.content.decode()
+        except Exception:
+            return None
+
+    def _fetch_file_content(self, file_path: str, branch: str) -> Optional[str]:
+        headers = self._api_headers(accept="application/vnd.github.raw+json")
+        return _SharedAsyncClient.run(self._async_fetch_file_content(file_path, branch, headers))
+
+    def _get_pr_files_contents(self, fetch_requests: list[tuple]) -> list[str]:
+        """
+        Fetches the content of several (file, sha) pairs concurrently on the shared async client. Cached contents
+        are read first, and at most 'github.max_concurrent_file_fetches' requests are in flight at once.
+        """
+        if not fetch_requests:
+            return []
+        blob_cache = get_blob_cache()
+        cache_keys = [self._pr_file_cache_key(file, sha) if blob_cache else None for file, sha in fetch_requests]
+        contents = [blob_cache.get(key) if key else None for key in cache_keys]
+        missing = [i for i, content in enumerate(contents) if content is None]
+        if missing:
+            max_concurrent = max(1, int(get_settings().get("GITHUB.MAX_CONCURRENT_FILE_FETCHES", 8)))
+            timeout = get_settings().get("GITHUB.FILE_FETCH_TIMEOUT_SEC", 30) or None
+            headers = self._api_headers(accept="application/vnd.github.raw+json")
+
+            async def fetch_all():
+                semaphore = asyncio.Semaphore(max_concurrent)
+
+                async def fetch(file, sha):
+                    async with semaphore:
+                        return await asyncio.wait_for(self._async_fetch_file_content(file.filename, sha, headers),
+                                                      timeout)
+
+                return await asyncio.gather(*[fetch(*fetch_requests[i]) for i in missing], return_exceptions=True)
+
+            for i, result in zip(missing, _SharedAsyncClient.run(fetch_all())):
+                file, sha = fetch_requests[i]
+                if isinstance(result, BaseException):
+                    get_logger().warning(f"Failed to load content of {file.filename} at {sha}, error: {result!r}")
+                    result = None
+                self._store_pr_file_content(blob_cache, cache_keys[i], result)
+                contents[i] = result or ""
+        return contents
+
+    async def _async_verify_code_comments(self, comments: list[dict], headers: dict) \
+            -> tuple[list[dict], list[tuple[dict, Exception]]]:
+        verified_comments = []
+        invalid_comments = []
+        for i, comment in enumerate(comments):
+            if i > 0 and getattr(self, "rate_limiter", None) is None:
+                await asyncio.sleep(1)  # for avoiding secondary rate limit (otherwise paced by the rate limiter)
+            try:
+                response = await self._async_request("POST", f"{self.pr.url}/reviews", headers=headers,
+                                                     json=dict(commit_id=self.last_commit_id.sha, comments=[comment]))
+            except Exception as e:
+                invalid_comments.append((comment, e))
+                continue
+            if response.status_code in (200, 201):
+                verified_comments.append(comment)
+                pending_review_id = response.json().get("id")
+                if pending_review_id is not None:
+                    try:
+                        await self._async_request("DELETE", f"{self.pr.url}/reviews/{pending_review_id}", headers=headers)
+                    except Exception:
+                        pass
+            else:
+                try:
+                    data = response.json()
+                except ValueError:
+                    data = {"message": response.text}
+                invalid_comments.append((comment, GithubException(response.status_code, data, dict(response.headers))))
+        return verified_comments, invalid_comments
+
+    def _verify_code_comments(self, comments: list[dict]) -> tuple[list[dict], list[tuple[dict, Exception]]]:
+        """Very each comment against the GitHub API and return 2 lists: 1 of verified and 1 of invalid comments"""
+        return _SharedAsyncClient.run(self._async_verify_code_comments(comments, self._api_headers()))
@@ -0,0 +1,170 @@
+import hashlib
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+from pr_agent.log import get_logger
+
+RE_COMMIT_SHA = re.compile(r"^[0-9a-f]{40}([0-9a-f]{24})?$")
+
+
+class BlobCache:
+    """
+    On-disk, content-addressed cache of repository file contents.
+
+    Entries are immutable: they are keyed either by a git blob SHA, or by a commit SHA and a path, so a cached value
+    never needs invalidation. The cache directory can be shared by all the worker processes on a host, and is bounded
+    in size by evicting the least recently used entries.
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key digest -> size in bytes, least recently used first
+        self._total_bytes = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def is_immutable_ref(ref: str) -> bool:
+        """Only full commit SHAs are safe cache keys - branch names and tags can move."""
+        return bool(ref) and bool(RE_COMMIT_SHA.match(ref))
+
+    @staticmethod
+    def make_key(repo: str, ref: str = None, path: str = None, blob_sha: str = None) -> Optional[str]:
+        """
+        Build a cache key for a file content. Returns None if the content cannot be cached safely.
+
+        Args:
+            repo: the repository full name (e.g. 'owner/repo').
+            ref: the commit SHA the content was read at.
+            path: the path of the file (or directory listing) in the repository.
+            blob_sha: the git blob SHA of the content. When given, 'ref' and 'path' are ignored.
+        """
+        if not repo:
+            return None
+        if blob_sha:
+            return f"blob:{repo}:{blob_sha}"
+        if path is None or not BlobCache.is_immutable_ref(ref):
+            return None
+        return f"path:{repo}:{ref}:{path}"
+
+    def get(self, key: str) -> Optional[str]:
+        if not key:
+            return None
+        digest = self._digest(key)
+        file_path = self._path(digest)
+        try:
+            with open(file_path, "rb") as f:
+                data = f.read()
+            content = data.decode("utf-8")
+            os.utime(file_path)  # mark as recently used, also for the other processes sharing the directory
+        except (OSError, UnicodeDecodeError):
+            with self._lock:
+                self.misses += 1
+                size = self._entries.pop(digest, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        with self._lock:
+            self.hits += 1
+            if digest in self._entries:
+                self._entries.move_to_end(digest)
+            else:  # written by another process
+                self._entries[digest] = len(data)
+                self._total_bytes += len(data)
+        return content
+
+    def put(self, key: str, content: str) -> None:
+        if not key or content is None:
+            return
+        data = content.encode("utf-8")
+        if len(data) > self.max_bytes:
+            return
+        digest = self._digest(key)
+        file_path = self._path(digest)
+        try:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), prefix=".tmp_")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, file_path)  # atomic, so concurrent readers never see a partial entry
+        except OSError as e:
+            get_logger().debug(f"Failed to write blob cache entry: {e}")
+            return
+        with self._lock:
+            previous_size = self._entries.pop(digest, 0)
+            self._entries[digest] = len(data)
+            self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "total_bytes": self._total_bytes, "max_bytes": self.max_bytes}
+
+    def _evict(self):
+        # called with the lock held. Evict down to 90% of the budget, to avoid evicting on every write
+        target_bytes = int(self.max_bytes * 0.9)
+        while self._entries and self._total_bytes > target_bytes:
+            digest, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(self._path(digest))
+            except OSError:
+                pass
+
+    def _load_index(self):
+        entries = []
+        for root, _, file_names in os.walk(self.cache_dir):
+            for file_name in file_names:
+                if file_name.startswith(".tmp_"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, file_name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, file_name, stat.st_size))
+        for _, digest, size in sorted(entries):
+            self._entries[digest] = size
+            self._total_bytes += size
+
+    @staticmethod
+    def _digest(key: str) -> str:
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, digest[:2], digest)
+
+
+class _BlobCacheInstance:
+    instance: Optional[BlobCache] = None
+    lock = Lock()
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """
+    Returns the process-wide blob cache, or None if it is disabled ('github.enable_blob_cache').
+    """
+    if not get_settings().get("GITHUB.ENABLE_BLOB_CACHE", False):
+        return None
+    if _BlobCacheInstance.instance is None:
+        with _BlobCacheInstance.lock:
+            if _BlobCacheInstance.instance is None:
+                cache_dir = get_settings().get("GITHUB.BLOB_CACHE_DIR", "") or \
+                            os.path.join(tempfile.gettempdir(), "pr_agent_blob_cache")
+                max_bytes = int(get_settings().get("GITHUB.BLOB_CACHE_MAX_MB", 512)) * 1024 * 1024
+                try:
+                    _BlobCacheInstance.instance = BlobCache(cache_dir, max_bytes)
+                except OSError as e:
+                    get_logger().warning(f"Failed to initialize blob cache at {cache_dir}, error: {e}")
+                    return None
+    return _BlobCacheInstance.instance
@@ -86,6 +86,47 @@ class GitProvider(ABC):
         finally:
             return returned_obj
 
+    # Creates (if needed) a local bare repository, and fetches the given refspecs into it. Unlike _clone_inner, the
+    # repository is kept between calls, so only the objects that are missing locally are transferred.
+    def _mirror_fetch_inner(self, repo_url: str, mirror_folder: str, refspecs: list[str],
+                            operation_timeout_in_seconds: int=None) -> None:
+        if not os.path.exists(os.path.join(mirror_folder, "HEAD")):
+            subprocess.run(["git", "init", "--bare", "--quiet", mirror_folder], check=True,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=operation_timeout_in_seconds)
+        subprocess.run([
+            "git", "-C", mirror_folder, "fetch",
+            "--quiet", "--no-tags", "--no-write-fetch-head",
+            repo_url, *refspecs
+        ], check=True,  # check=True will raise an exception if the command fails
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=operation_timeout_in_seconds)
+
+    MIRROR_FETCH_TIMEOUT_SEC = 120
+    # Updates the local bare mirror of a given url with the given refspecs. Returns the mirror folder if successful,
+    # None otherwise. Concurrent updates of the same mirror (from other threads or processes) are serialized.
+    def mirror(self, repo_url_to_mirror: str, mirror_folder: str, refspecs: list[str],
+               operation_timeout_in_seconds: int=MIRROR_FETCH_TIMEOUT_SEC) -> str|None:
+        mirror_url = self._prepare_clone_url_with_token(repo_url_to_mirror)
+        if not mirror_url:
+            get_logger().error("Mirror failed: Unable to obtain url to fetch.")
+            return None
+        try:
+            import fcntl
+            os.makedirs(os.path.dirname(os.path.abspath(mirror_folder)), exist_ok=True)
+            with open(f"{mirror_folder}.lock", "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._mirror_fetch_inner(mirror_url, mirror_folder, refspecs, operation_timeout_in_seconds)
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+            return mirror_folder
+        except Exception as e:
+            # the fetched url (and so the failed command) may contain a token, so only the original url is logged
+            error = f"git exited with status {e.returncode}" if isinstance(e, subprocess.CalledProcessError) \
+                else type(e).__name__
+            get_logger().error(f"Mirror failed: Could not fetch url.",
+                artifact={"error": error, "url": repo_url_to_mirror, "mirror_folder": mirror_folder})
+            return None
+
     @abstractmethod
     def get_files(self) -> list:
         pass
@@ -399,6 +440,20 @@ class GitProvider(ABC):
     def get_latest_commit_url(self) -> str:
         return ""
 
+    def get_diff_refs(self) -> Optional[tuple]:
+        """
+        Returns the (base SHA, head SHA) pair that determines the diff files of the PR, or None if unknown. The
+        prepared diffs are cached by this pair (see prepared_diff_cache).
+        """
+        return None
+
+    def get_diff_content_stats(self) -> Optional[dict]:
+        """
+        Returns the memory and spill statistics of the contents of the diff files (see DiffContentStore), or None if
+        their contents are not limited.
+        """
+        return None
+
     def auto_approve(self) -> bool:
         return False
 
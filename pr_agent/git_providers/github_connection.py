@@ -0,0 +1,37 @@
+import threading
+from typing import Callable
+
+
+class ThreadLocalConnection:
+    """
+    PyGithub connection that delegates to a separate connection per thread.
+
+    A PyGithub Requester keeps a single persistent connection, and its connection classes store the verb, url and
+    headers of a request on the connection between request() and getresponse(). Requests issued from several threads
+    through the same client (e.g. concurrent file fetches) would then send, and read, each other's requests. With
+    this connection, each thread has its own connection object (and HTTP session).
+    """
+
+    def __init__(self, connection_factory: Callable, *args, **kwargs):
+        self._connection_factory = connection_factory
+        self._args = args
+        self._kwargs = kwargs
+        self._local = threading.local()
+
+    def _get_connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connection_factory(*self._args, **self._kwargs)
+        return connection
+
+    def request(self, verb, url, input, headers):
+        return self._get_connection().request(verb, url, input, headers)
+
+    def getresponse(self):
+        return self._get_connection().getresponse()
+
+    def close(self):
+        return self._get_connection().close()
+
+    def __getattr__(self, name):
+        return getattr(self._get_connection(), name)
@@ -0,0 +1,166 @@
+import threading
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+
+
+class HttpResponseCache:
+    """
+    In-memory store of GitHub API responses, with their ETag / Last-Modified validators.
+
+    Cached responses are replayed with conditional requests ('If-None-Match' / 'If-Modified-Since'). A '304 Not
+    Modified' answer does not count against the GitHub rate limit, and carries no body. Entries are scoped (by
+    installation or token), so a response is never served to a client with different permissions.
+
+    The cache is bounded by its number of entries and by the total size of their bodies ('max_size', in characters):
+    least recently used entries are evicted first, and a body larger than an eighth of 'max_size' (e.g. the content
+    of a large file) is not stored, so it cannot evict the small, frequently revalidated responses.
+    """
+
+    def __init__(self, max_entries: int, max_size: int):
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        self._entries = OrderedDict()  # key -> (etag, last_modified, headers, text), least recently used first
+
+    @staticmethod
+    def make_key(scope: str, url: str, headers: dict) -> tuple:
+        return scope, url, headers.get("Accept", ""), headers.get("X-GitHub-Api-Version", "")
+
+    def get(self, key: tuple) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key: tuple, etag: Optional[str], last_modified: Optional[str], headers: dict, text: str):
+        with self._lock:
+            self._pop(key)
+            if len(text) > self.max_size // 8:
+                return
+            self._entries[key] = (etag, last_modified, headers, text)
+            self.size += len(text)
+            while len(self._entries) > self.max_entries or self.size > self.max_size:
+                self.size -= len(self._entries.popitem(last=False)[1][3])
+
+    def remove(self, key: tuple):
+        with self._lock:
+            self._pop(key)
+
+    def _pop(self, key: tuple):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[3])
+
+    def record(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries),
+                    "size_mb": round(self.size / 2 ** 20, 1),
+                    "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+
+class _CachedResponse:
+    # mimic the httplib response object, like github.Requester.RequestsResponse
+    def __init__(self, status: int, headers: dict, text: str):
+        self.status = status
+        self.headers = headers
+        self.text = text
+
+    def getheaders(self):
+        return self.headers.items()
+
+    def read(self) -> str:
+        return self.text
+
+
+class ConditionalRequestsMixin:
+    """
+    Adds conditional requests to a PyGithub connection class. GET requests are sent with the validators of the
+    cached response (if any), and a '304 Not Modified' answer is replayed as the cached '200 OK' response.
+
+    The cache key and the validators are computed in request(), from its own arguments (the validators are added to
+    a copy of its headers), and handed to getresponse() of the same thread.
+    """
+
+    def __init__(self, *args, cache: HttpResponseCache = None, cache_scope: str = "", **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.cache_scope = cache_scope
+        self._pending = threading.local()  # (key, cached response) of the request of each thread
+
+    def request(self, verb, url, input, headers):
+        pending = None
+        if self.cache is not None and verb == "GET":
+            key = HttpResponseCache.make_key(self.cache_scope, f"{self.host}:{self.port}{url}", headers)
+            cached = self.cache.get(key)
+            if cached is not None:
+                etag, last_modified, _, _ = cached
+                headers = dict(headers)
+                if etag:
+                    headers["If-None-Match"] = etag
+                if last_modified:
+                    headers["If-Modified-Since"] = last_modified
+            pending = (key, cached)
+        self._pending.request = pending
+        return super().request(verb, url, input, headers)
+
+    def getresponse(self):
+        pending = getattr(self._pending, "request", None)
+        self._pending.request = None
+        response = super().getresponse()
+        if pending is None:
+            return response
+
+        key, cached = pending
+        if response.status == 304 and cached is not None:
+            self.cache.record(hit=True)
+            _, _, cached_headers, cached_text = cached
+            headers = {k.lower(): v for k, v in cached_headers.items()}
+            headers.update({k.lower(): v for k, v in response.getheaders()})  # fresh rate limit headers
+            return _CachedResponse(200, headers, cached_text)
+
+        self.cache.record(hit=False)
+        if response.status == 200:
+            headers = dict(response.getheaders())
+            lower_headers = {k.lower(): v for k, v in headers.items()}
+            etag = lower_headers.get("etag")
+            last_modified = lower_headers.get("last-modified")
+            if (etag or last_modified) and "no-store" not in lower_headers.get("cache-control", ""):
+                self.cache.put(key, etag, last_modified, headers, response.read())
+        elif cached is not None:
+            self.cache.remove(key)
+        return response
+
+
+class _HttpCacheInstance:
+    instance: Optional[HttpResponseCache] = None
+    lock = Lock()
+
+
+def get_http_cache() -> Optional[HttpResponseCache]:
+    """
+    Returns the process-wide HTTP response cache, or None if it is disabled ('github.enable_http_cache').
+    """
+    if not get_settings().get("GITHUB.ENABLE_HTTP_CACHE", False):
+        return None
+    if _HttpCacheInstance.instance is None:
+        with _HttpCacheInstance.lock:
+            if _HttpCacheInstance.instance is None:
+                max_entries = int(get_settings().get("GITHUB.HTTP_CACHE_MAX_ENTRIES", 2000))
+                max_size = int(get_settings().get("GITHUB.HTTP_CACHE_MAX_MB", 16) * 2 ** 20)
+                _HttpCacheInstance.instance = HttpResponseCache(max_entries, max_size)
+    return _HttpCacheInstance.instance
@@ -0,0 +1,250 @@
+from dataclasses import dataclass, field
+from typing import Optional
+
+from pr_agent.log import get_logger
+
+_PR_SNAPSHOT_QUERY = """
+query($owner: String!, $name: String!, $number: Int!) {
+  repository(owner: $owner, name: $name) {
+    databaseId name nameWithOwner url isPrivate
+    owner { login }
+    defaultBranchRef { name }
+    languages(first: 100, orderBy: {field: SIZE, direction: DESC}) { edges { size node { name } } }
+    pullRequest(number: $number) {
+      databaseId number title body url state isDraft merged mergeable createdAt updatedAt
+      additions deletions changedFiles
+      author { __typename login }
+      headRefName headRefOid baseRefName baseRefOid
+      labels(first: 100) { nodes { name color } }
+      commits(first: 100) {
+        totalCount
+        pageInfo { hasNextPage endCursor }
+        nodes { commit { ...commitFields } }
+      }
+      comments(last: 100) {
+        totalCount
+        pageInfo { hasPreviousPage startCursor }
+        nodes { ...commentFields }
+      }
+    }
+  }
+}
+"""
+
+_COMMITS_PAGE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      commits(first: 100, after: $cursor) {
+        pageInfo { hasNextPage endCursor }
+        nodes { commit { ...commitFields } }
+      }
+    }
+  }
+}
+"""
+
+_COMMENTS_PAGE_QUERY = """
+query($owner: String!, $name: String!, $number: Int!, $cursor: String) {
+  repository(owner: $owner, name: $name) {
+    pullRequest(number: $number) {
+      comments(last: 100, before: $cursor) {
+        pageInfo { hasPreviousPage startCursor }
+        nodes { ...commentFields }
+      }
+    }
+  }
+}
+"""
+
+_FRAGMENTS = """
+fragment commitFields on Commit {
+  oid message url
+  author { name email date }
+  committer { name email date }
+}
+fragment commentFields on IssueComment {
+  databaseId body url createdAt updatedAt
+  author { __typename login }
+}
+"""
+
+
+@dataclass
+class PRSnapshot:
+    """
+    PR metadata loaded with GraphQL, converted to the attributes of the equivalent REST API objects, so PyGithub
+    objects can be built from them (see GithubProvider).
+    """
+    repository: dict
+    pull: dict
+    commits: list[dict] = field(default_factory=list)  # oldest first, like GET /pulls/{number}/commits
+    comments: list[dict] = field(default_factory=list)  # issue comments, oldest first
+    languages: dict = field(default_factory=dict)  # language name -> size in bytes, like GET /languages
+
+
+def get_graphql_url(api_base_url: str) -> str:
+    # https://api.github.com -> https://api.github.com/graphql, https://host/api/v3 -> https://host/api/graphql
+    api_base_url = api_base_url.rstrip("/")
+    if api_base_url.endswith("/api/v3"):
+        return api_base_url[:-len("/v3")] + "/graphql"
+    return api_base_url + "/graphql"
+
+
+def load_pr_snapshot(requester, api_base_url: str, repo_full_name: str, pr_number: int,
+                     max_pages: int = 10) -> Optional[PRSnapshot]:
+    """
+    Loads the PR metadata (title, body, head/base, labels, languages, commits and issue comments) with one GraphQL
+    request, plus one per additional page of 100 commits or comments.
+
+    Args:
+        requester: the PyGithub requester of the client (handles authentication, caching and rate limiting).
+        api_base_url: the base url of the REST API, e.g. 'https://api.github.com'.
+        repo_full_name: 'owner/repo'.
+        pr_number: the PR number.
+        max_pages: maximal number of pages loaded per connection (commits, comments).
+
+    Returns:
+        the snapshot, or None if it could not be loaded (the caller should fall back to the REST API).
+    """
+    owner, name = repo_full_name.split("/")
+    variables = {"owner": owner, "name": name, "number": pr_number}
+    graphql_url = get_graphql_url(api_base_url)
+    try:
+        repository = _query(requester, graphql_url, _PR_SNAPSHOT_QUERY, variables)["repository"]
+        pull_request = repository["pullRequest"]
+        commits_connection, comments_connection = pull_request["commits"], pull_request["comments"]
+
+        commit_nodes = list(commits_connection["nodes"])
+        page_info = commits_connection["pageInfo"]
+        for _ in range(max_pages - 1):
+            if not page_info["hasNextPage"]:
+                break
+            connection = _query(requester, graphql_url, _COMMITS_PAGE_QUERY,
+                                dict(variables, cursor=page_info["endCursor"]))["repository"]["pullRequest"]["commits"]
+            commit_nodes.extend(connection["nodes"])
+            page_info = connection["pageInfo"]
+        if page_info["hasNextPage"]:
+            return None  # an incomplete list of commits would point at a wrong last commit
+
+        comment_nodes = list(comments_connection["nodes"])
+        page_info = comments_connection["pageInfo"]
+        for _ in range(max_pages - 1):
+            if not page_info["hasPreviousPage"]:
+                break
+            connection = _query(requester, graphql_url, _COMMENTS_PAGE_QUERY,
+                                dict(variables, cursor=page_info["startCursor"]))
+            connection = connection["repository"]["pullRequest"]["comments"]
+            comment_nodes = connection["nodes"] + comment_nodes
+            page_info = connection["pageInfo"]
+        if page_info["hasPreviousPage"]:
+            return None
+    except Exception as e:
+        get_logger().warning(f"Failed to load PR snapshot with GraphQL, falling back to the REST API: {e}")
+        return None
+
+    api_base_url = api_base_url.rstrip("/")
+    repo_url = f"{api_base_url}/repos/{repo_full_name}"
+    return PRSnapshot(
+        repository=_repository_attributes(repository, repo_url),
+        pull=_pull_attributes(pull_request, repo_url, api_base_url),
+        commits=[_commit_attributes(node["commit"], repo_url) for node in commit_nodes],
+        comments=[_comment_attributes(node, repo_url, api_base_url) for node in comment_nodes],
+        languages={edge["node"]["name"]: edge["size"] for edge in repository["languages"]["edges"]},
+    )
+
+
+def _query(requester, graphql_url: str, query: str, variables: dict) -> dict:
+    headers, data = requester.requestJsonAndCheck("POST", graphql_url,
+                                                  input={"query": query + _FRAGMENTS, "variables": variables})
+    if data.get("errors") or not data.get("data"):
+        raise ValueError(f"GraphQL errors: {data.get('errors')}")
+    return data["data"]
+
+
+def _user_attributes(actor: Optional[dict], api_base_url: str) -> Optional[dict]:
+    if not actor:
+        return None
+    login = actor["login"]
+    user_type = actor.get("__typename", "User")
+    if user_type == "Bot":
+        # GraphQL returns the login of a GitHub App without the "[bot]" suffix of its REST user
+        login = f"{login}[bot]"
+    return {"login": login, "type": user_type, "url": f"{api_base_url}/users/{login}"}
+
+
+def _repository_attributes(repository: dict, repo_url: str) -> dict:
+    return {
+        "id": repository["databaseId"],
+        "name": repository["name"],
+        "full_name": repository["nameWithOwner"],
+        "url": repo_url,
+        "html_url": repository["url"],
+        "private": repository["isPrivate"],
+        "owner": {"login": repository["owner"]["login"]},
+        "default_branch": (repository.get("defaultBranchRef") or {}).get("name"),
+    }
+
+
+def _pull_attributes(pull_request: dict, repo_url: str, api_base_url: str) -> dict:
+    number = pull_request["number"]
+    mergeable = {"MERGEABLE": True, "CONFLICTING": False}.get(pull_request["mergeable"])
+    attributes = {
+        "id": pull_request["databaseId"],
+        "number": number,
+        "url": f"{repo_url}/pulls/{number}",
+        "html_url": pull_request["url"],
+        "issue_url": f"{repo_url}/issues/{number}",
+        "title": pull_request["title"],
+        "body": pull_request["body"],
+        "state": pull_request["state"].lower() if pull_request["state"] != "MERGED" else "closed",
+        "draft": pull_request["isDraft"],
+        "merged": pull_request["merged"],
+        "created_at": pull_request["createdAt"],
+        "updated_at": pull_request["updatedAt"],
+        "additions": pull_request["additions"],
+        "deletions": pull_request["deletions"],
+        "changed_files": pull_request["changedFiles"],
+        "commits": pull_request["commits"]["totalCount"],
+        "comments": pull_request["comments"]["totalCount"],
+        "user": _user_attributes(pull_request["author"], api_base_url),
+        "head": {"ref": pull_request["headRefName"], "sha": pull_request["headRefOid"]},
+        "base": {"ref": pull_request["baseRefName"], "sha": pull_request["baseRefOid"]},
+        "labels": [{"name": label["name"], "color": label["color"],
+                    "url": f"{repo_url}/labels/{label['name']}"} for label in pull_request["labels"]["nodes"]],
+    }
+    if mergeable is not None:  # otherwise, PyGithub loads it lazily from the REST API
+        attributes["mergeable"] = mergeable
+    return attributes
+
+
+def _git_actor_attributes(actor: Optional[dict]) -> Optional[dict]:
+    if not actor:
+        return None
+    return {"name": actor["name"], "email": actor["email"], "date": actor["date"]}
+
+
+def _commit_attributes(commit: dict, repo_url: str) -> dict:
+    return {
+        "sha": commit["oid"],
+        "url": f"{repo_url}/commits/{commit['oid']}",
+        "html_url": commit["url"],
+        "commit": {
+            "message": commit["message"],
+            "url": f"{repo_url}/git/commits/{commit['oid']}",
+            "author": _git_actor_attributes(commit["author"]),
+            "committer": _git_actor_attributes(commit["committer"]),
+        },
+    }
+
+
+def _comment_attributes(comment: dict, repo_url: str, api_base_url: str) -> dict:
+    return {
+        "id": comment["databaseId"],
+        "body": comment["body"],
+        "url": f"{repo_url}/issues/comments/{comment['databaseId']}",
+        "html_url": comment["url"],
+        "created_at": comment["createdAt"],
+        "updated_at": comment["updatedAt"],
+        "user": _user_attributes(comment["author"], api_base_url),
+    }
@@ -6,27 +6,92 @@ import re
 import time
 import traceback
 import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
 from datetime import datetime
+from functools import partial
+from threading import Lock
 from typing import Optional, Tuple
 from urllib.parse import urlparse
 
+from github.Commit import Commit
 from github.Issue import Issue
-from github import AppAuthentication, Auth, Github, GithubException
+from github.IssueComment import IssueComment
+from github.PullRequest import PullRequest
+from github.Repository import Repository
+from github import (AppAuthentication, Auth, Github, GithubException,
+                    UnknownObjectException)
+from github.Requester import (HTTPRequestsConnectionClass,
+                              HTTPSRequestsConnectionClass)
 from retry import retry
 from starlette_context import context
 
+from ..algo.diff_content_store import DiffContentStore, create_diff_content_store
+from ..algo.diff_files_index import get_diff_files_index
 from ..algo.file_filter import filter_ignored
-from ..algo.git_patch_processing import extract_hunk_headers
+from ..algo.git_patch_processing import parse_patch
 from ..algo.language_handler import is_valid_file
-from ..algo.types import EDIT_TYPE
+from ..algo.types import EDIT_TYPE, LazyFilePatchInfo
 from ..algo.utils import (PRReviewHeader, Range, clip_tokens,
                           find_line_number_of_relevant_line_in_file,
                           load_large_diff, set_file_languages)
 from ..config_loader import get_settings
 from ..log import get_logger
 from ..servers.utils import RateLimitExceeded
+from .blob_cache import BlobCache, get_blob_cache
 from .git_provider import (MAX_FILES_ALLOWED_FULL, FilePatchInfo, GitProvider,
                            IncrementalPR)
+from .github_connection import ThreadLocalConnection
+from .github_http_cache import ConditionalRequestsMixin, get_http_cache
+from .github_pr_snapshot import PRSnapshot, load_pr_snapshot
+from .inline_comment_validator import (CommentValidity, parse_diff_lines,
+                                       predict_comment_validity)
+from .local_git_mirror import LocalGitMirror
+from .rate_limiter import RateLimitedConnectionMixin, get_rate_limiter
+
+
+class _PRFileContentsLoader:
+    """
+    Loads the contents of the diff files of a PR on demand (see LazyFilePatchInfo). Only the files whose contents are
+    needed are loaded, up to 'max_files' of them: the contents of the other files are empty, and their patches are
+    used as is. Contents that cannot exist are not fetched (the base of an added file, the head of a removed one).
+    """
+
+    def __init__(self, git_provider: "GithubProvider", head_sha: str, base_sha: str, max_files: int):
+        self.git_provider = git_provider
+        self.shas = {"head": head_sha, "base": base_sha}
+        self.max_files = max_files
+        self.github_files = {}  # filename -> file of the PR (from the GitHub API)
+        self.loaded_files = set()  # names of the files whose contents were loaded
+        self.skipped_files = set()  # names of the files whose contents were needed, but not loaded (over the limit)
+        self.num_fetches = 0
+        self._lock = Lock()
+
+    def load_contents(self, requests: list[tuple]) -> list[str]:
+        contents = [""] * len(requests)
+        fetch_indexes = []
+        fetch_requests = []
+        with self._lock:
+            for i, (file, side) in enumerate(requests):
+                github_file = self.github_files.get(file.filename)
+                if github_file is None or github_file.status == ("added" if side == "base" else "removed"):
+                    continue
+                if file.filename not in self.loaded_files:
+                    if len(self.loaded_files) >= self.max_files:
+                        if not self.skipped_files:
+                            get_logger().info(f"Loaded the full content of {self.max_files} files, "
+                                              f"will avoid loading full content for rest of files")
+                        self.skipped_files.add(file.filename)
+                        continue
+                    self.loaded_files.add(file.filename)
+                fetch_indexes.append(i)
+                fetch_requests.append((github_file, self.shas[side]))
+            self.num_fetches += len(fetch_requests)
+        for i, content in zip(fetch_indexes, self.git_provider._get_pr_files_contents(fetch_requests)):
+            contents[i] = content
+        return contents
 
 
 class GithubProvider(GitProvider):
@@ -43,14 +108,16 @@ class GithubProvider(GitProvider):
         self.repo = None
         self.pr_num = None
         self.pr = None
+        self.pr_snapshot = None
         self.issue_main = None
         self.github_user_id = None
         self.diff_files = None
+        self.diff_content_store = None  # the memory budget of the contents of the diff files (see get_diff_files)
         self.git_files = None
         self.incremental = IncrementalPR(False)
         if pr_url and 'pull' in pr_url:
             self.set_pr(pr_url)
-            self.pr_commits = list(self.pr.get_commits())
+            self.pr_commits = self._get_pr_commits()
             self.last_commit_id = self.pr_commits[-1]
             self.pr_url = self.get_pr_url() # pr_url for github actions can be as api.github.com, so we need to get the url from the pr object
         elif pr_url and 'issue' in pr_url: #url is an issue
@@ -147,11 +214,32 @@ class GithubProvider(GitProvider):
 
     def set_pr(self, pr_url: str):
         self.repo, self.pr_num = self._parse_pr_url(pr_url)
+        self.pr_snapshot = self._load_pr_snapshot()
         self.pr = self._get_pr()
 
+    def _load_pr_snapshot(self) -> Optional[PRSnapshot]:
+        """
+        Loads the PR metadata with a single GraphQL query ('github.use_graphql_snapshot'), instead of separate REST
+        calls for the repo, the PR, its commits and its comments. Returns None if disabled or failed.
+        """
+        if not get_settings().get("GITHUB.USE_GRAPHQL_SNAPSHOT", False):
+            return None
+        requester = self.github_client._Github__requester
+        snapshot = load_pr_snapshot(requester, self.base_url, self.repo, self.pr_num)
+        if snapshot:
+            # PyGithub objects built from the snapshot load any missing attribute lazily from the REST API
+            self.repo_obj = Repository(requester, {}, snapshot.repository, completed=False)
+        return snapshot
+
+    def _get_pr_commits(self) -> list:
+        if self.pr_snapshot:
+            return [Commit(self.pr._requester, {}, attributes, completed=False)
+                    for attributes in self.pr_snapshot.commits]
+        return list(self.pr.get_commits())
+
     def _get_incremental_commits(self):
         if not self.pr_commits:
-            self.pr_commits = list(self.pr.get_commits())
+            self.pr_commits = self._get_pr_commits()
 
         self.previous_review = self.get_previous_review(full=True, incremental=True)
         if self.previous_review:
@@ -183,7 +271,11 @@ class GithubProvider(GitProvider):
         if not (full or incremental):
             raise ValueError("At least one of full or incremental must be True")
         if not getattr(self, "comments", None):
-            self.comments = list(self.pr.get_issue_comments())
+            if getattr(self, "pr_snapshot", None):
+                self.comments = [IssueComment(self.pr._requester, {}, attributes, completed=False)
+                                 for attributes in self.pr_snapshot.comments]
+            else:
+                self.comments = list(self.pr.get_issue_comments())
         prefixes = []
         if full:
             prefixes.append(PRReviewHeader.REGULAR.value)
@@ -239,6 +331,16 @@ class GithubProvider(GitProvider):
             if self.diff_files:
                 return self.diff_files
 
+            if not self.incremental.is_incremental:
+                diff_files = self._get_diff_files_from_mirror()  # None if disabled or failed
+                if diff_files is not None:
+                    self.diff_files = diff_files
+                    try:
+                        context["diff_files"] = diff_files
+                    except Exception:
+                        pass
+                    return diff_files
+
             # filter files using [ignore] patterns
             files_original = self.get_files()
             files = filter_ignored(files_original)
@@ -272,69 +374,63 @@ class GithubProvider(GitProvider):
                 get_logger().info(
                     f"Using merge base commit {merge_base_commit.sha} instead of base commit ")
 
+            # the contents of the files with a patch are loaded only if (and when) they are needed
+            self.diff_content_store = create_diff_content_store()
+            contents_loader = None
+            if get_settings().get("GITHUB.LAZY_FILE_CONTENTS", True) and not self.incremental.is_incremental:
+                contents_loader = _PRFileContentsLoader(self, self.pr.head.sha, merge_base_commit.sha,
+                                                        MAX_FILES_ALLOWED_FULL)
+
+            # first pass: decide which file contents need to be loaded, so they can be fetched concurrently
+            valid_files = []
+            fetch_requests = []  # (file, sha) pairs, in file order
             counter_valid = 0
             for file in files:
                 if not is_valid_file(file.filename):
                     invalid_files_names.append(file.filename)
                     continue
 
-                patch = file.patch
-                if is_close_to_rate_limit:
-                    new_file_content_str = ""
-                    original_file_content_str = ""
-                else:
+                load_head = load_base = False
+                if contents_loader is not None and file.patch:
+                    contents_loader.github_files[file.filename] = file
+                elif not is_close_to_rate_limit:
                     # allow only a limited number of files to be fully loaded. We can manage the rest with diffs only
                     counter_valid += 1
                     avoid_load = False
-                    if counter_valid >= MAX_FILES_ALLOWED_FULL and patch and not self.incremental.is_incremental:
+                    if counter_valid >= MAX_FILES_ALLOWED_FULL and file.patch and not self.incremental.is_incremental:
                         avoid_load = True
                         if counter_valid == MAX_FILES_ALLOWED_FULL:
                             get_logger().info(f"Too many files in PR, will avoid loading full content for rest of files")
+                    load_head = load_base = not avoid_load
 
-                    if avoid_load:
-                        new_file_content_str = ""
+                if load_head:
+                    fetch_requests.append((file, self.pr.head.sha))
+                if load_base:
+                    if self.incremental.is_incremental and self.unreviewed_files_set:
+                        fetch_requests.append((file, self.incremental.last_seen_commit_sha))
                     else:
-                        new_file_content_str = self._get_pr_file_content(file, self.pr.head.sha)  # communication with GitHub
+                        fetch_requests.append((file, merge_base_commit.sha))
+                        # fetch_requests.append((file, self.pr.base.sha))
+                valid_files.append((file, load_head, load_base))
+
+            fetched_contents = iter(self._get_pr_files_contents(fetch_requests))  # communication with GitHub
 
+            for file, load_head, load_base in valid_files:
+                patch = file.patch
+                new_file_content_str = next(fetched_contents) if load_head else ""
+                original_file_content_str = next(fetched_contents) if load_base else ""
+                if load_head:
                     if self.incremental.is_incremental and self.unreviewed_files_set:
-                        original_file_content_str = self._get_pr_file_content(file, self.incremental.last_seen_commit_sha)
                         patch = load_large_diff(file.filename, new_file_content_str, original_file_content_str)
                         self.unreviewed_files_set[file.filename] = patch
-                    else:
-                        if avoid_load:
-                            original_file_content_str = ""
-                        else:
-                            original_file_content_str = self._get_pr_file_content(file, merge_base_commit.sha)
-                            # original_file_content_str = self._get_pr_file_content(file, self.pr.base.sha)
-                        if not patch:
-                            patch = load_large_diff(file.filename, new_file_content_str, original_file_content_str)
-
-
-                if file.status == 'added':
-                    edit_type = EDIT_TYPE.ADDED
-                elif file.status == 'removed':
-                    edit_type = EDIT_TYPE.DELETED
-                elif file.status == 'renamed':
-                    edit_type = EDIT_TYPE.RENAMED
-                elif file.status == 'modified':
-                    edit_type = EDIT_TYPE.MODIFIED
-                else:
-                    get_logger().error(f"Unknown edit type: {file.status}")
-                    edit_type = EDIT_TYPE.UNKNOWN
+                    elif not patch:
+                        patch = load_large_diff(file.filename, new_file_content_str, original_file_content_str)
 
-                # count number of lines added and removed
-                if hasattr(file, 'additions') and hasattr(file, 'deletions'):
-                    num_plus_lines = file.additions
-                    num_minus_lines = file.deletions
-                else:
-                    patch_lines = patch.splitlines(keepends=True)
-                    num_plus_lines = len([line for line in patch_lines if line.startswith('+')])
-                    num_minus_lines = len([line for line in patch_lines if line.startswith('-')])
-
-                file_patch_canonical_structure = FilePatchInfo(original_file_content_str, new_file_content_str, patch,
-                                                               file.filename, edit_type=edit_type,
-                                                               num_plus_lines=num_plus_lines,
-                                                               num_minus_lines=num_minus_lines,)
+                lazy_contents = contents_loader is not None and file.filename in contents_loader.github_files
+                file_patch_canonical_structure = self._build_file_patch_info(
+                    file, patch, original_file_content_str, new_file_content_str,
+                    contents_loader=contents_loader if lazy_contents else None,
+                    content_store=self.diff_content_store)
                 diff_files.append(file_patch_canonical_structure)
             if invalid_files_names:
                 get_logger().info(f"Filtered out files with invalid extensions: {invalid_files_names}")
@@ -352,12 +448,130 @@ class GithubProvider(GitProvider):
                                artifact={"traceback": traceback.format_exc()})
             raise RateLimitExceeded("Rate limit exceeded for GitHub API.") from e
 
+    @staticmethod
+    def _build_file_patch_info(file, patch: str, original_file_content_str: str,
+                               new_file_content_str: str, contents_loader=None,
+                               content_store: Optional[DiffContentStore] = None) -> FilePatchInfo:
+        if file.status == 'added':
+            edit_type = EDIT_TYPE.ADDED
+        elif file.status == 'removed':
+            edit_type = EDIT_TYPE.DELETED
+        elif file.status == 'renamed':
+            edit_type = EDIT_TYPE.RENAMED
+        elif file.status == 'modified':
+            edit_type = EDIT_TYPE.MODIFIED
+        else:
+            get_logger().error(f"Unknown edit type: {file.status}")
+            edit_type = EDIT_TYPE.UNKNOWN
+
+        # count number of lines added and removed
+        if hasattr(file, 'additions') and hasattr(file, 'deletions'):
+            num_plus_lines = file.additions
+            num_minus_lines = file.deletions
+        else:
+            patch_lines = patch.splitlines(keepends=True)
+            num_plus_lines = len([line for line in patch_lines if line.startswith('+')])
+            num_minus_lines = len([line for line in patch_lines if line.startswith('-')])
+
+        if contents_loader is not None or content_store is not None:
+            file_patch_info = LazyFilePatchInfo(patch, file.filename, contents_loader, content_store=content_store,
+                                                edit_type=edit_type,
+                                                num_plus_lines=num_plus_lines,
+                                                num_minus_lines=num_minus_lines)
+            if contents_loader is None:  # the contents are already loaded, and are kept by the store
+                file_patch_info.base_file = original_file_content_str
+                file_patch_info.head_file = new_file_content_str
+            return file_patch_info
+        return FilePatchInfo(original_file_content_str, new_file_content_str, patch,
+                             file.filename, edit_type=edit_type,
+                             num_plus_lines=num_plus_lines,
+                             num_minus_lines=num_minus_lines,)
+
+    def _get_local_mirror(self) -> Optional[LocalGitMirror]:
+        """
+        Updates the local bare mirror of the repository with the PR head and base branch, and returns it.
+        Returns None if the mirror is disabled ('github.use_local_mirror'), or could not be updated.
+        """
+        if not get_settings().get("GITHUB.USE_LOCAL_MIRROR", False):
+            return None
+        mirror_dir = get_settings().get("GITHUB.LOCAL_MIRROR_DIR", "") or \
+                     os.path.join(tempfile.gettempdir(), "pr_agent_git_mirrors")
+        mirror_folder = os.path.join(mirror_dir, f"{self.repo}.git")
+        timeout = get_settings().get("GITHUB.LOCAL_MIRROR_FETCH_TIMEOUT_SEC", GitProvider.MIRROR_FETCH_TIMEOUT_SEC)
+        refspecs = [f"+refs/pull/{self.pr_num}/head:refs/pull/{self.pr_num}/head",
+                    f"+refs/heads/{self.pr.base.ref}:refs/heads/{self.pr.base.ref}"]
+        if not self.mirror(self.get_git_repo_url(self.pr_url), mirror_folder, refspecs, timeout):
+            return None
+        local_mirror = LocalGitMirror(mirror_folder)
+        if not local_mirror.has_commits(self.pr.head.sha, self.pr.base.sha):
+            get_logger().warning(f"Local mirror of {self.repo} does not contain the PR commits")
+            return None
+        return local_mirror
+
+    def _get_diff_files_from_mirror(self) -> Optional[list[FilePatchInfo]]:
+        """
+        Computes the diff files (merge base, patches, and base and head contents) from a local bare mirror of the
+        repository, with a single incremental 'git fetch' instead of per-file REST calls. Since the contents are read
+        locally, they are loaded for all the files (no MAX_FILES_ALLOWED_FULL cap).
+        Returns None if the diff could not be computed locally, so the caller can fall back to the REST API.
+        """
+        try:
+            local_mirror = self._get_local_mirror()
+            if not local_mirror:
+                return None
+            head_sha = self.pr.head.sha
+            merge_base_sha = local_mirror.merge_base(self.pr.base.sha, head_sha) or self.pr.base.sha
+            if merge_base_sha != self.pr.base.sha:
+                get_logger().info(f"Using merge base commit {merge_base_sha} instead of base commit ")
+            files_original = local_mirror.diff_files(merge_base_sha, head_sha)
+            if files_original is None:
+                return None
+
+            # filter files using [ignore] patterns
+            files = filter_ignored(files_original)
+            invalid_files_names = [file.filename for file in files if not is_valid_file(file.filename)]
+            files = [file for file in files if is_valid_file(file.filename)]
+
+            read_requests = []
+            for file in files:
+                read_requests.append((head_sha, file.filename))
+                read_requests.append((merge_base_sha, file.previous_filename or file.filename))
+            contents = local_mirror.read_files(read_requests)
+
+            diff_files = []
+            self.diff_content_store = create_diff_content_store()
+            for i, file in enumerate(files):
+                new_file_content_str, original_file_content_str = contents[2 * i], contents[2 * i + 1]
+                contents[2 * i] = contents[2 * i + 1] = None  # let the store keep (or spill) them
+                patch = file.patch
+                if not patch:
+                    patch = load_large_diff(file.filename, new_file_content_str, original_file_content_str)
+                diff_files.append(self._build_file_patch_info(file, patch, original_file_content_str,
+                                                              new_file_content_str,
+                                                              content_store=self.diff_content_store))
+            if invalid_files_names:
+                get_logger().info(f"Filtered out files with invalid extensions: {invalid_files_names}")
+            get_logger().info(f"Computed {len(diff_files)} diff files from local mirror of {self.repo}")
+            return diff_files
+        except Exception as e:
+            get_logger().warning(f"Failed to compute diff files from local mirror, falling back to the API: {e}")
+            return None
+
     def _publish_description_impl(self, pr_title: str, pr_body: str):
         self.pr.edit(title=pr_title, body=pr_body)
 
     def get_latest_commit_url(self) -> str:
         return self.last_commit_id.html_url
 
+    def get_diff_refs(self) -> Optional[tuple]:
+        # in incremental mode, the diff files depend on the last reviewed commit too
+        if self.incremental.is_incremental or not getattr(self, "pr", None):
+            return None
+        return self.pr.base.sha, self.pr.head.sha
+
+    def get_diff_content_stats(self) -> Optional[dict]:
+        return self.diff_content_store.stats() if self.diff_content_store is not None else None
+
     def get_comment_url(self, comment) -> str:
         return comment.html_url
 
@@ -411,6 +625,11 @@ class GithubProvider(GitProvider):
         return dict(body=body, path=path, position=position) if subject_type == "LINE" else {}
 
     def _publish_inline_comments_impl(self, comments: list[dict], disable_fallback: bool = False):
+        valid_comments = []
+        if get_settings().get("GITHUB.VALIDATE_INLINE_COMMENTS_OFFLINE", False):
+            comments, valid_comments = self._validate_inline_comments_offline(comments)
+            if not comments:
+                return
         try:
             # publish all comments in a single message
             self.pr.create_review(commit=self.last_commit_id, comments=comments)
@@ -418,16 +637,62 @@ class GithubProvider(GitProvider):
             get_logger().info(f"Initially failed to publish inline comments as committable")
 
             if (getattr(e, "status", None) == 422 and not disable_fallback):
-                pass  # continue to try _publish_inline_comments_fallback_with_verification
+                pass  # continue to try the fallback
             else:
                 raise e # will end up with publishing the comments one by one
 
             try:
-                self._publish_inline_comments_fallback_with_verification(comments)
+                if get_settings().get("GITHUB.INLINE_COMMENTS_FALLBACK", "bisect") == "verify":
+                    self._publish_inline_comments_fallback_with_verification(comments, valid_comments)
+                else:
+                    self._publish_inline_comments_fallback_with_bisection(comments, valid_comments)
             except Exception as e:
                 get_logger().error(f"Failed to publish inline code comments fallback, error: {e}")
                 raise e
 
+    def _validate_inline_comments_offline(self, comments: list[dict]) -> tuple[list[dict], list[dict]]:
+        """
+        Predicts, from the hunks of the PR diff, which inline comments GitHub would reject, before publishing them.
+        Invalid comments are fixed (see _try_fix_invalid_inline_comments) when the fix is predicted to be valid,
+        and dropped otherwise.
+
+        Returns:
+            the comments to publish, and the subset of them that is predicted to be valid. The rest is uncertain,
+            and is verified against the GitHub API if the review is rejected.
+        """
+        if self.incremental.is_incremental:
+            return comments, []  # the diff files only cover the new commits, not the diff GitHub validates against
+        try:
+            diff_lines_by_file = {}
+            for file in self.get_diff_files():
+                diff_lines_by_file[file.filename] = parse_diff_lines(file.patch) if file.patch else None
+        except Exception as e:
+            get_logger().warning(f"Failed to validate inline comments offline: {e}")
+            return comments, []
+
+        comments_to_publish, valid_comments, invalid_comments = [], [], []
+        for comment in comments:
+            validity = predict_comment_validity(comment, diff_lines_by_file.get(comment.get("path")))
+            if validity == CommentValidity.INVALID:
+                invalid_comments.append(comment)
+                continue
+            comments_to_publish.append(comment)
+            if validity == CommentValidity.VALID:
+                valid_comments.append(comment)
+
+        if invalid_comments:
+            fixed_comments = []
+            if get_settings().github.try_fix_invalid_inline_comments:
+                fixed_comments = [comment for comment in self._try_fix_invalid_inline_comments(invalid_comments)
+                                  if predict_comment_validity(comment, diff_lines_by_file.get(comment.get("path")))
+                                  == CommentValidity.VALID]
+            comments_to_publish.extend(fixed_comments)
+            valid_comments.extend(fixed_comments)
+            get_logger().info(f"Predicted {len(invalid_comments)} invalid inline comments, "
+                              f"fixed {len(fixed_comments)} of them as single line comments",
+                              artifact={"invalid_comments": invalid_comments})
+        return comments_to_publish, valid_comments
+
     def get_review_thread_comments(self, comment_id: int) -> list[dict]:
         """
         Retrieves all comments in the same thread as the given comment.
@@ -462,13 +727,21 @@ class GithubProvider(GitProvider):
             get_logger().exception(f"Failed to get review comments for an inline ask command", artifact={"comment_id": comment_id, "error": e})
             return []
 
-    def _publish_inline_comments_fallback_with_verification(self, comments: list[dict]):
+    def _publish_inline_comments_fallback_with_verification(self, comments: list[dict],
+                                                            valid_comments: list[dict] = None):
         """
         Check each inline comment separately against the GitHub API and discard of invalid comments,
         then publish all the remaining valid comments in a single review.
         For invalid comments, also try removing the suggestion part and posting the comment just on the first line.
+        Comments in 'valid_comments' (predicted to be valid offline) are not verified again.
         """
-        verified_comments, invalid_comments = self._verify_code_comments(comments)
+        valid_comments_ids = {id(comment) for comment in valid_comments or []}
+        comments_to_verify = [comment for comment in comments if id(comment) not in valid_comments_ids]
+        if not comments_to_verify:  # the review was rejected although all the comments were predicted valid
+            valid_comments_ids, comments_to_verify = set(), comments
+        verified_comments, invalid_comments = self._verify_code_comments(comments_to_verify)
+        verified_comments_ids = valid_comments_ids | {id(comment) for comment in verified_comments}
+        verified_comments = [comment for comment in comments if id(comment) in verified_comments_ids]
 
         # publish as a group the verified comments
         if verified_comments:
@@ -483,11 +756,58 @@ class GithubProvider(GitProvider):
                 [comment for comment, _ in invalid_comments])
             for comment in fixed_comments_as_one_liner:
                 try:
-                    self.publish_inline_comments([comment], disable_fallback=True)
+                    self._publish_inline_comments_impl([comment], disable_fallback=True)
                     get_logger().info(f"Published invalid comment as a single line comment: {comment}")
                 except:
                     get_logger().error(f"Failed to publish invalid comment as a single line comment: {comment}")
 
+    def _publish_inline_comments_fallback_with_bisection(self, comments: list[dict],
+                                                         valid_comments: list[dict] = None):
+        """
+        Publish the comments as grouped reviews, isolating the comments GitHub rejects by splitting a rejected batch
+        in halves recursively: k invalid comments out of n cost O(k log n) requests, instead of one per comment.
+        Comments in 'valid_comments' (predicted to be valid offline) are batched together, apart from the uncertain
+        ones.
+        For rejected comments, also try removing the suggestion part and posting the comment just on the first line.
+        """
+        valid_comments_ids = {id(comment) for comment in valid_comments or []}
+        batches = [[comment for comment in comments if id(comment) in valid_comments_ids],
+                   [comment for comment in comments if id(comment) not in valid_comments_ids]]
+        rejected_comments = []
+        for batch in batches:
+            # a batch with all the comments is the review that was just rejected, so it is split right away
+            rejected_comments.extend(self._publish_review_bisecting(batch, is_rejected=len(batch) == len(comments)))
+
+        if rejected_comments and get_settings().github.try_fix_invalid_inline_comments:
+            fixed_comments_as_one_liner = self._try_fix_invalid_inline_comments(rejected_comments)
+            rejected_fixed_comments = self._publish_review_bisecting(fixed_comments_as_one_liner)
+            get_logger().info(f"Published {len(fixed_comments_as_one_liner) - len(rejected_fixed_comments)} "
+                              f"invalid comments as single line comments")
+        if rejected_comments:
+            get_logger().info(f"{len(rejected_comments)} inline comments were rejected by GitHub",
+                              artifact={"rejected_comments": rejected_comments})
+
+    def _publish_review_bisecting(self, comments: list[dict], is_rejected: bool = False) -> list[dict]:
+        """
+        Publishes the comments in a single review, or, if GitHub rejects it, each half of them recursively.
+        'is_rejected' means that GitHub already rejected a review of these comments.
+        Returns the comments that could not be published.
+        """
+        if not comments:
+            return []
+        if not is_rejected:
+            try:
+                self.pr.create_review(commit=self.last_commit_id, comments=comments)
+                return []
+            except Exception as e:
+                if getattr(e, "status", None) != 422:
+                    get_logger().warning(f"Failed to publish a review of {len(comments)} inline comments, error: {e}")
+                    return comments
+        if len(comments) == 1:
+            return comments
+        middle = len(comments) // 2
+        return self._publish_review_bisecting(comments[:middle]) + self._publish_review_bisecting(comments[middle:])
+
     def _verify_code_comment(self, comment: dict):
         is_verified = False
         e = None
@@ -514,7 +834,8 @@ class GithubProvider(GitProvider):
         verified_comments = []
         invalid_comments = []
         for comment in comments:
-            time.sleep(1)  # for avoiding secondary rate limit
+            if getattr(self, "rate_limiter", None) is None:
+                time.sleep(1)  # for avoiding secondary rate limit. Otherwise, writes are paced by the rate limiter
             is_verified, e = self._verify_code_comment(comment)
             if is_verified:
                 verified_comments.append(comment)
@@ -715,6 +1036,8 @@ class GithubProvider(GitProvider):
         return self.pr.title
 
     def get_languages(self):
+        if getattr(self, "pr_snapshot", None) and self.pr_snapshot.repository["full_name"] == self.repo:
+            return dict(self.pr_snapshot.languages)
         languages = self._get_repo().get_languages()
         return languages
 
@@ -864,6 +1187,7 @@ class GithubProvider(GitProvider):
             auth = AppAuthentication(app_id=app_id, private_key=private_key,
                                      installation_id=self.installation_id)
             self.auth = auth
+            cache_scope = f"app:{app_id}:{self.installation_id}"
         elif self.deployment_type == 'user':
             try:
                 token = get_settings().github.user_token
@@ -872,11 +1196,44 @@ class GithubProvider(GitProvider):
                     "GitHub token is required when using user deployment. See: "
                     "https://github.com/Codium-ai/pr-agent#method-2-run-from-source") from e
             self.auth = Auth.Token(token)
+            cache_scope = f"token:{token}"
         if self.auth:
-            return Github(auth=self.auth, base_url=self.base_url)
+            github_client = Github(auth=self.auth, base_url=self.base_url)
+            self._install_transport(github_client, cache_scope)
+            return github_client
         else:
             raise ValueError("Could not authenticate to GitHub")
 
+    def _install_transport(self, github_client: Github, scope: str) -> None:
+        """
+        Gives each thread its own connection of the client (see ThreadLocalConnection), and routes its requests
+        through the process-wide HTTP cache and the shared rate limiter of its credentials ('scope'), when enabled.
+        """
+        self.rate_limiter = get_rate_limiter(scope)
+        self.thread_safe_transport = False
+        cache = get_http_cache()
+        mixins = tuple(mixin for mixin, enabled in ((RateLimitedConnectionMixin, self.rate_limiter),
+                                                    (ConditionalRequestsMixin, cache)) if enabled)
+        try:
+            requester = github_client._Github__requester
+            if requester._Requester__scheme == "https":
+                base_connection_class = HTTPSRequestsConnectionClass
+            else:
+                base_connection_class = HTTPRequestsConnectionClass
+            if mixins:
+                connection_class = type("GithubConnectionClass", mixins + (base_connection_class,), {})
+                cache_scope = hashlib.sha256(scope.encode("utf-8")).hexdigest()  # never keep credentials in the keys
+                connection_class = partial(connection_class, cache=cache, cache_scope=cache_scope,
+                                           rate_limiter=self.rate_limiter)
+            else:
+                connection_class = base_connection_class
+            requester._Requester__connectionClass = partial(ThreadLocalConnection, connection_class)
+            self.thread_safe_transport = True
+            if cache:
+                get_logger().debug("GitHub HTTP cache stats", artifact=cache.stats())
+        except Exception as e:
+            get_logger().warning(f"Failed to install GitHub transport: {e}")
+
     def _get_repo(self):
         if hasattr(self, 'repo_obj') and \
                 hasattr(self.repo_obj, 'full_name') and \
@@ -888,18 +1245,40 @@ class GithubProvider(GitProvider):
 
 
     def _get_pr(self):
+        if getattr(self, "pr_snapshot", None):
+            return PullRequest(self.github_client._Github__requester, {}, self.pr_snapshot.pull, completed=False)
         return self._get_repo().get_pull(self.pr_num)
 
     def get_pr_file_content(self, file_path: str, branch: str) -> str:
+        blob_cache = get_blob_cache()
+        cache_key = BlobCache.make_key(self.repo, ref=branch, path=file_path) if blob_cache else None
+        if cache_key:
+            file_content_str = blob_cache.get(cache_key)
+            if file_content_str is not None:
+                return file_content_str
+
+        file_content_str = self._fetch_file_content(file_path, branch)
+        if file_content_str is None:
+            return ""
+        if cache_key:
+            blob_cache.put(cache_key, file_content_str)
+        return file_content_str
+
+    def _fetch_file_content(self, file_path: str, branch: str) -> Optional[str]:
+        """
+        Returns the content of a file at a given ref, an empty string if the file does not exist at that ref,
+        or None if the content could not be loaded (and therefore should not be cached).
+        """
         try:
-            file_content_str = str(
+            return str(
                 self._get_repo()
                 .get_contents(file_path, ref=branch)
                 .decoded_content.decode()
             )
+        except UnknownObjectException:
+            return ""
         except Exception:
-            file_content_str = ""
-        return file_content_str
+            return None
 
     def create_or_update_pr_file(
         self, file_path: str, branch: str, contents="", message=""
@@ -920,8 +1299,75 @@ class GithubProvider(GitProvider):
             branch=branch,
         )
 
+    def _pr_file_cache_key(self, file: FilePatchInfo, sha: str) -> Optional[str]:
+        # the blob SHA of a PR file describes its content at the PR head, so identical blobs are shared across
+        # commits and PRs. For removed files (and for files of a single commit, in incremental mode) it does not
+        blob_sha = getattr(file, "sha", None)
+        if (blob_sha and self.pr and sha == self.pr.head.sha
+                and getattr(file, "status", None) != "removed" and not self.incremental.is_incremental):
+            return BlobCache.make_key(self.repo, blob_sha=blob_sha)
+        return BlobCache.make_key(self.repo, ref=sha, path=file.filename)
+
+    @staticmethod
+    def _store_pr_file_content(blob_cache: Optional[BlobCache], cache_key: Optional[str],
+                               file_content_str: Optional[str]) -> None:
+        if not (blob_cache and cache_key) or file_content_str is None:
+            return
+        if not file_content_str and cache_key.startswith("blob:"):  # never store a missing file under a blob SHA
+            return
+        blob_cache.put(cache_key, file_content_str)
+
     def _get_pr_file_content(self, file: FilePatchInfo, sha: str) -> str:
-        return self.get_pr_file_content(file.filename, sha)
+        blob_cache = get_blob_cache()
+        cache_key = self._pr_file_cache_key(file, sha) if blob_cache else None
+        if cache_key:
+            file_content_str = blob_cache.get(cache_key)
+            if file_content_str is not None:
+                return file_content_str
+        file_content_str = self._fetch_file_content(file.filename, sha)
+        self._store_pr_file_content(blob_cache, cache_key, file_content_str)
+        return file_content_str or ""
+
+    def _get_pr_files_contents(self, fetch_requests: list[tuple]) -> list[str]:
+        """
+        Fetches the content of several (file, sha) pairs concurrently, using a bounded thread pool. Each thread
+        sends its requests on its own connection of the client (see _install_transport): if it is not installed,
+        the files are fetched one by one.
+
+        Args:
+            fetch_requests: list of (file, sha) pairs to load.
+
+        Returns:
+            list[str]: the file contents, in the same order as 'fetch_requests'. A file that failed to load, or
+            did not finish within 'github.file_fetch_timeout_sec', is returned as an empty string.
+        """
+        if not fetch_requests:
+            return []
+        max_workers = max(1, int(get_settings().get("GITHUB.MAX_CONCURRENT_FILE_FETCHES", 8)))
+        timeout = get_settings().get("GITHUB.FILE_FETCH_TIMEOUT_SEC", 30) or None
+        if not getattr(self, "thread_safe_transport", False):
+            max_workers = 1
+        if max_workers == 1 or len(fetch_requests) == 1:
+            return [self._get_pr_file_content(file, sha) for file, sha in fetch_requests]
+
+        executor = ThreadPoolExecutor(max_workers=min(max_workers, len(fetch_requests)),
+                                      thread_name_prefix="pr_agent_fetch")
+        try:
+            futures = [executor.submit(self._get_pr_file_content, file, sha) for file, sha in fetch_requests]
+            contents = []
+            for (file, sha), future in zip(fetch_requests, futures):
+                try:
+                    contents.append(future.result(timeout=timeout))
+                except FuturesTimeoutError:
+                    get_logger().warning(f"Timed out loading content of {file.filename} at {sha}")
+                    future.cancel()
+                    contents.append("")
+                except Exception as e:
+                    get_logger().warning(f"Failed to load content of {file.filename} at {sha}, error: {e}")
+                    contents.append("")
+            return contents
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
 
     def _publish_labels_impl(self, pr_types):
         try:
@@ -999,7 +1445,8 @@ class GithubProvider(GitProvider):
         """
         max_tokens = get_settings().get("CONFIG.MAX_COMMITS_TOKENS", None)
         try:
-            commit_list = self.pr.get_commits()
+            commit_list = self.pr_commits if getattr(self, "pr_snapshot", None) and self.pr_commits \
+                else self.pr.get_commits()
             commit_messages = [commit.commit.message for commit in commit_list]
             commit_messages_str = "\n".join([f"{i + 1}. {message}" for i, message in enumerate(commit_messages)])
         except Exception:
@@ -1204,83 +1651,81 @@ class GithubProvider(GitProvider):
         """
         code_suggestions_copy = copy.deepcopy(code_suggestions)
         diff_files = self.get_diff_files()
-        RE_HUNK_HEADER = re.compile(
-            r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
 
         diff_files = set_file_languages(diff_files)
+        diff_files_index = get_diff_files_index(diff_files)
 
         for suggestion in code_suggestions_copy:
             try:
                 relevant_file_path = suggestion['relevant_file']
-                for file in diff_files:
-                    if file.filename == relevant_file_path:
-
-                        # generate on-demand the patches range for the relevant file
-                        patch_str = file.patch
-                        if not hasattr(file, 'patches_range'):
-                            file.patches_range = []
-                            patch_lines = patch_str.splitlines()
-                            for i, line in enumerate(patch_lines):
-                                if line.startswith('@@'):
-                                    match = RE_HUNK_HEADER.match(line)
-                                    # identify hunk header
-                                    if match:
-                                        section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
-                                        file.patches_range.append({'start': start2, 'end': start2 + size2 - 1})
-                                    else:
-                                        get_logger().warning(f"Invalid hunk header format in patch: {line}")
-
-                        patches_range = file.patches_range
-                        comment_start_line = suggestion.get('relevant_lines_start', None)
-                        comment_end_line = suggestion.get('relevant_lines_end', None)
-                        original_suggestion = suggestion.get('original_suggestion', None) # needed for diff code
-                        if not comment_start_line or not comment_end_line or not original_suggestion:
-                            continue
-
-                        # check if the comment is inside a valid hunk
-                        is_valid_hunk = False
-                        min_distance = float('inf')
-                        patch_range_min = None
-                        # find the hunk that contains the comment, or the closest one
-                        for i, patch_range in enumerate(patches_range):
-                            d1 = comment_start_line - patch_range['start']
-                            d2 = patch_range['end'] - comment_end_line
-                            if d1 >= 0 and d2 >= 0:  # found a valid hunk
-                                is_valid_hunk = True
-                                min_distance = 0
+                file = diff_files_index.get_file(relevant_file_path.strip())
+                if file is not None and file.filename == relevant_file_path:
+
+                    # generate on-demand the patches range for the relevant file
+                    patch_str = file.patch
+                    if not hasattr(file, 'patches_range'):
+                        file.patches_range = []
+                        parsed_patch = parse_patch(patch_str)
+                        for i, line in enumerate(parsed_patch.lines):
+                            if line.startswith('@@'):
+                                hunk = parsed_patch.hunk_by_line.get(i)
+                                # identify hunk header
+                                if hunk:
+                                    file.patches_range.append({'start': hunk.start2, 'end': hunk.start2 + hunk.size2 - 1})
+                                else:
+                                    get_logger().warning(f"Invalid hunk header format in patch: {line}")
+
+                    patches_range = file.patches_range
+                    comment_start_line = suggestion.get('relevant_lines_start', None)
+                    comment_end_line = suggestion.get('relevant_lines_end', None)
+                    original_suggestion = suggestion.get('original_suggestion', None) # needed for diff code
+                    if not comment_start_line or not comment_end_line or not original_suggestion:
+                        continue
+
+                    # check if the comment is inside a valid hunk
+                    is_valid_hunk = False
+                    min_distance = float('inf')
+                    patch_range_min = None
+                    # find the hunk that contains the comment, or the closest one
+                    for i, patch_range in enumerate(patches_range):
+                        d1 = comment_start_line - patch_range['start']
+                        d2 = patch_range['end'] - comment_end_line
+                        if d1 >= 0 and d2 >= 0:  # found a valid hunk
+                            is_valid_hunk = True
+                            min_distance = 0
+                            patch_range_min = patch_range
+                            break
+                        elif d1 * d2 <= 0:  # comment is possibly inside the hunk
+                            d1_clip = abs(min(0, d1))
+                            d2_clip = abs(min(0, d2))
+                            d = max(d1_clip, d2_clip)
+                            if d < min_distance:
                                 patch_range_min = patch_range
-                                break
-                            elif d1 * d2 <= 0:  # comment is possibly inside the hunk
-                                d1_clip = abs(min(0, d1))
-                                d2_clip = abs(min(0, d2))
-                                d = max(d1_clip, d2_clip)
-                                if d < min_distance:
-                                    patch_range_min = patch_range
-                                    min_distance = min(min_distance, d)
-                        if not is_valid_hunk:
-                            if min_distance < 10:  # 10 lines - a reasonable distance to consider the comment inside the hunk
-                                # make the suggestion non-committable, yet multi line
-                                suggestion['relevant_lines_start'] = max(suggestion['relevant_lines_start'], patch_range_min['start'])
-                                suggestion['relevant_lines_end'] = min(suggestion['relevant_lines_end'], patch_range_min['end'])
-                                body = suggestion['body'].strip()
-
-                                # present new diff code in collapsible
-                                existing_code = original_suggestion['existing_code'].rstrip() + "\n"
-                                improved_code = original_suggestion['improved_code'].rstrip() + "\n"
-                                diff = difflib.unified_diff(existing_code.split('\n'),
-                                                            improved_code.split('\n'), n=999)
-                                patch_orig = "\n".join(diff)
-                                patch = "\n".join(patch_orig.splitlines()[5:]).strip('\n')
-                                diff_code = f"\n\n<details><summary>New proposed code:</summary>\n\n```diff\n{patch.rstrip()}\n```"
-                                # replace ```suggestion ... ``` with diff_code, using regex:
-                                body = re.sub(r'```suggestion.*?```', diff_code, body, flags=re.DOTALL)
-                                body += "\n\n</details>"
-                                suggestion['body'] = body
-                                get_logger().info(f"Comment was moved to a valid hunk, "
-                                                  f"start_line={suggestion['relevant_lines_start']}, end_line={suggestion['relevant_lines_end']}, file={file.filename}")
-                            else:
-                                get_logger().error(f"Comment is not inside a valid hunk, "
-                                                   f"start_line={suggestion['relevant_lines_start']}, end_line={suggestion['relevant_lines_end']}, file={file.filename}")
+                                min_distance = min(min_distance, d)
+                    if not is_valid_hunk:
+                        if min_distance < 10:  # 10 lines - a reasonable distance to consider the comment inside the hunk
+                            # make the suggestion non-committable, yet multi line
+                            suggestion['relevant_lines_start'] = max(suggestion['relevant_lines_start'], patch_range_min['start'])
+                            suggestion['relevant_lines_end'] = min(suggestion['relevant_lines_end'], patch_range_min['end'])
+                            body = suggestion['body'].strip()
+
+                            # present new diff code in collapsible
+                            existing_code = original_suggestion['existing_code'].rstrip() + "\n"
+                            improved_code = original_suggestion['improved_code'].rstrip() + "\n"
+                            diff = difflib.unified_diff(existing_code.split('\n'),
+                                                        improved_code.split('\n'), n=999)
+                            patch_orig = "\n".join(diff)
+                            patch = "\n".join(patch_orig.splitlines()[5:]).strip('\n')
+                            diff_code = f"\n\n<details><summary>New proposed code:</summary>\n\n```diff\n{patch.rstrip()}\n```"
+                            # replace ```suggestion ... ``` with diff_code, using regex:
+                            body = re.sub(r'```suggestion.*?```', diff_code, body, flags=re.DOTALL)
+                            body += "\n\n</details>"
+                            suggestion['body'] = body
+                            get_logger().info(f"Comment was moved to a valid hunk, "
+                                              f"start_line={suggestion['relevant_lines_start']}, end_line={suggestion['relevant_lines_end']}, file={file.filename}")
+                        else:
+                            get_logger().error(f"Comment is not inside a valid hunk, "
+                                               f"start_line={suggestion['relevant_lines_start']}, end_line={suggestion['relevant_lines_end']}, file={file.filename}")
             except Exception as e:
                 get_logger().error(f"Failed to process patch for committable comment, error: {e}")
         return code_suggestions_copy
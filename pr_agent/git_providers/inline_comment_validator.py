@@ -0,0 +1,113 @@
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional
+
+from ..algo.git_patch_processing import parse_patch
+
+
+class CommentValidity(str, Enum):
+    VALID = "valid"
+    INVALID = "invalid"  # GitHub is expected to reject the comment (422)
+    UNCERTAIN = "uncertain"  # needs a round-trip verification
+
+
+@dataclass
+class DiffLines:
+    """The lines of a file patch that GitHub accepts review comments on"""
+    right: dict = field(default_factory=dict)  # new file line number -> hunk index
+    left: dict = field(default_factory=dict)  # original file line number -> hunk index
+    num_positions: int = 0  # number of diff positions (lines after the first hunk header)
+    header_positions: set = field(default_factory=set)  # positions of the hunk headers after the first one
+
+
+def parse_diff_lines(patch: str) -> Optional[DiffLines]:
+    """
+    Maps the lines of a patch (in GitHub's format) to their hunks, on both sides of the diff.
+    Returns None if the patch could not be parsed.
+    """
+    diff_lines = DiffLines()
+    hunk_index = -1
+    old_line = new_line = 0
+    position = 0
+    parsed_patch = parse_patch(patch)
+    for i, line in enumerate(parsed_patch.lines):
+        if hunk_index >= 0:
+            position += 1
+        if line.startswith("@@"):
+            hunk = parsed_patch.hunk_by_line.get(i)
+            if hunk is None:
+                return None
+            if hunk_index >= 0:
+                diff_lines.header_positions.add(position)
+            hunk_index += 1
+            old_line, new_line = hunk.start1, hunk.start2
+        elif hunk_index < 0:
+            return None  # content before the first hunk header
+        elif line.startswith("+"):
+            diff_lines.right[new_line] = hunk_index
+            new_line += 1
+        elif line.startswith("-"):
+            diff_lines.left[old_line] = hunk_index
+            old_line += 1
+        elif line.startswith("\\"):  # '\ No newline at end of file'
+            continue
+        else:
+            diff_lines.right[new_line] = hunk_index
+            diff_lines.left[old_line] = hunk_index
+            new_line += 1
+            old_line += 1
+    diff_lines.num_positions = position
+    return diff_lines
+
+
+def predict_comment_validity(comment: dict, diff_lines: Optional[DiffLines]) -> CommentValidity:
+    """
+    Predicts whether GitHub will accept an inline review comment, according to its rules:
+    - a 'line' comment must be on a line of the diff, on its 'side' (RIGHT: added or context lines of the new file,
+      LEFT: deleted or context lines of the original file).
+    - a multi-line comment must start before it ends, and both ends must be in the same hunk.
+    - a 'position' comment must be within the diff positions of the file.
+
+    Args:
+        comment: the comment, as passed to 'create_review'.
+        diff_lines: the parsed patch of the commented file, or None if the file or its patch is unknown.
+    """
+    if not comment or not comment.get("path"):
+        return CommentValidity.INVALID
+    if comment.get("subject_type") == "file":
+        return CommentValidity.UNCERTAIN if diff_lines is None else CommentValidity.VALID
+    if diff_lines is None:
+        return CommentValidity.UNCERTAIN
+
+    if "line" not in comment:
+        position = comment.get("position")
+        if not isinstance(position, int):
+            return CommentValidity.UNCERTAIN
+        if position < 1 or position > diff_lines.num_positions:
+            return CommentValidity.INVALID
+        if position in diff_lines.header_positions:
+            return CommentValidity.UNCERTAIN
+        return CommentValidity.VALID
+
+    line = comment.get("line")
+    side = comment.get("side", "RIGHT")
+    if not isinstance(line, int) or side not in ("RIGHT", "LEFT"):
+        return CommentValidity.UNCERTAIN
+    lines = diff_lines.right if side == "RIGHT" else diff_lines.left
+    if line not in lines:
+        return CommentValidity.INVALID
+    if "start_line" not in comment:
+        return CommentValidity.VALID
+
+    start_line = comment.get("start_line")
+    start_side = comment.get("start_side", side)
+    if not isinstance(start_line, int) or start_side not in ("RIGHT", "LEFT"):
+        return CommentValidity.UNCERTAIN
+    start_lines = diff_lines.right if start_side == "RIGHT" else diff_lines.left
+    if start_line not in start_lines:
+        return CommentValidity.INVALID
+    if start_side == side and start_line >= line:
+        return CommentValidity.INVALID
+    if start_lines[start_line] != lines[line]:
+        return CommentValidity.INVALID
+    return CommentValidity.VALID
@@ -0,0 +1,144 @@
+import subprocess
+from dataclasses import dataclass
+from typing import Optional
+
+from pr_agent.log import get_logger
+
+GIT_STATUS_TO_FILE_STATUS = {
+    "A": "added",
+    "D": "removed",
+    "M": "modified",
+    "T": "modified",
+    "R": "renamed",
+    "C": "added",
+}
+
+
+@dataclass
+class MirrorDiffFile:
+    """A changed file computed from a local mirror. Mirrors the attributes of a PyGithub 'File' object."""
+    filename: str
+    status: str
+    patch: str
+    additions: int
+    deletions: int
+    previous_filename: Optional[str] = None
+
+
+class LocalGitMirror:
+    """
+    Read-only git operations on a local bare mirror of a repository.
+
+    The mirror is populated and updated by GitProvider.mirror(). All the operations here are local, and a single
+    git process is used per operation (not per file).
+    """
+
+    def __init__(self, path: str, operation_timeout_in_seconds: int = 60):
+        self.path = path
+        self.timeout = operation_timeout_in_seconds
+
+    def has_commits(self, *shas: str) -> bool:
+        try:
+            for sha in shas:
+                self._git("cat-file", "-e", f"{sha}^{{commit}}")
+            return True
+        except subprocess.CalledProcessError:
+            return False
+
+    def merge_base(self, sha1: str, sha2: str) -> Optional[str]:
+        try:
+            return self._git("merge-base", sha1, sha2).decode().strip() or None
+        except subprocess.CalledProcessError:
+            return None
+
+    def diff_files(self, base_sha: str, head_sha: str) -> Optional[list[MirrorDiffFile]]:
+        """
+        Returns the changed files between two commits, with their patches in the same format as GitHub's
+        'patch' field (hunks only, no file headers). Returns None if the diff output could not be parsed.
+        """
+        name_status = self._git("diff", "-z", "--name-status", "-M", base_sha, head_sha)
+        entries = self._parse_name_status(name_status)
+        diff_output = self._git("diff", "--no-color", "--no-ext-diff", "-M", base_sha, head_sha)
+        sections = self._split_diff_sections(diff_output.decode("utf-8", errors="replace"))
+        if len(sections) != len(entries):
+            get_logger().warning(f"Unexpected local diff output: {len(entries)} files, {len(sections)} diff sections")
+            return None
+
+        diff_files = []
+        for (status, filename, previous_filename), section in zip(entries, sections):
+            patch = self._strip_section_header(section)
+            patch_lines = patch.splitlines()
+            diff_files.append(MirrorDiffFile(
+                filename=filename,
+                status=status,
+                patch=patch,
+                additions=len([line for line in patch_lines if line.startswith('+')]),
+                deletions=len([line for line in patch_lines if line.startswith('-')]),
+                previous_filename=previous_filename,
+            ))
+        return diff_files
+
+    def read_files(self, requests: list[tuple[str, str]]) -> list[str]:
+        """
+        Reads the content of several files, given as (commit sha, path) pairs, with a single 'git cat-file' process.
+        A missing file, or a file that is not valid utf-8, is returned as an empty string.
+        """
+        if not requests:
+            return []
+        batch_input = "".join(f"{sha}:{path}\n" for sha, path in requests).encode("utf-8")
+        output = self._git("cat-file", "--batch", input=batch_input)
+
+        contents = []
+        offset = 0
+        for _ in requests:
+            header_end = output.index(b"\n", offset)
+            header = output[offset:header_end].decode("utf-8", errors="replace").split(" ")
+            offset = header_end + 1
+            if header[-1] == "missing" or len(header) < 3:
+                contents.append("")
+                continue
+            size = int(header[2])
+            data = output[offset:offset + size]
+            offset += size + 1  # content is followed by a newline
+            try:
+                contents.append(data.decode("utf-8") if header[1] == "blob" else "")
+            except UnicodeDecodeError:
+                contents.append("")
+        return contents
+
+    @staticmethod
+    def _parse_name_status(output: bytes) -> list[tuple[str, str, Optional[str]]]:
+        fields = output.decode("utf-8", errors="replace").split("\0")
+        entries = []
+        i = 0
+        while i < len(fields) and fields[i]:
+            git_status = fields[i][0]
+            if git_status in ("R", "C"):
+                previous_filename, filename = fields[i + 1], fields[i + 2]
+                i += 3
+            else:
+                previous_filename, filename = None, fields[i + 1]
+                i += 2
+            entries.append((GIT_STATUS_TO_FILE_STATUS.get(git_status, "unknown"), filename, previous_filename))
+        return entries
+
+    @staticmethod
+    def _split_diff_sections(diff_output: str) -> list[str]:
+        if not diff_output:
+            return []
+        sections = ("\n" + diff_output).split("\ndiff --git ")
+        return sections[1:]
+
+    @staticmethod
+    def _strip_section_header(section: str) -> str:
+        # the header ('a/x b/x', 'index ...', '--- a/x', '+++ b/x', ...) ends where the first hunk starts
+        if section.startswith("@@"):
+            return section.rstrip("\n")
+        hunks_start = section.find("\n@@")
+        if hunks_start == -1:
+            return ""  # binary file, pure rename or mode change
+        return section[hunks_start + 1:].rstrip("\n")
+
+    def _git(self, *args, input: bytes = None) -> bytes:
+        return subprocess.run(["git", "-C", self.path, *args], input=input, check=True,
+                              stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=self.timeout).stdout
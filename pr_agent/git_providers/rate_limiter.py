@@ -0,0 +1,191 @@
+import hashlib
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Optional
+
+from pr_agent.config_loader import get_settings
+from pr_agent.log import get_logger
+from pr_agent.servers.utils import RateLimitExceeded
+
+WRITE_VERBS = ("POST", "PATCH", "PUT", "DELETE")
+
+
+class GithubRateLimiter:
+    """
+    Request scheduler for one GitHub app installation (or token), shared by all the worker processes on a host.
+
+    The state lives in a small JSON file, updated under an exclusive file lock, so every process sees the same
+    budget. It is fed from the 'X-RateLimit-*' response headers, and callers reserve a time slot before each request:
+    - primary rate limit, per resource ('core', 'graphql', 'search'): no pacing while plenty of requests remain.
+      Below 'github.rate_limit_reserve' remaining requests, calls are spread evenly until the limit resets.
+    - secondary rate limit: mutating requests (POST/PATCH/PUT/DELETE) are spaced by 'github.min_write_interval_sec'.
+    - a 'Retry-After' answer, or an exhausted limit, blocks the scope until the given time.
+    Slots are handed out in arrival order (a virtual-scheduling token bucket), which gives fair queueing across
+    threads and processes instead of independent sleeps and retry storms.
+    """
+
+    def __init__(self, state_path: str, reserve: int, min_write_interval_sec: float, max_wait_sec: float):
+        self.state_path = state_path
+        self.reserve = reserve
+        self.min_write_interval_sec = min_write_interval_sec
+        self.max_wait_sec = max_wait_sec
+        self._lock = Lock()  # flock is per open file description, so threads of a process also need a lock
+
+    @staticmethod
+    def get_resource(url: str) -> str:
+        if "/graphql" in url:
+            return "graphql"
+        if "/search/" in url:
+            return "search"
+        return "core"
+
+    def reserve_slot(self, verb: str, url: str) -> float:
+        """
+        Reserves the next slot for a request, and returns the number of seconds to wait before sending it.
+        Raises RateLimitExceeded if the wait would be longer than 'github.max_rate_limit_wait_sec'.
+        """
+        resource = self.get_resource(url)
+        with self._locked_state() as state:
+            now = time.time()
+            start = max(now, state.get("blocked_until", 0))
+
+            bucket = state.setdefault(resource, {})
+            remaining = bucket.get("remaining")
+            reset = bucket.get("reset", 0)
+            if remaining is not None and reset > now:
+                if remaining <= 0:
+                    start = max(start, reset)
+                elif remaining <= self.reserve:
+                    # spread the remaining requests evenly until the limit resets
+                    interval = (reset - now) / remaining
+                    start = max(start, bucket.get("next_slot", 0))
+                    bucket["next_slot"] = start + interval
+                bucket["remaining"] = remaining - 1  # until the next response headers update it
+
+            if verb.upper() in WRITE_VERBS and self.min_write_interval_sec > 0:
+                start = max(start, state.get("next_write_slot", 0))
+                state["next_write_slot"] = start + self.min_write_interval_sec
+
+            wait = start - now
+            if wait > self.max_wait_sec:
+                raise RateLimitExceeded(f"GitHub rate limit: the next {resource} request slot is in {wait:.0f} sec")
+            return max(0.0, wait)
+
+    def acquire(self, verb: str, url: str) -> None:
+        try:
+            wait = self.reserve_slot(verb, url)
+        except OSError as e:
+            get_logger().debug(f"Failed to read GitHub rate limit state: {e}")
+            return
+        if wait > 0:
+            get_logger().debug(f"Waiting {wait:.2f} sec for GitHub rate limit")
+            time.sleep(wait)
+
+    def update(self, status: int, headers: dict) -> None:
+        """Feeds the rate limit state from the (lower-cased) headers of a response"""
+        remaining = headers.get("x-ratelimit-remaining")
+        retry_after = headers.get("retry-after")
+        if remaining is None and retry_after is None:
+            return
+        try:
+            with self._locked_state() as state:
+                now = time.time()
+                if remaining is not None and headers.get("x-ratelimit-reset") is not None:
+                    resource = headers.get("x-ratelimit-resource", "core")
+                    bucket = state.setdefault(resource, {})
+                    remaining, reset = int(remaining), int(headers["x-ratelimit-reset"])
+                    if bucket.get("reset") == reset and bucket.get("remaining") is not None:
+                        # responses of concurrent requests can arrive out of order, within a window remaining only drops
+                        remaining = min(remaining, bucket["remaining"])
+                    else:
+                        bucket.pop("next_slot", None)
+                    bucket["remaining"], bucket["reset"] = remaining, reset
+                if status in (403, 429):
+                    if retry_after is not None:  # secondary rate limit
+                        blocked_until = now + int(retry_after)
+                    elif remaining is not None and int(remaining) == 0:
+                        blocked_until = int(headers.get("x-ratelimit-reset", now))
+                    else:
+                        return
+                    state["blocked_until"] = max(state.get("blocked_until", 0), blocked_until)
+                    get_logger().warning(f"GitHub rate limit hit, requests are paused for "
+                                         f"{blocked_until - now:.0f} sec")
+        except (ValueError, OSError) as e:
+            get_logger().debug(f"Failed to update GitHub rate limit state: {e}")
+
+    @contextmanager
+    def _locked_state(self):
+        import fcntl
+        with self._lock, open(self.state_path, "a+") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            f.seek(0)
+            try:
+                state = json.loads(f.read() or "{}")
+            except ValueError:  # e.g. a partial write of a killed process
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+
+
+class _RateLimiters:
+    instances: dict[str, GithubRateLimiter] = {}
+    lock = Lock()
+
+
+def get_rate_limiter(scope: str) -> Optional[GithubRateLimiter]:
+    """
+    Returns the rate limiter of a scope (e.g. an app installation), or None if it is disabled
+    ('github.enable_rate_limiter') or not supported on this platform.
+
+    Args:
+        scope: identifies the credentials whose rate limit is tracked. Only a hash of it is stored.
+    """
+    if not get_settings().get("GITHUB.ENABLE_RATE_LIMITER", False):
+        return None
+    digest = hashlib.sha256(scope.encode("utf-8")).hexdigest()
+    with _RateLimiters.lock:
+        if digest not in _RateLimiters.instances:
+            try:
+                import fcntl  # noqa: F401  # the state is shared between processes with file locks
+                state_dir = get_settings().get("GITHUB.RATE_LIMITER_DIR", "") or \
+                            os.path.join(tempfile.gettempdir(), "pr_agent_rate_limits")
+                os.makedirs(state_dir, exist_ok=True)
+            except (ImportError, OSError) as e:
+                get_logger().warning(f"GitHub rate limiter is not available: {e}")
+                return None
+            _RateLimiters.instances[digest] = GithubRateLimiter(
+                state_path=os.path.join(state_dir, f"{digest}.json"),
+                reserve=int(get_settings().get("GITHUB.RATE_LIMIT_RESERVE", 100)),
+                min_write_interval_sec=float(get_settings().get("GITHUB.MIN_WRITE_INTERVAL_SEC", 1.0)),
+                max_wait_sec=float(get_settings().get("GITHUB.MAX_RATE_LIMIT_WAIT_SEC", 300)))
+        return _RateLimiters.instances[digest]
+
+
+class RateLimitedConnectionMixin:
+    """
+    Makes a PyGithub connection class reserve a slot from a GithubRateLimiter before each request, and feed it from
+    the response headers. The slot is reserved (and waited for) in request(), from its own arguments, before the
+    request is handed to the connection.
+    """
+
+    def __init__(self, *args, rate_limiter: GithubRateLimiter = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.rate_limiter = rate_limiter
+
+    def request(self, verb, url, input, headers):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(verb, url)
+        return super().request(verb, url, input, headers)
+
+    def getresponse(self):
+        response = super().getresponse()
+        if self.rate_limiter is None:
+            return response
+        self.rate_limiter.update(response.status, {k.lower(): v for k, v in response.getheaders()})
+        return response
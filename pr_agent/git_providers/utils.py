@@ -2,6 +2,7 @@ import copy
 import os
 import tempfile
 from pathlib import Path
+from typing import Optional
 
 from dynaconf import Dynaconf
 from starlette_context import context
@@ -203,17 +204,19 @@ def get_repository_rules_for_prompt():
         return ""
 
 
-def add_repository_rules_to_prompt(system_prompt: str) -> str:
+def add_repository_rules_to_prompt(system_prompt: str, repo_rules: Optional[str] = None) -> str:
     """
     Add repository-specific Cursor rules to a system prompt.
     
     Args:
         system_prompt: The original system prompt
+        repo_rules: The rules, if already loaded with get_repository_rules_for_prompt()
         
     Returns:
         The system prompt with repository rules appended (if any)
     """
-    repo_rules = get_repository_rules_for_prompt()
+    if repo_rules is None:
+        repo_rules = get_repository_rules_for_prompt()
     if repo_rules:
         rules_explanation = """
 
@@ -1,3 +1,4 @@
+import asyncio
 import asyncio.locks
 import copy
 import os
@@ -13,6 +14,7 @@ from starlette_context import context
 from starlette_context.middleware import RawContextMiddleware
 
 from pr_agent.agent.pr_agent import PRAgent
+from pr_agent.algo.token_handler import TokenEncoder
 from pr_agent.algo.utils import update_settings_from_args
 from pr_agent.config_loader import get_settings, global_settings
 from pr_agent.git_providers import (get_git_provider,
@@ -22,7 +24,8 @@ from pr_agent.git_providers.utils import apply_repo_settings
 from pr_agent.identity_providers import get_identity_provider
 from pr_agent.identity_providers.identity_provider import Eligibility
 from pr_agent.log import LoggingFormat, get_logger, setup_logger
-from pr_agent.servers.utils import DefaultDictWithTimeout, verify_signature
+from pr_agent.servers.utils import (DefaultDictWithTimeout,
+                                    EventLoopThreadPool, verify_signature)
 
 setup_logger(fmt=LoggingFormat.JSON, level=get_settings().get("CONFIG.LOG_LEVEL", "DEBUG"))
 base_path = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
@@ -76,6 +79,29 @@ async def get_body(request):
 
 _duplicate_push_triggers = DefaultDictWithTimeout(ttl=get_settings().github_app.push_trigger_pending_tasks_ttl)
 _pending_task_duplicate_push_conditions = DefaultDictWithTimeout(asyncio.locks.Condition, ttl=get_settings().github_app.push_trigger_pending_tasks_ttl)
+_agent_worker_loops = EventLoopThreadPool(max_workers=get_settings().get("GITHUB.ASYNC_WORKER_THREADS", 16))
+
+
+def _run_off_event_loop() -> bool:
+    # git providers that declare it (e.g. 'github_async') are run on worker threads, so their blocking calls do
+    # not stall the other webhooks handled by this process
+    try:
+        return getattr(get_git_provider(), "run_off_event_loop", False)
+    except ValueError:
+        return False
+
+
+async def _run_blocking(func, *args, **kwargs):
+    if _run_off_event_loop():
+        return await asyncio.to_thread(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+
+async def _run_agent_request(agent: PRAgent, api_url: str, request: str, notify=None):
+    if _run_off_event_loop():
+        return await _agent_worker_loops.run(agent.handle_request(api_url, request, notify=notify))
+    return await agent.handle_request(api_url, request, notify=notify)
+
 
 async def handle_comments_on_pr(body: Dict[str, Any],
                                 event: str,
@@ -112,11 +138,11 @@ async def handle_comments_on_pr(body: Dict[str, Any],
         return {}
     log_context["api_url"] = api_url
     comment_id = body.get("comment", {}).get("id")
-    provider = get_git_provider_with_context(pr_url=api_url)
+    provider = await _run_blocking(get_git_provider_with_context, pr_url=api_url)
     with get_logger().contextualize(**log_context):
         if get_identity_provider().verify_eligibility("github", sender_id, api_url) is not Eligibility.NOT_ELIGIBLE:
             get_logger().info(f"Processing comment on PR {api_url=}, comment_body={comment_body}")
-            await agent.handle_request(api_url, comment_body,
+            await _run_agent_request(agent, api_url, comment_body,
                         notify=lambda: provider.add_eyes_reaction(comment_id, disable_eyes=disable_eyes))
         else:
             get_logger().info(f"User {sender=} is not eligible to process comment on PR {api_url=}")
@@ -136,7 +162,7 @@ async def handle_new_pr_opened(body: Dict[str, Any],
         return {}
     if action in get_settings().github_app.handle_pr_actions:  # ['opened', 'reopened', 'ready_for_review']
         # logic to ignore PRs with specific titles (e.g. "[Auto] ...")
-        apply_repo_settings(api_url)
+        await _run_blocking(apply_repo_settings, api_url)
         if get_identity_provider().verify_eligibility("github", sender_id, api_url) is not Eligibility.NOT_ELIGIBLE:
             await _perform_auto_commands_github("pr_commands", agent, body, api_url, log_context)
         else:
@@ -153,7 +179,7 @@ async def handle_push_trigger_for_new_commits(body: Dict[str, Any],
     if not (pull_request and api_url):
         return {}
 
-    apply_repo_settings(api_url) # we need to apply the repo settings to get the correct settings for the PR. This is quite expensive - a call to the git provider is made for each PR event.
+    await _run_blocking(apply_repo_settings, api_url) # we need to apply the repo settings to get the correct settings for the PR. This is quite expensive - a call to the git provider is made for each PR event.
     if not get_settings().github_app.handle_push_trigger:
         return {}
 
@@ -415,7 +441,7 @@ def _check_pull_request_event(action: str, body: dict, log_context: dict) -> Tup
 
 async def _perform_auto_commands_github(commands_conf: str, agent: PRAgent, body: dict, api_url: str,
                                         log_context: dict):
-    apply_repo_settings(api_url)
+    await _run_blocking(apply_repo_settings, api_url)
     if commands_conf == "pr_commands" and get_settings().config.disable_auto_feedback:  # auto commands for PR, and auto feedback is disabled
         get_logger().info(f"Auto feedback is disabled, skipping auto commands for PR {api_url=}")
         return
@@ -433,12 +459,12 @@ async def _perform_auto_commands_github(commands_conf: str, agent: PRAgent, body
         other_args = update_settings_from_args(args)
         new_command = ' '.join([command] + other_args)
         get_logger().info(f"{commands_conf}. Performing auto command '{new_command}', for {api_url=}")
-        await agent.handle_request(api_url, new_command)
+        await _run_agent_request(agent, api_url, new_command)
 
 
 @router.get("/")
 async def root():
-    return {"status": "ok"}
+    return {"status": "ok", "tokenizer_load_time_sec": TokenEncoder.load_time_sec}
 
 
 if get_settings().github_app.override_deployment_type:
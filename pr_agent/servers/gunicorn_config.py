@@ -189,3 +189,17 @@ proc_name = None
 #
 #       A callable that takes a server instance as the sole argument.
 #
+#   on_starting - Called just before the master process is initialized.
+#
+#       A callable that takes a server instance as the sole argument.
+#
+
+
+def on_starting(server):
+    # load the tokenizer encodings once in the master process: the forked workers share them copy-on-write
+    try:
+        from pr_agent.algo.token_handler import TokenEncoder
+        load_time_sec = TokenEncoder.warm_up()
+        server.log.info(f"Tokenizer warm-up took {load_time_sec:.2f} sec")
+    except Exception as e:
+        server.log.warning(f"Tokenizer warm-up failed, encodings will be loaded by the workers: {e}")
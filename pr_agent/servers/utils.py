@@ -1,7 +1,11 @@
+import asyncio
+import contextvars
 import hashlib
 import hmac
+import threading
 import time
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any, Callable
 
 from fastapi import HTTPException
@@ -84,3 +88,28 @@ class DefaultDictWithTimeout(defaultdict):
     def __delitem__(self, __key):
         del self.__key_times[__key]
         return super().__delitem__(__key)
+
+
+class EventLoopThreadPool:
+    """
+    Runs coroutines on a pool of worker threads, each with its own long-lived event loop.
+
+    Used for agent requests that mix awaits with blocking git provider calls, so they do not block the event loop
+    of the server. The context variables of the caller (e.g. the starlette context) are propagated to the coroutine.
+    """
+
+    def __init__(self, max_workers: int):
+        self.__executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="pr_agent_worker_loop")
+        self.__local = threading.local()
+
+    def __run_in_thread_loop(self, coro):
+        loop = getattr(self.__local, "loop", None)
+        if loop is None:
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            self.__local.loop = loop
+        return loop.run_until_complete(coro)
+
+    async def run(self, coro):
+        ctx = contextvars.copy_context()
+        return await asyncio.wrap_future(self.__executor.submit(ctx.run, self.__run_in_thread_loop, coro))
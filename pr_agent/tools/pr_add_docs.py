@@ -7,6 +7,7 @@ from jinja2 import Environment, StrictUndefined
 
 from pr_agent.algo.ai_handlers.base_ai_handler import BaseAiHandler
 from pr_agent.algo.ai_handlers.litellm_ai_handler import LiteLLMAIHandler
+from pr_agent.algo.diff_files_index import get_diff_files_index
 from pr_agent.algo.pr_processing import get_pr_diff, retry_with_fallback_models
 from pr_agent.algo.token_handler import TokenHandler
 from pr_agent.algo.utils import load_yaml
@@ -144,13 +145,14 @@ class PRAddDocs:
             self.diff_files = self.git_provider.diff_files if self.git_provider.diff_files \
                 else self.git_provider.get_diff_files()
             original_initial_line = None
-            for file in self.diff_files:
-                if file.filename.strip() == relevant_file:
-                    original_initial_line = file.head_file.splitlines()[relevant_lines_start - 1]
-                    break
+            diff_files_index = get_diff_files_index(self.diff_files)
+            file = diff_files_index.get_file(relevant_file)
+            if file is not None:
+                file_lines = diff_files_index.head_lines(file)
+                original_initial_line = file_lines[relevant_lines_start - 1]
             if original_initial_line:
                 if doc_placement == 'after':
-                    line = file.head_file.splitlines()[relevant_lines_start]
+                    line = file_lines[relevant_lines_start]
                 else:
                     line = original_initial_line
                 suggested_initial_line = new_code_snippet.splitlines()[0]
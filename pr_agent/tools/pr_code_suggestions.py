@@ -13,6 +13,7 @@ from jinja2 import Environment, StrictUndefined
 from pr_agent.algo import MAX_TOKENS
 from pr_agent.algo.ai_handlers.base_ai_handler import BaseAiHandler
 from pr_agent.algo.ai_handlers.litellm_ai_handler import LiteLLMAIHandler
+from pr_agent.algo.diff_files_index import get_diff_files_index
 from pr_agent.algo.git_patch_processing import decouple_and_convert_to_hunks_with_lines_numbers
 from pr_agent.algo.pr_processing import (add_ai_metadata_to_diff_files,
                                          get_pr_diff, get_pr_multi_diffs,
@@ -596,27 +597,27 @@ class PRCodeSuggestions:
             self.diff_files = self.git_provider.diff_files if self.git_provider.diff_files \
                 else self.git_provider.get_diff_files()
             original_initial_line = None
-            for file in self.diff_files:
-                if file.filename.strip() == relevant_file:
-                    if file.head_file:
-                        file_lines = file.head_file.splitlines()
-                        if relevant_lines_start > len(file_lines):
-                            get_logger().warning(
-                                "Could not dedent code snippet, because relevant_lines_start is out of range",
-                                artifact={'filename': file.filename,
-                                          'file_content': file.head_file,
-                                          'relevant_lines_start': relevant_lines_start,
-                                          'new_code_snippet': new_code_snippet})
-                            return new_code_snippet
-                        else:
-                            original_initial_line = file_lines[relevant_lines_start - 1]
-                    else:
-                        get_logger().warning("Could not dedent code snippet, because head_file is missing",
-                                             artifact={'filename': file.filename,
-                                                       'relevant_lines_start': relevant_lines_start,
-                                                       'new_code_snippet': new_code_snippet})
+            diff_files_index = get_diff_files_index(self.diff_files)
+            file = diff_files_index.get_file(relevant_file)
+            if file is not None:
+                if file.head_file:
+                    file_lines = diff_files_index.head_lines(file)
+                    if relevant_lines_start > len(file_lines):
+                        get_logger().warning(
+                            "Could not dedent code snippet, because relevant_lines_start is out of range",
+                            artifact={'filename': file.filename,
+                                      'file_content': file.head_file,
+                                      'relevant_lines_start': relevant_lines_start,
+                                      'new_code_snippet': new_code_snippet})
                         return new_code_snippet
-                    break
+                    else:
+                        original_initial_line = file_lines[relevant_lines_start - 1]
+                else:
+                    get_logger().warning("Could not dedent code snippet, because head_file is missing",
+                                         artifact={'filename': file.filename,
+                                                   'relevant_lines_start': relevant_lines_start,
+                                                   'new_code_snippet': new_code_snippet})
+                    return new_code_snippet
             if original_initial_line:
                 suggested_initial_line = new_code_snippet.splitlines()[0]
                 original_initial_spaces = len(original_initial_line) - len(original_initial_line.lstrip())
@@ -638,19 +639,19 @@ class PRCodeSuggestions:
 
             relevant_file = suggestion.get('relevant_file', '').strip()
             diff_files = self.git_provider.get_diff_files()
-            for file in diff_files:
-                if file.filename.strip() == relevant_file:
-                    # protections
-                    if not file.head_file:
-                        get_logger().info(f"head_file is empty")
-                        return suggestion
-                    head_file = file.head_file
-                    base_file = file.base_file
-                    if existing_code in base_file and existing_code not in head_file and new_code in head_file:
-                        suggestion["score"] = 0
-                        get_logger().warning(
-                            f"existing_code is in the base file but not in the head file, setting score to 0",
-                            artifact={"suggestion": suggestion})
+            file = get_diff_files_index(diff_files).get_file(relevant_file)
+            if file is not None:
+                # protections
+                if not file.head_file:
+                    get_logger().info(f"head_file is empty")
+                    return suggestion
+                head_file = file.head_file
+                base_file = file.base_file
+                if existing_code in base_file and existing_code not in head_file and new_code in head_file:
+                    suggestion["score"] = 0
+                    get_logger().warning(
+                        f"existing_code is in the base file but not in the head file, setting score to 0",
+                        artifact={"suggestion": suggestion})
         except Exception as e:
             get_logger().exception(f"Error validating one-liner suggestion", artifact={"error": e})
 
@@ -772,7 +773,8 @@ class PRCodeSuggestions:
                     if token_count > max_tokens_full - delta_output:
                         get_logger().warning(
                             f"Token count {token_count} exceeds the limit {max_tokens_full - delta_output}. clipping the tokens")
-                        patch_final = clip_tokens(patch_final, max_tokens_full - delta_output)
+                        patch_final = clip_tokens(patch_final, max_tokens_full - delta_output,
+                                                  num_input_tokens=token_count)
                     patches_diff_list.append(patch_final)
                 return patches_diff_list
             except Exception as e:
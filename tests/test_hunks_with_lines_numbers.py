@@ -0,0 +1,159 @@
+"""
+Equivalence and regression benchmark of the line-numbered hunks renderer
+(decouple_and_convert_to_hunks_with_lines_numbers and iter_hunks_with_lines_numbers) against its previous,
+string-concatenating implementation.
+"""
+
+import random
+import re
+import time
+
+from pr_agent.algo.git_patch_processing import (decouple_and_convert_to_hunks_with_lines_numbers,
+                                                extract_hunk_headers, iter_hunks_with_lines_numbers)
+from pr_agent.algo.types import EDIT_TYPE, FilePatchInfo
+
+
+def reference_decouple_and_convert_to_hunks_with_lines_numbers(patch: str, file) -> str:
+    """The previous implementation, which appends to a growing string and strips it for every hunk section"""
+    if file:
+        if hasattr(file, 'edit_type') and file.edit_type == EDIT_TYPE.DELETED:
+            return f"\n\n## File '{file.filename.strip()}' was deleted\n"
+
+        patch_with_lines_str = f"\n\n## File: '{file.filename.strip()}'\n"
+    else:
+        patch_with_lines_str = ""
+
+    patch_lines = patch.splitlines()
+    RE_HUNK_HEADER = re.compile(
+        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+    new_content_lines = []
+    old_content_lines = []
+    match = None
+    start1, size1, start2, size2 = -1, -1, -1, -1
+    prev_header_line = []
+    header_line = []
+    for line_i, line in enumerate(patch_lines):
+        if 'no newline at end of file' in line.lower():
+            continue
+
+        if line.startswith('@@'):
+            header_line = line
+            match = RE_HUNK_HEADER.match(line)
+            if match and (new_content_lines or old_content_lines):  # found a new hunk, split the previous lines
+                if prev_header_line:
+                    patch_with_lines_str += f'\n{prev_header_line}\n'
+                is_plus_lines = is_minus_lines = False
+                if new_content_lines:
+                    is_plus_lines = any([line.startswith('+') for line in new_content_lines])
+                if old_content_lines:
+                    is_minus_lines = any([line.startswith('-') for line in old_content_lines])
+                if is_plus_lines or is_minus_lines:
+                    patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__new hunk__\n'
+                    for i, line_new in enumerate(new_content_lines):
+                        patch_with_lines_str += f"{start2 + i} {line_new}\n"
+                if is_minus_lines:
+                    patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__old hunk__\n'
+                    for line_old in old_content_lines:
+                        patch_with_lines_str += f"{line_old}\n"
+                new_content_lines = []
+                old_content_lines = []
+            if match:
+                prev_header_line = header_line
+
+            section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+
+        elif line.startswith('+'):
+            new_content_lines.append(line)
+        elif line.startswith('-'):
+            old_content_lines.append(line)
+        else:
+            if not line and line_i:  # if this line is empty and the next line is a hunk header, skip it
+                if line_i + 1 < len(patch_lines) and patch_lines[line_i + 1].startswith('@@'):
+                    continue
+                elif line_i + 1 == len(patch_lines):
+                    continue
+            new_content_lines.append(line)
+            old_content_lines.append(line)
+
+    # finishing last hunk
+    if match and new_content_lines:
+        patch_with_lines_str += f'\n{header_line}\n'
+        is_plus_lines = is_minus_lines = False
+        if new_content_lines:
+            is_plus_lines = any([line.startswith('+') for line in new_content_lines])
+        if old_content_lines:
+            is_minus_lines = any([line.startswith('-') for line in old_content_lines])
+        if is_plus_lines or is_minus_lines:
+            patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__new hunk__\n'
+            for i, line_new in enumerate(new_content_lines):
+                patch_with_lines_str += f"{start2 + i} {line_new}\n"
+        if is_minus_lines:
+            patch_with_lines_str = patch_with_lines_str.rstrip() + '\n__old hunk__\n'
+            for line_old in old_content_lines:
+                patch_with_lines_str += f"{line_old}\n"
+
+    return patch_with_lines_str.rstrip()
+
+
+PATCH_LINES = [" ctx", "+add", "-del", "", " ", "+", "-", "+x  ", "-y \t", " z  ", "\\ No newline at end of file",
+               "@@ bogus", "@@ -1 +1 @@ ", "@@ -3,2 +4,2 @@   "]
+
+
+def random_patch(rng: random.Random) -> str:
+    lines = [rng.choice(PATCH_LINES) for _ in range(rng.randint(0, 3))]
+    start = rng.randint(1, 50)
+    for _ in range(rng.randint(0, 6)):
+        body = [rng.choice(PATCH_LINES[:10]) for _ in range(rng.randint(0, 6))]
+        lines.append(f"@@ -{start},{len(body)} +{start},{len(body)} @@" + rng.choice(["", " ", "  f()  "]))
+        lines.extend(body)
+        start += len(body) + 3
+    return "\n".join(lines) + rng.choice(["", "\n", "\n\n", " \n"])
+
+
+def render(function, patch, file):
+    try:
+        return function(patch, file)
+    except Exception as e:
+        return type(e).__name__
+
+
+def test_matches_reference_on_random_patches():
+    rng = random.Random(7)
+    for _ in range(5000):
+        patch = random_patch(rng)
+        file = rng.choice([None, FilePatchInfo("", "", patch, rng.choice(["a.py", " "]),
+                                               edit_type=rng.choice([EDIT_TYPE.MODIFIED] * 5 + [EDIT_TYPE.DELETED]))])
+        expected = render(reference_decouple_and_convert_to_hunks_with_lines_numbers, patch, file)
+        assert render(decouple_and_convert_to_hunks_with_lines_numbers, patch, file) == expected, patch
+        assert render(lambda p, f: "".join(iter_hunks_with_lines_numbers(p, f)), patch, file) == expected, patch
+
+
+def test_iter_hunks_yields_one_piece_per_hunk():
+    patch = "\n".join(f"@@ -{i * 10 + 1},3 +{i * 10 + 1},3 @@\n ctx\n-old\n+new\n ctx" for i in range(3))
+    pieces = list(iter_hunks_with_lines_numbers(patch, FilePatchInfo("", "", patch, "a.py")))
+    assert all(pieces)
+    assert sum(piece.count("__new hunk__") for piece in pieces) == 3
+
+
+def best_time(function, *args, repeat: int = 5) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def many_hunks_patch(num_hunks: int) -> str:
+    return "\n".join(f"@@ -{i * 10 + 1},3 +{i * 10 + 1},3 @@\n ctx\n-old\n+new  \n ctx" for i in range(num_hunks))
+
+
+def test_benchmark_many_hunks_is_linear():
+    # the previous implementation stripped the whole output for every hunk section, which is quadratic in the number
+    # of hunks: 4 times more hunks took about 16 times longer. A linear renderer takes about 4 times longer, the bound
+    # leaves room for noisy runners
+    file = FilePatchInfo("", "", "", "generated.py")
+    small_patch, large_patch = many_hunks_patch(2000), many_hunks_patch(8000)
+    small_time = best_time(decouple_and_convert_to_hunks_with_lines_numbers, small_patch, file)
+    large_time = best_time(decouple_and_convert_to_hunks_with_lines_numbers, large_patch, file)
+    assert large_time < 12 * small_time
@@ -0,0 +1,374 @@
+"""
+Equivalence and end-to-end benchmark of the consumers of the parsed patches (process_patch_lines,
+omit_deletion_hunks and extract_hunk_lines_from_patch) against their previous implementations, which each split the
+patch and matched its hunk headers again.
+"""
+
+import random
+import re
+import time
+import traceback
+
+import pytest
+
+from pr_agent.algo import git_patch_processing
+from pr_agent.algo.git_patch_processing import (check_if_hunk_lines_matches_to_file, extract_hunk_headers,
+                                                extract_hunk_lines_from_patch, omit_deletion_hunks,
+                                                process_patch_lines)
+from pr_agent.algo.types import FilePatchInfo
+from pr_agent.algo.utils import find_line_number_of_relevant_line_in_file
+from pr_agent.config_loader import get_settings
+from pr_agent.log import get_logger
+
+
+def reference_process_patch_lines(patch_str, original_file_str, patch_extra_lines_before, patch_extra_lines_after,
+                                  new_file_str=""):
+    """The previous implementation, which splits the patch and matches its hunk headers again"""
+    allow_dynamic_context = get_settings().config.allow_dynamic_context
+    patch_extra_lines_before_dynamic = get_settings().config.max_extra_lines_before_dynamic_context
+
+    file_original_lines = original_file_str.splitlines()
+    file_new_lines = new_file_str.splitlines() if new_file_str else []
+    len_original_lines = len(file_original_lines)
+    patch_lines = patch_str.splitlines()
+    extended_patch_lines = []
+
+    is_valid_hunk = True
+    start1, size1, start2, size2 = -1, -1, -1, -1
+    RE_HUNK_HEADER = re.compile(
+        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+    try:
+        for i,line in enumerate(patch_lines):
+            if line.startswith('@@'):
+                match = RE_HUNK_HEADER.match(line)
+                # identify hunk header
+                if match:
+                    # finish processing previous hunk
+                    if is_valid_hunk and (start1 != -1 and patch_extra_lines_after > 0):
+                        delta_lines_original = [f' {line}' for line in file_original_lines[
+                            start1 + size1 - 1:start1 + size1 - 1 + patch_extra_lines_after]]
+                        extended_patch_lines.extend(delta_lines_original)
+
+                    section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+
+                    is_valid_hunk = check_if_hunk_lines_matches_to_file(i, file_original_lines, patch_lines, start1)
+
+                    if is_valid_hunk and (patch_extra_lines_before > 0 or patch_extra_lines_after > 0):
+                        def _calc_context_limits(patch_lines_before):
+                            extended_start1 = max(1, start1 - patch_lines_before)
+                            extended_size1 = size1 + (start1 - extended_start1) + patch_extra_lines_after
+                            extended_start2 = max(1, start2 - patch_lines_before)
+                            extended_size2 = size2 + (start2 - extended_start2) + patch_extra_lines_after
+                            if extended_start1 - 1 + extended_size1 > len_original_lines:
+                                # we cannot extend beyond the original file
+                                delta_cap = extended_start1 - 1 + extended_size1 - len_original_lines
+                                extended_size1 = max(extended_size1 - delta_cap, size1)
+                                extended_size2 = max(extended_size2 - delta_cap, size2)
+                            return extended_start1, extended_size1, extended_start2, extended_size2
+
+                        if allow_dynamic_context and file_new_lines:
+                            extended_start1, extended_size1, extended_start2, extended_size2 = \
+                                _calc_context_limits(patch_extra_lines_before_dynamic)
+
+                            lines_before_original = file_original_lines[extended_start1 - 1:start1 - 1]
+                            lines_before_new = file_new_lines[extended_start2 - 1:start2 - 1]
+                            found_header = False
+                            for i, line in enumerate(lines_before_original):
+                                if section_header in line:
+                                    # Update start and size in one line each
+                                    extended_start1, extended_start2 = extended_start1 + i, extended_start2 + i
+                                    extended_size1, extended_size2 = extended_size1 - i, extended_size2 - i
+                                    lines_before_original_dynamic_context = lines_before_original[i:]
+                                    lines_before_new_dynamic_context = lines_before_new[i:]
+                                    if lines_before_original_dynamic_context == lines_before_new_dynamic_context:
+                                        found_header = True
+                                        section_header = ''
+                                    else:
+                                        pass  # the lines are different in the 'old' and 'new' hunks
+                                    break
+
+                            if not found_header:
+                                extended_start1, extended_size1, extended_start2, extended_size2 = \
+                                    _calc_context_limits(patch_extra_lines_before)
+                        else:
+                            extended_start1, extended_size1, extended_start2, extended_size2 = \
+                                _calc_context_limits(patch_extra_lines_before)
+
+                        # check if extra lines before hunk are different in original and new file
+                        delta_lines_original = [f' {line}'
+                                                for line in file_original_lines[extended_start1 - 1:start1 - 1]]
+                        if file_new_lines:
+                            delta_lines_new = [f' {line}' for line in file_new_lines[extended_start2 - 1:start2 - 1]]
+                            if delta_lines_original != delta_lines_new:
+                                found_mini_match = False
+                                for i in range(len(delta_lines_original)):
+                                    if delta_lines_original[i:] == delta_lines_new[i:]:
+                                        delta_lines_original = delta_lines_original[i:]
+                                        delta_lines_new = delta_lines_new[i:]
+                                        extended_start1 += i
+                                        extended_size1 -= i
+                                        extended_start2 += i
+                                        extended_size2 -= i
+                                        found_mini_match = True
+                                        break
+                                if not found_mini_match:
+                                    extended_start1 = start1
+                                    extended_size1 = size1
+                                    extended_start2 = start2
+                                    extended_size2 = size2
+                                    delta_lines_original = []
+
+                        #  logic to remove section header if its in the extra delta lines
+                        if section_header and not allow_dynamic_context:
+                            for line in delta_lines_original:
+                                if section_header in line:
+                                    section_header = ''  # remove section header if it is in the extra delta lines
+                                    break
+                    else:
+                        extended_start1 = start1
+                        extended_size1 = size1
+                        extended_start2 = start2
+                        extended_size2 = size2
+                        delta_lines_original = []
+                    extended_patch_lines.append('')
+                    extended_patch_lines.append(
+                        f'@@ -{extended_start1},{extended_size1} '
+                        f'+{extended_start2},{extended_size2} @@ {section_header}')
+                    extended_patch_lines.extend(delta_lines_original)  # one to zero based
+                    continue
+            extended_patch_lines.append(line)
+    except Exception as e:
+        get_logger().warning(f"Failed to extend patch: {e}", artifact={"traceback": traceback.format_exc()})
+        return patch_str
+
+    # finish processing last hunk
+    if start1 != -1 and patch_extra_lines_after > 0 and is_valid_hunk:
+        delta_lines_original = file_original_lines[start1 + size1 - 1:start1 + size1 - 1 + patch_extra_lines_after]
+        # add space at the beginning of each extra line
+        delta_lines_original = [f' {line}' for line in delta_lines_original]
+        extended_patch_lines.extend(delta_lines_original)
+
+    extended_patch_str = '\n'.join(extended_patch_lines)
+    return extended_patch_str
+
+
+def reference_omit_deletion_hunks(patch_lines) -> str:
+    """The previous implementation, which matches the hunk headers again"""
+    temp_hunk = []
+    added_patched = []
+    add_hunk = False
+    inside_hunk = False
+    RE_HUNK_HEADER = re.compile(
+        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))?\ @@[ ]?(.*)")
+
+    for line in patch_lines:
+        if line.startswith('@@'):
+            match = RE_HUNK_HEADER.match(line)
+            if match:
+                # finish previous hunk
+                if inside_hunk and add_hunk:
+                    added_patched.extend(temp_hunk)
+                    temp_hunk = []
+                    add_hunk = False
+                temp_hunk.append(line)
+                inside_hunk = True
+        else:
+            temp_hunk.append(line)
+            if line:
+                edit_type = line[0]
+                if edit_type == '+':
+                    add_hunk = True
+    if inside_hunk and add_hunk:
+        added_patched.extend(temp_hunk)
+
+    return '\n'.join(added_patched)
+
+
+def reference_extract_hunk_lines_from_patch(patch: str, file_name, line_start, line_end, side,
+                                            remove_trailing_chars: bool = True) -> tuple[str, str]:
+    """The previous implementation, which splits the patch and matches its hunk headers again"""
+    try:
+        patch_with_lines_str = f"\n\n## File: '{file_name.strip()}'\n\n"
+        selected_lines = ""
+        patch_lines = patch.splitlines()
+        RE_HUNK_HEADER = re.compile(
+            r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+        match = None
+        start1, size1, start2, size2 = -1, -1, -1, -1
+        skip_hunk = False
+        selected_lines_num = 0
+        for line in patch_lines:
+            if 'no newline at end of file' in line.lower():
+                continue
+
+            if line.startswith('@@'):
+                skip_hunk = False
+                selected_lines_num = 0
+                header_line = line
+
+                match = RE_HUNK_HEADER.match(line)
+
+                section_header, size1, size2, start1, start2 = extract_hunk_headers(match)
+
+                # check if line range is in this hunk
+                if side.lower() == 'left':
+                    # check if line range is in this hunk
+                    if not (start1 <= line_start <= start1 + size1):
+                        skip_hunk = True
+                        continue
+                elif side.lower() == 'right':
+                    if not (start2 <= line_start <= start2 + size2):
+                        skip_hunk = True
+                        continue
+                patch_with_lines_str += f'\n{header_line}\n'
+
+            elif not skip_hunk:
+                if side.lower() == 'right' and line_start <= start2 + selected_lines_num <= line_end:
+                    selected_lines += line + '\n'
+                if side.lower() == 'left' and start1 <= selected_lines_num + start1 <= line_end:
+                    selected_lines += line + '\n'
+                patch_with_lines_str += line + '\n'
+                if not line.startswith('-'): # currently we don't support /ask line for deleted lines
+                    selected_lines_num += 1
+    except Exception as e:
+        get_logger().error(f"Failed to extract hunk lines from patch: {e}",
+                           artifact={"traceback": traceback.format_exc()})
+        return "", ""
+
+    if remove_trailing_chars:
+        patch_with_lines_str = patch_with_lines_str.rstrip()
+        selected_lines = selected_lines.rstrip()
+
+    return patch_with_lines_str, selected_lines
+
+
+FILE_LINES = ["def f():", "    return 1", "", "class A:", "x = 1", "# comment", "  y", "def g(x):", "    pass"]
+
+
+def random_file(rng: random.Random) -> list[str]:
+    return [rng.choice(FILE_LINES) for _ in range(rng.randint(0, 60))]
+
+
+def random_patch(rng: random.Random, original_lines: list[str]) -> str:
+    """Hunks of the original file (some of them with wrong line numbers, or malformed headers)"""
+    lines = []
+    line_i = rng.randint(0, 10)
+    for _ in range(rng.randint(0, 5)):
+        body, size1, size2 = [], 0, 0
+        for original_line in original_lines[line_i:line_i + rng.randint(0, 8)]:
+            kind = rng.choice(" -+")
+            body.append(kind + (original_line if kind != "+" else rng.choice(FILE_LINES)))
+            size1 += kind != "+"
+            size2 += kind != "-"
+        if rng.random() < 0.1:
+            body.append("\\ No newline at end of file")
+        start = line_i + 1 + (rng.randint(-3, 3) if rng.random() < 0.1 else 0)
+        header = f"@@ -{start},{size1} +{start},{size2} @@"
+        header = rng.choice([header] * 5 + [f"{header} {rng.choice(FILE_LINES)}", f"@@ -{start} +{start} @@",
+                                            "@@ malformed @@"])
+        lines.append(header)
+        lines.extend(body)
+        line_i += max(size1, 1) + rng.randint(0, 10)
+    return "\n".join(lines)
+
+
+def random_new_file(rng: random.Random, original_lines: list[str]) -> str:
+    if rng.random() < 0.3:
+        return ""
+    return "\n".join(line if rng.random() < 0.9 else rng.choice(FILE_LINES) for line in original_lines)
+
+
+@pytest.fixture
+def dynamic_context():
+    settings = get_settings()
+    previous = (settings.config.allow_dynamic_context, settings.config.max_extra_lines_before_dynamic_context)
+
+    def set_dynamic_context(allow: bool, max_extra_lines_before: int):
+        settings.set("config.allow_dynamic_context", allow)
+        settings.set("config.max_extra_lines_before_dynamic_context", max_extra_lines_before)
+
+    yield set_dynamic_context
+    set_dynamic_context(*previous)
+
+
+def test_process_patch_lines_matches_reference(dynamic_context):
+    rng = random.Random(11)
+    for allow_dynamic_context in (False, True):
+        dynamic_context(allow_dynamic_context, 8)
+        for _ in range(600):
+            original_lines = random_file(rng)
+            patch = random_patch(rng, original_lines)
+            args = (patch, "\n".join(original_lines), rng.randint(0, 5), rng.randint(0, 3),
+                    random_new_file(rng, original_lines))
+            assert process_patch_lines(*args) == reference_process_patch_lines(*args), args
+
+
+def test_omit_deletion_hunks_matches_reference():
+    rng = random.Random(12)
+    for _ in range(3000):
+        patch_lines = random_patch(rng, random_file(rng)).splitlines()
+        if rng.random() < 0.2:  # lines before the first hunk header
+            patch_lines = [rng.choice(["+a", "-b", " c", ""])] + patch_lines
+        assert omit_deletion_hunks(patch_lines) == reference_omit_deletion_hunks(patch_lines), patch_lines
+
+
+def test_extract_hunk_lines_from_patch_matches_reference():
+    rng = random.Random(13)
+    for _ in range(3000):
+        patch = random_patch(rng, random_file(rng))
+        line_start = rng.randint(0, 60)
+        args = (patch, rng.choice(["a.py", " b.py "]), line_start, line_start + rng.randint(0, 10),
+                rng.choice(["left", "right", "RIGHT"]), rng.choice([True, False]))
+        assert extract_hunk_lines_from_patch(*args) == reference_extract_hunk_lines_from_patch(*args), args
+
+
+def test_hunk_headers_without_sizes():
+    # '@@ -1 +1 @@' headers (single-line hunks) have sizes of 0, as in extract_hunk_headers. The previous line locator
+    # (find_line_number_of_relevant_line_in_file) converted the missing sizes with int(None), and raised a TypeError
+    patch = "@@ -1 +1 @@\n-a\n+b"
+    hunk = git_patch_processing.parse_patch(patch).hunks[0]
+    assert (hunk.start1, hunk.size1, hunk.start2, hunk.size2) == (1, 0, 1, 0)
+    assert find_line_number_of_relevant_line_in_file([FilePatchInfo("", "", patch, "a.py")], "a.py", "+b") == (2, 1)
+
+
+def large_pr(num_files: int, num_lines: int) -> list[tuple[str, str]]:
+    """(original file, patch) pairs, with a hunk every 50 lines"""
+    rng = random.Random(5)
+    files = []
+    for file_i in range(num_files):
+        original_lines = [f"    value_{file_i}_{i} = compute(value_{file_i}_{i - 1})" for i in range(num_lines)]
+        patch_lines = []
+        for start in range(10, num_lines - 10, 50):
+            patch_lines.append(f"@@ -{start + 1},6 +{start + 1},6 @@ def function_{start}():")
+            for i in range(start, start + 6):
+                kind = rng.choice(" -+")
+                patch_lines.append(kind + original_lines[i] if kind != "+" else f"+    changed_{i} = {i}")
+            patch_lines.append(f"+    added_{start} = True")
+            patch_lines.append(f"-    removed_{start} = True")
+        files.append(("\n".join(original_lines), "\n".join(patch_lines)))
+    return files
+
+
+def process_pr(files, extend, omit, extract):
+    # the diff preparation of a tool on a large PR: the deletion hunks are omitted, the patches are extended, and the
+    # lines of a few suggestions are extracted from each patch
+    for original_file, patch in files:
+        extend(omit(patch.splitlines()), original_file, 3, 3)
+        for line_start in (20, 140, 260, 380):
+            extract(patch, "a.py", line_start, line_start + 3, "right")
+
+
+def test_benchmark_large_pr(dynamic_context):
+    dynamic_context(False, 8)
+    files = large_pr(num_files=150, num_lines=400)
+
+    start = time.perf_counter()
+    process_pr(files, reference_process_patch_lines, reference_omit_deletion_hunks,
+               reference_extract_hunk_lines_from_patch)
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    process_pr(files, process_patch_lines, omit_deletion_hunks, extract_hunk_lines_from_patch)
+    parsed_time = time.perf_counter() - start
+
+    # about 40% faster: the patches are split and their hunk headers parsed once, and the settings are read once
+    assert parsed_time < reference_time
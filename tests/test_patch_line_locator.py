@@ -0,0 +1,195 @@
+"""
+Equivalence and benchmark of find_line_number_of_relevant_line_in_file, which locates the lines of the inline comments
+with a per-file index (PatchLineLocator), against its previous implementation, which scanned the patch for each line.
+"""
+
+import difflib
+import random
+import re
+import time
+from pathlib import Path
+
+import pytest
+
+from pr_agent.algo.patch_line_locator import PatchLineLocator
+from pr_agent.algo.types import FilePatchInfo
+from pr_agent.algo.utils import find_line_number_of_relevant_line_in_file
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def reference_find_line_number_of_relevant_line_in_file(diff_files, relevant_file, relevant_line_in_file,
+                                                        absolute_position=None):
+    """The previous implementation, with a difflib pass and up to two substring scans of the patch for each line"""
+    position = -1
+    if absolute_position is None:
+        absolute_position = -1
+    re_hunk_header = re.compile(
+        r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@[ ]?(.*)")
+
+    if not diff_files:
+        return position, absolute_position
+
+    for file in diff_files:
+        if file.filename and (file.filename.strip() == relevant_file):
+            patch = file.patch
+            patch_lines = patch.splitlines()
+            delta = 0
+            start1, size1, start2, size2 = 0, 0, 0, 0
+            if absolute_position != -1:  # matching absolute to relative
+                for i, line in enumerate(patch_lines):
+                    # new hunk
+                    if line.startswith('@@'):
+                        delta = 0
+                        match = re_hunk_header.match(line)
+                        start1, size1, start2, size2 = map(int, match.groups()[:4])
+                    elif not line.startswith('-'):
+                        delta += 1
+
+                    absolute_position_curr = start2 + delta - 1
+
+                    if absolute_position_curr == absolute_position:
+                        position = i
+                        break
+            else:
+                # try to find the line in the patch using difflib, with some margin of error
+                matches_difflib = difflib.get_close_matches(relevant_line_in_file, patch_lines, n=3, cutoff=0.93)
+                if len(matches_difflib) == 1 and matches_difflib[0].startswith('+'):
+                    relevant_line_in_file = matches_difflib[0]
+
+                for i, line in enumerate(patch_lines):
+                    if line.startswith('@@'):
+                        delta = 0
+                        match = re_hunk_header.match(line)
+                        start1, size1, start2, size2 = map(int, match.groups()[:4])
+                    elif not line.startswith('-'):
+                        delta += 1
+
+                    if relevant_line_in_file in line and line[0] != '-':
+                        position = i
+                        absolute_position = start2 + delta - 1
+                        break
+
+                if position == -1 and relevant_line_in_file[0] == '+':
+                    no_plus_line = relevant_line_in_file[1:].lstrip()
+                    for i, line in enumerate(patch_lines):
+                        if line.startswith('@@'):
+                            delta = 0
+                            match = re_hunk_header.match(line)
+                            start1, size1, start2, size2 = map(int, match.groups()[:4])
+                        elif not line.startswith('-'):
+                            delta += 1
+
+                        if no_plus_line in line and line[0] != '-':
+                            # The model might add a '+' to the beginning of the relevant_line_in_file even if
+                            # originally it's a context line
+                            position = i
+                            absolute_position = start2 + delta - 1
+                            break
+    return position, absolute_position
+
+
+def locate(function, *args):
+    try:
+        return function(*args)
+    except Exception:
+        # a malformed hunk header reached by the scan fails both implementations (with different exceptions)
+        return "error"
+
+
+WORDS = ["foo", "bar", "x", "y = 1", "return", "self.a", "", "  ", "def f():", "-", "+", "ab", "abc"]
+
+
+def random_line(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(0, 4)))
+
+
+def random_patch(rng: random.Random) -> str:
+    lines = []
+    start = 1
+    for _ in range(rng.randint(0, 4)):
+        start += rng.randint(0, 20)
+        lines.append(f"@@ -{start},3 +{start},3 @@" if rng.random() > 0.03 else "@@ malformed @@")
+        lines.extend(rng.choice("+- ") + random_line(rng) for _ in range(rng.randint(0, 8)))
+    return "\n".join(lines)
+
+
+def random_query(rng: random.Random, patch_lines: list[str]) -> str:
+    if not patch_lines or rng.random() < 0.4:
+        return rng.choice(["+", "+ ", "+" + random_line(rng), random_line(rng)])
+    line = rng.choice(patch_lines)
+    return rng.choice([line, line[1:], "+" + line[1:] + rng.choice(["", "x"]), line[2:-1]])
+
+
+def test_matches_reference_on_random_patches():
+    rng = random.Random(1)
+    for _ in range(3000):
+        patch = random_patch(rng)
+        diff_files = [FilePatchInfo("", "", patch, "a.py")]
+        for _ in range(5):
+            query = random_query(rng, patch.splitlines())
+            absolute_position = rng.choice([None, None, -1, rng.randint(-2, 60)])
+            expected = locate(reference_find_line_number_of_relevant_line_in_file, diff_files, "a.py", query,
+                              absolute_position)
+            assert locate(find_line_number_of_relevant_line_in_file, diff_files, "a.py", query,
+                          absolute_position) == expected, (patch, query, absolute_position)
+
+
+@pytest.mark.parametrize("patch, query, absolute_position", [
+    # empty lines are context lines of the new file
+    ("@@ -1,3 +1,4 @@\n a\n\n+b\n c", "c", None),
+    ("@@ -1,3 +1,4 @@\n a\n\n+b\n c", "", None),
+    ("@@ -1,3 +1,4 @@\n a\n\n+b\n c", "x", 3),
+    # '+'-only lines: an added empty line, and a model line that is just '+'
+    ("@@ -1,2 +1,3 @@\n a\n+\n b", "+", None),
+    ("@@ -1,2 +1,3 @@\n a\n+\n b", "+ b", None),
+    ("@@ -1,2 +1,2 @@\n-+\n+x", "+", None),
+    # malformed hunk headers, before and after the located line (the hunk headers have sizes here: the previous
+    # implementation also failed on headers without sizes, e.g. "@@ -1 +1 @@", which are now parsed)
+    ("@@ malformed @@\n+a\n@@ -5,1 +5,1 @@\n+b", "b", None),
+    ("@@ -1,1 +1,1 @@\n+a\n@@ malformed @@\n+b", "a", None),
+    ("@@ -1,1 +1,1 @@\n+a\n@@ malformed @@\n+b", "missing", None),
+    ("@@ -1,1 +1,1 @@\n+a\n@@ malformed @@\n+b", "", 1),
+    ("@@ -1,1 +1,1 @@\n+a\n@@ malformed @@\n+b", "", 7),
+])
+def test_matches_reference_on_edge_cases(patch, query, absolute_position):
+    diff_files = [FilePatchInfo("", "", patch, "a.py")]
+    assert locate(find_line_number_of_relevant_line_in_file, diff_files, "a.py", query, absolute_position) == \
+        locate(reference_find_line_number_of_relevant_line_in_file, diff_files, "a.py", query, absolute_position)
+
+
+def test_benchmark_large_patch():
+    # a 10000-line patch made of the sources of this repository, and 30 review findings on it
+    source_lines = []
+    for path in sorted(REPO_ROOT.glob("pr_agent/**/*.py")):
+        source_lines.extend(path.read_text(encoding="utf-8").splitlines())
+    source_lines = source_lines[:10000]
+    rng = random.Random(3)
+    patch_lines = [f"@@ -1,{len(source_lines)} +1,{len(source_lines)} @@"]
+    patch_lines += [rng.choice("+ -") + line for line in source_lines]
+    diff_files = [FilePatchInfo("", "", "\n".join(patch_lines), "large.py")]
+    queries = []
+    for _ in range(30):
+        line = rng.choice(patch_lines[1:])
+        queries.append(rng.choice([line, "+" + line[1:], line[1:].strip(), line[1:].strip()[:-2] + "xy"]))
+
+    start = time.perf_counter()
+    expected = [reference_find_line_number_of_relevant_line_in_file(diff_files, "large.py", query)
+                for query in queries]
+    reference_time = time.perf_counter() - start
+    start = time.perf_counter()
+    results = [find_line_number_of_relevant_line_in_file(diff_files, "large.py", query) for query in queries]
+    indexed_time = time.perf_counter() - start  # including the construction of the index
+
+    assert results == expected
+    # about 3 times faster, the bound leaves room for noisy runners
+    assert indexed_time < reference_time
+
+
+def test_many_similar_lines_fall_back_to_difflib():
+    # generated code, where every line shares most of its n-grams with the others
+    lines = [f"+    value_{i} = compute(item_{i % 97}, {i})" for i in range(2000)]
+    locator = PatchLineLocator("\n".join(["@@ -1,2000 +1,2000 @@"] + lines))
+    for i in range(0, 2000, 250):
+        word = lines[i][1:].strip()
+        assert locator.get_close_matches(word) == difflib.get_close_matches(word, locator.lines, n=3, cutoff=0.93)
@@ -0,0 +1,128 @@
+"""
+Accounting and eviction of the process-wide token count cache (TokenCountCache), and a benchmark of the repeated
+counts of a 200-file PR: the extended diff, the compressed diff and the full patch count the same patches again.
+"""
+
+import re
+import time
+
+import pytest
+
+from pr_agent.algo import token_handler as th
+from pr_agent.config_loader import get_settings
+
+
+class CountingEncoder:
+    """A deterministic BPE-like encoder that counts the texts it encodes"""
+    name = "counting"
+    _TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]| +|\s")
+
+    def __init__(self):
+        self.encoded_texts = 0
+
+    def encode(self, text, disallowed_special=()):
+        self.encoded_texts += 1
+        return self._TOKEN_RE.findall(text)
+
+    def encode_batch(self, texts, num_threads=8, disallowed_special=()):
+        return [self.encode(text) for text in texts]
+
+
+def make_text(i: int) -> str:
+    return f"@@ -1,20 +1,20 @@ def function_{i}():\n" + "".join(
+        f"+    value_{i}_{j} = compute(value_{i}_{j - 1}, '{j}')  # line {j}\n" for j in range(40))
+
+
+@pytest.fixture
+def token_handler(monkeypatch):
+    encoder = CountingEncoder()
+    monkeypatch.setattr(th.TokenEncoder, "_encoder_instance", encoder)
+    monkeypatch.setattr(th.TokenEncoder, "_model", get_settings().config.model)
+    monkeypatch.setattr(th._TokenCountCacheInstance, "instance", None)
+    previous = get_settings().get("config.token_count_cache_max_entries")
+    get_settings().set("config.token_count_cache_max_entries", 1000)
+    yield th.TokenHandler()
+    get_settings().set("config.token_count_cache_max_entries", previous)
+
+
+def test_hits_and_misses():
+    encoder = CountingEncoder()
+    cache = th.TokenCountCache(max_entries=10)
+    text = make_text(0)
+    count = len(encoder.encode(text))
+    encoder.encoded_texts = 0
+
+    assert cache.count_tokens(encoder, text) == count
+    assert cache.count_tokens(encoder, text) == count
+    assert cache.count_tokens_batch(encoder, [text, make_text(1), text], num_threads=1)[0::2] == [count, count]
+    assert encoder.encoded_texts == 2
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (3, 2, 2)
+    assert stats["hit_rate"] == 0.6
+
+    # short texts are encoded every time, and not accounted
+    cache.count_tokens(encoder, "short")
+    cache.count_tokens(encoder, "short")
+    assert encoder.encoded_texts == 4
+    assert cache.stats()["entries"] == 2
+
+
+def test_counts_are_keyed_by_encoder():
+    cache = th.TokenCountCache(max_entries=10)
+    encoder, other_encoder = CountingEncoder(), CountingEncoder()
+    other_encoder.name = "other"
+    cache.count_tokens(encoder, make_text(0))
+    cache.count_tokens(other_encoder, make_text(0))
+    assert cache.stats()["misses"] == 2
+
+
+def test_lru_eviction():
+    encoder = CountingEncoder()
+    cache = th.TokenCountCache(max_entries=2)
+    for i in (0, 1, 0, 2):  # the hit on text 0 makes text 1 the least recently used
+        cache.count_tokens(encoder, make_text(i))
+    assert encoder.encoded_texts == 3
+    cache.count_tokens(encoder, make_text(0))
+    assert encoder.encoded_texts == 3
+    cache.count_tokens(encoder, make_text(1))
+    assert encoder.encoded_texts == 4
+    assert cache.stats()["entries"] == 2
+
+
+def test_remember_token_count(token_handler):
+    text = make_text(0)
+    token_handler.remember_token_count(text, 123)
+    assert token_handler.count_tokens(text) == 123
+    assert token_handler.encoder.encoded_texts == 0
+    stats = th.get_token_count_cache().stats()
+    assert (stats["hits"], stats["misses"]) == (1, 0)
+
+
+def test_200_file_pr_counts_each_patch_once(token_handler):
+    # the extended diff counts the patches in a batch, then the compressed diff and the full patch count them again
+    patches = [make_text(i) for i in range(200)]
+    first_counts = token_handler.count_tokens_batch(patches)
+    for _ in range(2):
+        assert [token_handler.count_tokens(patch) for patch in patches] == first_counts
+
+    assert token_handler.encoder.encoded_texts == 200
+    stats = th.get_token_count_cache().stats()
+    assert (stats["hits"], stats["misses"]) == (400, 200)
+    assert stats["time_saved_sec"] > 0
+
+
+def test_benchmark_200_file_pr():
+    encoder = CountingEncoder()
+    cache = th.TokenCountCache(max_entries=1000)
+    patches = [make_text(i) for i in range(200)]
+
+    start = time.perf_counter()
+    cache.count_tokens_batch(encoder, patches, num_threads=1)
+    uncached_time = time.perf_counter() - start
+    start = time.perf_counter()
+    for patch in patches:
+        cache.count_tokens(encoder, patch)
+    cached_time = time.perf_counter() - start
+
+    # a hit hashes the text instead of encoding it (about 30 times faster with this encoder)
+    assert cached_time * 3 < uncached_time
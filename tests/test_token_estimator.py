@@ -0,0 +1,138 @@
+"""
+Accuracy of the calibrated token estimator on a fixture of patches (the sources of this repository), and the budget
+decisions of TokenHandler.count_tokens_batch_within_budget that rely on it.
+"""
+
+import re
+from pathlib import Path
+
+import pytest
+
+from pr_agent.algo import token_estimator as te
+from pr_agent.algo import token_handler as th
+from pr_agent.config_loader import get_settings
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+class RegexEncoder:
+    """A deterministic BPE-like encoder: words are split in chunks of 4 characters, punctuation is one token each"""
+    name = "regex"
+    _TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]| +|\s")
+
+    def __init__(self):
+        self.encoded_texts = 0
+
+    def encode(self, text, disallowed_special=()):
+        self.encoded_texts += 1
+        return self._TOKEN_RE.findall(text)
+
+    def encode_batch(self, texts, num_threads=8, disallowed_special=()):
+        return [self.encode(text) for text in texts]
+
+
+def load_o200k_encoder():
+    th.TokenEncoder.use_bundled_assets()
+    try:
+        return th.get_encoding("o200k_base")
+    except Exception as e:  # the BPE file is downloaded on first use
+        pytest.skip(f"o200k_base encoding is not available: {e}")
+
+
+def fixture_patches() -> list[tuple[str, str]]:
+    """(patch, language) pairs: the files of the repository, as added hunks of 50 lines"""
+    patches = []
+    for path in sorted(REPO_ROOT.glob("pr_agent/**/*")):
+        if path.suffix not in (".py", ".toml", ".md") or not path.is_file():
+            continue
+        lines = path.read_text(encoding="utf-8").splitlines()
+        for start in range(0, len(lines), 50):
+            hunk = lines[start:start + 50]
+            header = f"@@ -{start},0 +{start + 1},{len(hunk)} @@"
+            patches.append(("\n".join([header] + ["+" + line for line in hunk]), path.suffix))
+    return patches
+
+
+@pytest.fixture
+def token_estimator(monkeypatch):
+    estimator = te.TokenEstimator()
+    monkeypatch.setattr(te._TokenEstimatorInstance, "instance", estimator)
+    return estimator
+
+
+@pytest.fixture
+def settings():
+    settings = get_settings()
+    keys = ("config.use_token_estimator", "config.token_count_cache_max_entries")
+    previous = {key: settings.get(key) for key in keys}
+    settings.set("config.use_token_estimator", True)
+    settings.set("config.token_count_cache_max_entries", 0)
+    yield settings
+    for key, value in previous.items():
+        settings.set(key, value)
+
+
+@pytest.mark.parametrize("encoder_factory", [RegexEncoder, load_o200k_encoder], ids=["regex", "o200k_base"])
+def test_estimate_accuracy_on_fixture(token_estimator, encoder_factory):
+    encoder = encoder_factory()
+    patches = fixture_patches()
+    assert len(patches) > 200
+    training, evaluation = patches[::4], [patch for i, patch in enumerate(patches) if i % 4]
+    for patch, language in training:
+        token_estimator.observe(patch, encoder.name, language, len(encoder.encode(patch)))
+
+    errors = []
+    outside_band = 0
+    for patch, language in evaluation:
+        exact = len(encoder.encode(patch))
+        estimate, band = token_estimator.estimate(patch, encoder.name, language)
+        lower, upper = token_estimator.bounds(patch, encoder.name, language)
+        assert band is not None and lower <= estimate <= upper
+        errors.append(abs(estimate - exact) / exact)
+        outside_band += not lower <= exact <= upper
+    assert sum(errors) / len(errors) < 0.15
+    assert outside_band <= 0.02 * len(evaluation)
+
+
+def test_band_tightens_with_accurate_observations(token_estimator):
+    text = "def f(x):\n    return x + 1\n" * 20
+    raw = te.TokenEstimator.raw_estimate(text)
+    for _ in range(te.MIN_OBSERVATIONS):
+        token_estimator.observe(text, "enc", ".py", round(raw))
+    token_estimator.observe(text, "enc", ".py", round(raw * 1.5))  # an outlier widens the band
+    _, wide_band = token_estimator.estimate(text, "enc", ".py")
+    for _ in range(100):
+        token_estimator.observe(text, "enc", ".py", round(raw * token_estimator._calibrations["enc", ".py"].ratio))
+    _, band = token_estimator.estimate(text, "enc", ".py")
+    assert band < wide_band / 2
+
+
+def test_within_budget_skips_clear_decisions_and_samples_them(monkeypatch, settings, token_estimator):
+    encoder = RegexEncoder()
+    monkeypatch.setattr(th.TokenEncoder, "_encoder_instance", encoder)
+    monkeypatch.setattr(th.TokenEncoder, "_model", settings.config.model)
+    token_handler = th.TokenHandler()
+    patches = fixture_patches()[:200]
+    languages = [language for _, language in patches]
+    patches = [patch for patch, _ in patches]
+    exact_counts = [len(encoder.encode(patch)) for patch in patches]
+
+    # not calibrated yet: exact counts, which calibrate the estimator
+    assert token_handler.count_tokens_batch_within_budget(patches[:40], 10 ** 9, languages[:40]) == exact_counts[:40]
+
+    # clearly fits: upper bounds, with only a sample of the patches encoded
+    encoder.encoded_texts = 0
+    counts = token_handler.count_tokens_batch_within_budget(patches[40:], 10 ** 9, languages[40:])
+    assert encoder.encoded_texts == len(patches[40:]) // te.CALIBRATION_SAMPLE_INTERVAL
+    assert sum(counts) >= sum(exact_counts[40:])
+
+    # clearly exceeds: lower bounds, with only a sample of the patches encoded
+    encoder.encoded_texts = 0
+    counts = token_handler.count_tokens_batch_within_budget(patches[40:], 100, languages[40:])
+    assert encoder.encoded_texts == len(patches[40:]) // te.CALIBRATION_SAMPLE_INTERVAL
+    assert 100 < sum(counts) <= sum(exact_counts[40:])
+
+    # too close to decide: exact counts
+    budget = sum(exact_counts[40:])
+    assert token_handler.count_tokens_batch_within_budget(patches[40:], budget, languages[40:]) == exact_counts[40:]
+    assert token_estimator.stats()["exact_counts"] == 40 + 2 * 16 + 160